@@ -0,0 +1,124 @@
+import asyncio
+import socket
+import time
+import uuid
+from communication import *
+from framing import FrameDecoder
+from server import ChessServer
+from config import *
+
+class AsyncChessServer(ChessServer):
+    """Chess server that runs every connection on a single asyncio event loop"""
+
+    def start(self):
+        """Start the server"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Server shutting down...")
+        finally:
+            self.server_socket.close()
+
+    async def serve(self):
+        """Accept connections and run the game clocks until cancelled"""
+        # Reuse the socket bound in ChessServer.__init__
+        self.server_socket.setblocking(False)
+        self.loop = asyncio.get_running_loop()
+        self.start_metrics_endpoint()
+        self.install_profile_signal()
+        server = await asyncio.start_server(self.handle_connection, sock=self.server_socket)
+
+        # Game clocks are driven by the shared scheduler from a single task
+        clock_task = asyncio.create_task(self.run_clocks())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            clock_task.cancel()
+            self.close_journal()
+
+    async def handle_connection(self, reader, writer):
+        """Handle communication with a client"""
+        client_id = str(uuid.uuid4())
+        address = writer.get_extra_info("peername")
+        ready = asyncio.Event()
+        self.add_client(client_id, writer, address, wakeup=ready.set)
+        queue, traffic = self.client_queues[client_id], self.client_traffic[client_id]
+        writer_task = asyncio.create_task(self.write_client(client_id, writer, queue, traffic, ready))
+
+        # Moves are tiny packets, don't let Nagle hold them back
+        client_socket = writer.get_extra_info("socket")
+        if client_socket is not None:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        print(f"New connection from {address}, assigned ID: {client_id}")
+
+        try:
+            decoder = FrameDecoder()
+            while True:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break  # Client disconnected
+
+                traffic[0] += len(data)
+                decoder.feed(data)
+                self.process_frames(client_id, decoder)
+
+        except ConnectionError as e:
+            print(f"Error handling client {client_id}: {e}")
+        finally:
+            self.disconnect_client(client_id)
+            await writer_task
+
+    async def run_clocks(self):
+        """Sleep until the next clock timer is due and fire it"""
+        self.clock_event = asyncio.Event()
+        while True:
+            deadline = self.clock_scheduler.next_deadline()
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                await asyncio.wait_for(self.clock_event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.clock_event.clear()
+            self.update_games()
+
+    def wake_clock_scheduler(self):
+        """Let the clock task recompute how long to sleep"""
+        clock_event = getattr(self, "clock_event", None)
+        if clock_event is not None:
+            clock_event.set()
+
+    async def write_client(self, client_id, writer, queue, traffic, ready):
+        """Drain a client's outbound queue onto its transport"""
+        try:
+            while not queue.closed:
+                await ready.wait()
+                ready.clear()
+                frames = queue.take()
+                if frames:
+                    payload = b"".join(frames)
+                    writer.write(payload)
+                    traffic[1] += len(payload)
+                    # Wait out a slow reader here; meanwhile its queue absorbs (or overflows)
+                    await writer.drain()
+        except ConnectionError as e:
+            if not queue.closed:
+                print(f"Error sending message to client {client_id}: {e}")
+        finally:
+            self.disconnect_client(client_id)
+
+    def collect_metrics(self):
+        """Render the metrics on the event loop, which owns everything they read"""
+        async def render():
+            return self.metrics.render()
+        return asyncio.run_coroutine_threadsafe(render(), self.loop).result(timeout=5)
+
+    def close_connection(self, conn):
+        """Close a client's stream writer"""
+        # Abort rather than close: a client dropped for falling behind may never drain its buffer
+        conn.transport.abort()
+
+if __name__ == "__main__":
+    server = AsyncChessServer()
+    server.start()
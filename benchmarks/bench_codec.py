@@ -0,0 +1,73 @@
+"""Compare the JSON and binary wire codecs on the server's hottest messages.
+
+Run from the repository root:  python benchmarks/bench_codec.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from communication import *
+from framing import FrameDecoder
+
+GAME_ID = "6f1c2a9e-3b7d-4e0a-9c55-1d2e3f4a5b6c"
+WHITE_ID = "0a1b2c3d-4e5f-4a6b-8c7d-9e0f1a2b3c4d"
+BLACK_ID = "f0e1d2c3-b4a5-4968-8776-655443322110"
+
+SAMPLES = {
+    MAKE_MOVE: {"move": "g1f3"},
+    TIME_UPDATE: {"white_time": 871.2345, "black_time": 889.9876},
+    GAME_DELTA: {
+        "game_id": GAME_ID,
+        "version": 5,
+        "move": "b8c6",
+        "white_time": 871.2345,
+        "black_time": 889.9876
+    },
+    GAME_STATE: {
+        "game_id": GAME_ID,
+        "version": 5,
+        "board_fen": "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+        "turn": "white",
+        "white_player": WHITE_ID,
+        "black_player": BLACK_ID,
+        "white_time": 871.2345,
+        "black_time": 889.9876,
+        "status": "active",
+        "check": False,
+        "last_move": "b8c6"
+    },
+}
+
+def measure(func, number):
+    """Return the best per-call time in microseconds"""
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+def main(number=20000):
+    encoder = BinaryCodec()
+    decoder = BinaryCodec()
+    
+    print(f"{'message':<12} {'json B':>7} {'bin B':>6} {'json enc us':>12} {'bin enc us':>11} "
+          f"{'json dec us':>12} {'bin dec us':>11}")
+    for msg_type, data in SAMPLES.items():
+        json_frame = create_message(msg_type, data) + b'\n'
+        
+        # Steady state: ids have already been interned on this connection
+        frames = FrameDecoder()
+        frames.feed(encoder.encode(msg_type, data))
+        for _, message in frames.frames():
+            decoder.decode(message)
+        binary_frame = encoder.encode(msg_type, data)
+        binary_body = binary_frame[BINARY_HEADER.size:]  # No INTERN frames in front any more
+        
+        json_encode = measure(lambda: create_message(msg_type, data) + b'\n', number)
+        binary_encode = measure(lambda: encoder.encode(msg_type, data), number)
+        json_decode = measure(lambda: parse_message(json_frame[:-1]), number)
+        binary_decode = measure(lambda: decoder.decode(binary_body), number)
+        
+        print(f"{msg_type:<12} {len(json_frame):>7} {len(binary_frame):>6} {json_encode:>12.2f} "
+              f"{binary_encode:>11.2f} {json_decode:>12.2f} {binary_decode:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Compare splitting bursts of frames with next_frame on a growing bytes buffer and with FrameDecoder.
+
+Each burst is a run of small MAKE_MOVE frames (half JSON, half binary) arriving as
+one large write, cut into 64 KiB reads. Splitting with next_frame copies the rest
+of the buffer for every frame, so its cost per frame grows with the burst. A single
+large frame arriving in 4 KiB reads is also timed: next_frame rescans and the buffer
+is copied again on every read, which is quadratic in the frame's size.
+
+Run from the repository root:  python benchmarks/bench_framing.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from communication import *
+from framing import FrameDecoder
+
+READ_SIZE = 65536
+
+def burst(frames):
+    """Return frames small frames alternating between the JSON and binary framings"""
+    codec = BinaryCodec()
+    parts = []
+    for i in range(frames):
+        move = {"move": "e2e4" if i % 4 < 2 else "e7e5"}
+        parts.append(codec.encode(MAKE_MOVE, move) if i % 2 else create_message(MAKE_MOVE, move) + b'\n')
+    return b"".join(parts)
+
+def large_frame(size):
+    """Return one JSON frame of about size bytes"""
+    return create_message(CHAT_HISTORY, {"messages": ["x" * 100] * (size // 104)}) + b'\n'
+
+def next_frame(buffer):
+    """Split the first complete frame off buffer, as communication.py once did.
+
+    Returns (is_binary, message, rest), or None if the frame is incomplete.
+    """
+    if not buffer:
+        return None
+    if buffer[0] == BINARY_MAGIC:
+        if len(buffer) < BINARY_HEADER.size:
+            return None
+        _, length = BINARY_HEADER.unpack_from(buffer)
+        end = BINARY_HEADER.size + length
+        if len(buffer) < end:
+            return None
+        return True, buffer[BINARY_HEADER.size:end], buffer[end:]
+
+    index = buffer.find(b'\n')
+    if index < 0:
+        return None
+    return False, buffer[:index], buffer[index + 1:]
+
+def reads(stream, read_size=READ_SIZE):
+    return [stream[i:i + read_size] for i in range(0, len(stream), read_size)]
+
+def split_bytes(chunks, buffer=b""):
+    """The loop the servers and client used before FrameDecoder"""
+    count = 0
+    for data in chunks:
+        buffer += data
+        while True:
+            frame = next_frame(buffer)
+            if frame is None:
+                break
+            _, _, buffer = frame
+            count += 1
+    return count
+
+def split_decoder(chunks, decoder):
+    """The same with a connection's long-lived FrameDecoder"""
+    count = 0
+    for data in chunks:
+        decoder.feed(data)
+        for _ in decoder.frames():
+            count += 1
+    return count
+
+def measure(func, frames, number=None):
+    """Return the best per-frame time in microseconds"""
+    assert func() == frames
+    number = number or max(1, 20000 // frames)
+    return min(timeit.repeat(func, number=number, repeat=5)) / number / frames * 1e6
+
+def main():
+    print(f"{'burst':>8} {'bytes':>9} {'bytes us/frame':>15} {'decoder us/frame':>17} {'speedup':>8}")
+    for frames in (10, 100, 1000, 10000, 50000):
+        chunks = reads(burst(frames))
+        decoder = FrameDecoder(read_size=READ_SIZE)
+        old = measure(lambda: split_bytes(chunks), frames)
+        new = measure(lambda: split_decoder(chunks, decoder), frames)
+        size = sum(len(chunk) for chunk in chunks)
+        print(f"{frames:>8} {size:>9} {old:>15.2f} {new:>17.2f} {old / new:>7.1f}x")
+
+    print()
+    print(f"{'frame':>9} {'reads':>6} {'bytes us/frame':>15} {'decoder us/frame':>17} {'speedup':>8}")
+    for size in (16384, 131072, 1048576 - 4096):
+        chunks = reads(large_frame(size), 4096)
+        decoder = FrameDecoder()
+        old = measure(lambda: split_bytes(chunks), 1, number=5)
+        new = measure(lambda: split_decoder(chunks, decoder), 1, number=5)
+        print(f"{size:>9} {len(chunks):>6} {old:>15.1f} {new:>17.1f} {old / new:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Report how many bytes an active game costs, to size hosts for a target number of games.
+
+Run from the repository root:  python benchmarks/bench_game_size.py [games] [moves per game]
+"""
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess
+from fixtures import random_games
+from game_logic import ChessGame
+from server import ChessServer
+
+TARGET_GAMES = 100000
+
+def traced_bytes():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+def measure(build, count):
+    """Return the bytes allocated per object by build(i), and the objects"""
+    before = traced_bytes()
+    objects = [build(i) for i in range(count)]
+    return (traced_bytes() - before) / count, objects
+
+def main(game_count=2000, moves_per_game=40):
+    sequences = random_games(50, moves_per_game, in_progress=True)
+
+    def play(game, moves):
+        for move in moves:
+            player = game.white_player if game.white_to_move() else game.black_player
+            game.make_move(move, player)
+
+    def populate(game, i):
+        play(game, sequences[i % len(sequences)])
+        for n in range(3):
+            game.add_spectator(f"spectator-{i}-{n}")
+        for n in range(20):
+            game.add_chat_message(f"white-{i}", f"message {n}")
+
+    def build_game(i):
+        game = ChessGame(f"game-{i}", f"white-{i}", f"black-{i}")
+        populate(game, i)
+        return game
+
+    def build_board(i):
+        # What every game used to hold: a board with its full move and undo stacks
+        board = chess.Board()
+        for move in sequences[i % len(sequences)]:
+            board.push_uci(move)
+        return board
+
+    tracemalloc.start()
+    game_bytes, games = measure(build_game, game_count)
+    before = traced_bytes()
+    for game in games:
+        game.release_board()
+    released_bytes = game_bytes - (before - traced_bytes()) / game_count
+    del games
+    stacked_bytes, boards = measure(build_board, game_count)
+    del boards
+
+    server = ChessServer(listen=False, journal_path=None, archive_path=None)
+
+    def build_server_game(i):
+        white, black = f"white-{i}", f"black-{i}"
+        server.clients[white] = (None, None, white)
+        server.clients[black] = (None, None, black)
+        server.start_game(f"game-{i}", white, black)
+        populate(server.games[f"game-{i}"], i)
+
+    sys.stdout = open(os.devnull, "w")  # start_game prints every match
+    try:
+        server_bytes, _ = measure(build_server_game, game_count)
+    finally:
+        sys.stdout = sys.__stdout__
+    tracemalloc.stop()
+
+    print(f"{game_count} games of {moves_per_game} plies, 3 spectators and 20 chat messages each")
+    print(f"ChessGame:                      {game_bytes:>8.0f} bytes/game")
+    print(f"  after release_board():        {released_bytes:>8.0f} bytes/game")
+    print(f"  (chess.Board with move stack: {stacked_bytes:>8.0f} bytes/game)")
+    print(f"in a server (timers, directory, client maps): {server_bytes:>8.0f} bytes/game")
+    print(f"=> {TARGET_GAMES} concurrent games need about {server_bytes * TARGET_GAMES / 2**20:.0f} MiB")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,59 @@
+"""Measure the move journal's write throughput and how long recovery takes.
+
+Run from the repository root:  python benchmarks/bench_journal.py [games] [moves per game]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixtures import random_games
+from journal import *
+from server import ChessServer
+
+def main(game_count=10000, moves_per_game=40):
+    # A small pool of real games, reused so setup doesn't dominate the run
+    sequences = random_games(100, moves_per_game, in_progress=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.journal")
+        journal = GameJournal(path)
+
+        records = 0
+        start = time.perf_counter()
+        for i in range(game_count):
+            game_id = f"game-{i}"
+            journal.append(GAME_CREATED, game_id, white=f"w{i}", black=f"b{i}", time_limit=900)
+            records += 1
+        # Interleave games the way a busy server does: one move per game per round
+        for ply in range(moves_per_game):
+            for i in range(game_count):
+                moves = sequences[i % len(sequences)]
+                if ply < len(moves):
+                    journal.append(MOVE_MADE, f"game-{i}", move=moves[ply],
+                                   white_time=900 - ply, black_time=900 - ply)
+                    records += 1
+        append_time = time.perf_counter() - start
+        journal.close()
+        total_time = time.perf_counter() - start
+
+        size = os.path.getsize(path)
+        print(f"journaled {records} records ({size / 1e6:.1f} MB) for {game_count} games")
+        print(f"append: {append_time / records * 1e6:.2f} us/record on the move path")
+        print(f"durable throughput: {records / total_time:,.0f} records/s including fsync")
+
+        start = time.perf_counter()
+        games = replay_journal(path)
+        replay_time = time.perf_counter() - start
+        print(f"replay: {len(games)} games parsed in {replay_time:.2f}s")
+
+        start = time.perf_counter()
+        server = ChessServer(listen=False, journal_path=path)
+        recovery_time = time.perf_counter() - start
+        print(f"recovery: {len(server.games)} games rebuilt, scheduled and compacted in {recovery_time:.2f}s")
+        server.journal.close()
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
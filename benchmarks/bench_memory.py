@@ -0,0 +1,42 @@
+"""Churn through many short games and check that memory stays flat once they are evicted.
+
+Run from the repository root:  python benchmarks/bench_memory.py [rounds] [games per round]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from server import ChessServer
+from config import *
+
+FOOLS_MATE = ["f2f3", "e7e5", "g2g4", "d8h4"]
+
+def play_round(server, round_number, game_count):
+    """Start game_count games, chat a little in each and finish them all"""
+    for i in range(game_count):
+        white, black = f"w{round_number}-{i}", f"b{round_number}-{i}"
+        server.clients[white] = (None, None, white)
+        server.clients[black] = (None, None, black)
+        game_id = f"game-{round_number}-{i}"
+        server.start_game(game_id, white, black)
+        for n in range(10):
+            server.handle_message(white, "chat_message", {"message": f"message {n}"})
+        for ply, move in enumerate(FOOLS_MATE):
+            server.handle_message(black if ply % 2 else white, "make_move", {"move": move})
+        del server.clients[white], server.clients[black]
+
+def main(rounds=10, game_count=2000):
+    server = ChessServer(listen=False, journal_path=None, archive_path=None)
+    print(f"{'round':>5} {'rss MB':>8} {'live games':>10} {'archived':>9} {'cache':>6} {'timers':>7}")
+    for round_number in range(rounds):
+        play_round(server, round_number, game_count)
+        # Jump past the grace period so this round's games are evicted
+        server.update_games(time.monotonic() + GAME_ARCHIVE_GRACE + 1)
+        stats = server.memory_stats()
+        print(f"{round_number:>5} {stats['rss_bytes'] / 1e6:>8.1f} {stats['games']:>10} "
+              f"{stats['archived_games']:>9} {stats['archive_cache']:>6} {stats['timers']:>7}")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,46 @@
+"""Time ChessGame.make_move (validation plus game-end detection) and get_game_state per ply.
+
+Run from the repository root:  python benchmarks/bench_moves.py [games]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixtures import random_games
+from game_logic import ChessGame
+
+def replay(sequences):
+    """Play every sequence through ChessGame, returning per-ply seconds for each step"""
+    timings = [0.0, 0.0, 0.0]  # make_move, first get_game_state, repeated get_game_state
+    plies = 0
+    clock = time.perf_counter
+    for i, moves in enumerate(sequences):
+        game = ChessGame(f"game-{i}", "white", "black")
+        for move in moves:
+            start = clock()
+            success, _ = game.make_move(move, "white" if game.white_to_move() else "black")
+            moved = clock()
+            game.get_game_state()
+            first = clock()
+            game.get_game_state()  # e.g. a spectator joining, or GAME_OVER after the delta
+            timings[0] += moved - start
+            timings[1] += first - moved
+            timings[2] += clock() - first
+            assert success
+        plies += len(moves)
+    return [total / plies for total in timings]
+
+def main(game_count=300):
+    sequences = random_games(game_count)
+    runs = [replay(sequences) for _ in range(5)]
+    move_time, state_time, repeat_time = (min(run[i] for run in runs) for i in range(3))
+
+    print(f"{game_count} random games, {sum(map(len, sequences))} plies")
+    print(f"make_move:                {move_time * 1e6:6.1f} us/ply")
+    print(f"get_game_state:           {state_time * 1e6:6.1f} us (first call after a move)")
+    print(f"get_game_state again:     {repeat_time * 1e6:6.1f} us")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
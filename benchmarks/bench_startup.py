@@ -0,0 +1,68 @@
+"""Time client startup, from launching the process to the first drawn frame, with and without cached sprites.
+
+Each run is a fresh interpreter. Without a display, the Tk window is skipped and the run
+ends once the modules are imported and the piece sprites are loaded.
+
+Run from the repository root:  python benchmarks/bench_startup.py [runs]
+"""
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in the child process; prints the mode once the first frame is up
+CHILD = """
+import sys
+sys.path.insert(0, {root!r})
+import config
+config.SPRITE_CACHE_DIR = {cache_dir!r}
+import tkinter as tk
+try:
+    root = tk.Tk()
+except tk.TclError:
+    root = None
+if root is None:
+    import client
+    from sprites import load_sprites
+    load_sprites()
+    print("headless")
+else:
+    from client import ChessClient
+    ChessClient(root)
+    root.update()
+    print("window")
+    root.destroy()
+"""
+
+def launch(cache_dir):
+    """Return (seconds from launch to first frame, mode) for one client process"""
+    code = CHILD.format(root=ROOT, cache_dir=cache_dir)
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return time.perf_counter() - start, output.split()[-1]
+
+def main(runs=5):
+    cache_dir = tempfile.mkdtemp(prefix="chess-sprites-")
+    try:
+        cold, warm = [], []
+        for _ in range(runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            seconds, mode = launch(cache_dir)
+            cold.append(seconds)
+            seconds, mode = launch(cache_dir)
+            warm.append(seconds)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    print(f"Startup to first frame ({mode}), median of {runs} runs")
+    print(f"{'sprites':<18} {'ms':>8}")
+    print(f"{'rendered (cold)':<18} {statistics.median(cold) * 1000:>8.1f}")
+    print(f"{'cached sheet':<18} {statistics.median(warm) * 1000:>8.1f}")
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:2]))
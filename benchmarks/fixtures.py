@@ -0,0 +1,21 @@
+"""Inputs shared by the benchmarks"""
+import random
+
+import chess
+
+def random_games(count, length=80, seed=1, in_progress=False):
+    """Return count random move sequences (UCI strings), played to the end or length plies.
+
+    With in_progress, a game-ending last move is left out, so every game can still be moved in.
+    """
+    rng = random.Random(seed)
+    games = []
+    for _ in range(count):
+        board = chess.Board()
+        moves = []
+        while len(moves) < length and not board.is_game_over():
+            move = rng.choice(list(board.legal_moves))
+            board.push(move)
+            moves.append(move.uci())
+        games.append(moves[:-1] if in_progress and board.is_game_over() else moves)
+    return games
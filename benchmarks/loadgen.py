@@ -0,0 +1,303 @@
+"""Headless load generator: many bot players and spectators speaking the chess protocol.
+
+Start a server, then run from the repository root, e.g.:
+
+    python benchmarks/loadgen.py --players 1000 --spectators 200 --duration 60 --move-interval 0.5
+
+Players join the lobby, play random legal moves and chat; when a game ends they
+queue again. Spectators keep picking a listed game to watch. Every second a
+progress line is printed, and at the end move round-trip latency percentiles,
+message rates and connection failures.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess
+from communication import *
+from framing import FrameDecoder
+from config import *
+
+class Stats:
+    """Counters shared by every bot"""
+    def __init__(self):
+        self.latencies = []  # move round trips, seconds
+        self.sent = 0
+        self.received = 0
+        self.bytes_received = 0
+        self.connected = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.dropped = 0  # connections the server closed
+        self.errors = 0
+        self.games_started = 0
+        self.games_finished = 0
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return float("nan")
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Bot:
+    """One simulated client connection"""
+    def __init__(self, name, args, stats):
+        self.name = name
+        self.args = args
+        self.stats = stats
+        self.rng = random.Random(name)
+        self.reader = None
+        self.writer = None
+        self.codec = None
+
+    async def connect(self):
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.args.host, self.args.port)
+        except OSError:
+            self.stats.connect_failures += 1
+            return False
+        self.stats.connected += 1
+        return True
+
+    def send(self, msg_type, data):
+        if self.codec is not None:
+            frame = self.codec.encode(msg_type, data)
+        else:
+            frame = create_message(msg_type, data) + b'\n'
+        self.writer.write(frame)
+        self.stats.sent += 1
+
+    async def messages(self):
+        """Yield (msg_type, data) for every message from the server until it disconnects"""
+        decoder = FrameDecoder(read_size=65536)
+        while True:
+            data = await self.reader.read(65536)
+            if not data:
+                return
+            self.stats.bytes_received += len(data)
+            decoder.feed(data)
+            for is_binary, message in decoder.frames():
+                if is_binary and self.codec is not None:
+                    msg_type, data = self.codec.decode(message)
+                else:
+                    msg_type, data = parse_message(message)
+                self.stats.received += 1
+                if msg_type == CODEC_SELECTED:
+                    self.codec = BinaryCodec()
+                elif msg_type == ERROR:
+                    self.stats.errors += 1
+                if msg_type != INTERN:
+                    yield msg_type, data
+
+    def join_lobby(self):
+        self.send(JOIN_LOBBY, {
+            "player_name": self.name,
+            "codecs": [CODEC_BINARY] if self.args.binary else [],
+            "features": sorted(OPTIONAL_MESSAGES),
+            "time_control": self.args.time_control,
+            "rating": self.rng.randint(800, 2200)
+        })
+
+    async def run(self):
+        if not await self.connect():
+            return
+        try:
+            await self.play()
+            self.stats.dropped += 1
+        except ConnectionError:
+            self.stats.dropped += 1
+        finally:
+            self.stats.disconnects += 1
+            self.writer.close()
+
+class PlayerBot(Bot):
+    """Plays random legal moves at a configurable rate"""
+    def __init__(self, name, args, stats):
+        super().__init__(name, args, stats)
+        self.board = None
+        self.color = None
+        self.version = None
+        self.pending = None  # (move, send time) awaiting its GAME_DELTA
+        self.mover = None
+
+    async def play(self):
+        self.join_lobby()
+        async for msg_type, data in self.messages():
+            if msg_type == PLAYER_ASSIGNED:
+                self.color = chess.WHITE if data.get("color") == "white" else chess.BLACK
+                self.board = None
+                if data.get("color") == "white":
+                    self.stats.games_started += 1
+
+            elif msg_type == GAME_STATE:
+                self.board = chess.Board(data["board_fen"])
+                self.version = data.get("version")
+
+            elif msg_type == GAME_DELTA:
+                if self.board is None:
+                    continue
+                if self.version is None or data.get("version") != self.version + 1:
+                    self.send(REQUEST_STATE, {})
+                    continue
+                self.board.push_uci(data["move"])
+                self.version = data["version"]
+                if self.pending is not None and self.pending[0] == data["move"]:
+                    self.stats.latencies.append(time.perf_counter() - self.pending[1])
+                    self.pending = None
+
+            elif msg_type == GAME_OVER:
+                self.board = None
+                self.pending = None
+                if self.color == chess.WHITE:
+                    self.stats.games_finished += 1
+                # Queue for another game after a short break
+                await asyncio.sleep(self.rng.uniform(0, 1))
+                self.join_lobby()
+                continue
+
+            elif msg_type == ERROR and self.pending is not None:
+                self.pending = None  # e.g. a move raced a flag fall
+
+            self.maybe_move()
+
+    def maybe_move(self):
+        """Schedule a move if it is this bot's turn"""
+        if self.board is None or self.board.turn != self.color or self.pending is not None:
+            return
+        if self.mover is not None and not self.mover.done():
+            return
+        self.mover = asyncio.ensure_future(self.move_later(self.version))
+
+    async def move_later(self, version):
+        await asyncio.sleep(self.rng.uniform(0.5, 1.5) * self.args.move_interval)
+        if self.board is None or self.version != version or self.board.turn != self.color:
+            return
+        moves = list(self.board.legal_moves)
+        if not moves:
+            return
+        move = self.rng.choice(moves).uci()
+        self.pending = (move, time.perf_counter())
+        self.send(MAKE_MOVE, {"move": move})
+        if self.rng.random() < self.args.chat_rate:
+            self.send(CHAT_MESSAGE, {"message": f"{self.name} played {move}"})
+
+class SpectatorBot(Bot):
+    """Watches a random listed game, moving on to another one every so often.
+
+    The protocol has no message to stop spectating, so each game is watched over its own connection.
+    """
+    async def run(self):
+        while await self.connect():
+            try:
+                if not await self.watch_next():
+                    self.stats.dropped += 1
+                    return
+            except ConnectionError:
+                self.stats.dropped += 1
+                return
+            finally:
+                self.stats.disconnects += 1
+                self.writer.close()
+
+    async def watch_next(self):
+        """Watch one listed game for spectate_time, returning False if the server hung up first"""
+        messages = self.messages()
+        # No JOIN_LOBBY: that would enter the bot into matchmaking
+        self.send(LIST_GAMES, {"status": "active", "limit": 20})
+        async for msg_type, data in messages:
+            if msg_type == GAMES_LIST:
+                games = data.get("games") or []
+                if games:
+                    self.send(SPECTATE_GAME, {"game_id": self.rng.choice(games)["game_id"],
+                                              "features": sorted(OPTIONAL_MESSAGES)})
+                    break
+                asyncio.get_running_loop().call_later(1, self.send, LIST_GAMES, {"status": "active", "limit": 20})
+        else:
+            return False
+
+        try:
+            await asyncio.wait_for(self.follow(messages), self.args.spectate_time)
+        except asyncio.TimeoutError:
+            return True
+        return False
+
+    async def follow(self, messages):
+        async for _ in messages:
+            pass
+
+def raise_file_limit():
+    """Allow as many open sockets as the hard limit permits"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+async def report(stats, started, interval=1.0):
+    """Print a progress line every interval"""
+    last_sent = last_received = 0
+    while True:
+        await asyncio.sleep(interval)
+        print(f"{time.monotonic() - started:6.0f}s  conns {stats.connected - stats.disconnects:5d}  "
+              f"sent/s {(stats.sent - last_sent) / interval:8.0f}  recv/s {(stats.received - last_received) / interval:8.0f}  "
+              f"moves {len(stats.latencies):7d}  p50 {stats.percentile(0.5) * 1000:6.1f}ms  "
+              f"p99 {stats.percentile(0.99) * 1000:6.1f}ms  games {stats.games_started}")
+        last_sent, last_received = stats.sent, stats.received
+
+async def main(args):
+    raise_file_limit()
+    stats = Stats()
+    started = time.monotonic()
+    reporter = asyncio.ensure_future(report(stats, started))
+
+    bots = [PlayerBot(f"bot{i}", args, stats) for i in range(args.players)]
+    bots += [SpectatorBot(f"spectator{i}", args, stats) for i in range(args.spectators)]
+    tasks = []
+    for bot in bots:
+        tasks.append(asyncio.ensure_future(bot.run()))
+        await asyncio.sleep(1 / args.connect_rate)  # Ramp up rather than stampede the accept queue
+
+    await asyncio.sleep(max(0, args.duration - (time.monotonic() - started)))
+    elapsed = time.monotonic() - started
+    reporter.cancel()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    print()
+    print(f"connections: {stats.connected} opened, {stats.connect_failures} failed, "
+          f"{stats.dropped} dropped by the server")
+    print(f"messages:    {stats.sent / elapsed:.0f} sent/s, {stats.received / elapsed:.0f} received/s, "
+          f"{stats.bytes_received / elapsed / 1e6:.2f} MB/s received, {stats.errors} errors")
+    print(f"games:       {stats.games_started} started, {stats.games_finished} finished")
+    print(f"move RTT:    {len(stats.latencies)} moves, "
+          + "  ".join(f"p{q * 100:g} {stats.percentile(q) * 1000:.1f}ms" for q in (0.5, 0.9, 0.99, 0.999))
+          + f"  max {max(stats.latencies, default=float('nan')) * 1000:.1f}ms")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--players", type=int, default=100, help="bot players (paired up by the lobby)")
+    parser.add_argument("--spectators", type=int, default=0, help="bots that watch random games")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--move-interval", type=float, default=1.0, help="mean seconds a bot thinks per move")
+    parser.add_argument("--chat-rate", type=float, default=0.1, help="chance of a chat message with each move")
+    parser.add_argument("--time-control", type=int, default=DEFAULT_TIME_LIMIT, help="minutes per side")
+    parser.add_argument("--spectate-time", type=float, default=10, help="seconds before a spectator switches game")
+    parser.add_argument("--connect-rate", type=float, default=500, help="new connections per second")
+    parser.add_argument("--binary", action="store_true", help="negotiate the binary codec")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main(parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,214 @@
+"""Microbenchmarks for the protocol and game-logic hot paths, with a stored baseline.
+
+Run from the repository root:
+
+    python benchmarks/microbench.py                      # compare with benchmarks/baseline.json
+    python benchmarks/microbench.py --save-baseline      # record a new baseline
+    python benchmarks/microbench.py --output results.json --threshold 0.25
+
+Each case reports the best per-operation time over several repeats. Before
+comparing, times are scaled by a calibration loop timed once per run (the median
+of a few timings) in both runs, so a slower (or throttled) machine does not show
+up as a regression. Cases more than --threshold slower than the baseline are
+flagged and make the exit status 1.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import socket
+import statistics
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chess
+from communication import *
+from framing import FrameDecoder
+from game_logic import ChessGame
+from server import ChessServer
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+CALIBRATION_RUNS = 5
+
+GAME_ID = "6f1c2a9e-3b7d-4e0a-9c55-1d2e3f4a5b6c"
+OPENING = ["e2e4", "e7e5", "g1f3", "b8c6", "f1b5", "a7a6", "b5a4", "g8f6", "e1g1", "f8e7",
+           "f1e1", "b7b5", "a4b3", "d7d6", "c2c3", "e8g8", "h2h3", "c6b8", "d2d4", "b8d7"]
+
+def game_after(moves):
+    game = ChessGame(GAME_ID, "white", "black")
+    for move in moves:
+        game.make_move(move, "white" if game.white_to_move() else "black")
+    return game
+
+def bench_create_message():
+    state = game_after(OPENING).get_game_state()
+    return lambda: create_message(GAME_STATE, state)
+
+def bench_parse_message():
+    message = create_message(GAME_STATE, game_after(OPENING).get_game_state())
+    return lambda: parse_message(message)
+
+def bench_framing():
+    # One recv() worth of small frames, split the way the servers and client do
+    buffer = b"".join(create_message(MAKE_MOVE, {"move": move}) + b"\n" for move in OPENING * 5)
+    decoder = FrameDecoder()
+
+    def split():
+        decoder.feed(buffer)
+        for _ in decoder.frames():
+            pass
+    return split, len(OPENING) * 5
+
+def bench_make_move():
+    def play():
+        game = ChessGame(GAME_ID, "white", "black")
+        for move in OPENING:
+            game.make_move(move, "white" if game.white_to_move() else "black")
+    return play, len(OPENING)
+
+def bench_get_game_state():
+    game = game_after(OPENING)
+
+    def state():
+        game._fen = game._position = None  # Measure a fresh snapshot, not the per-ply caches
+        game.get_game_state()
+    return state
+
+def bench_broadcast(spectators):
+    """broadcast_to_game of a GAME_DELTA to spectators over socketpairs, including the socket writes"""
+    server = ChessServer(listen=False, journal_path=None, archive_path=None)
+    peers = []
+    for i in range(spectators + 2):
+        conn, peer = socket.socketpair()
+        peer.setblocking(False)
+        peers.append(peer)
+        server.add_client(f"client-{i}", conn, None)
+        server.client_features[f"client-{i}"] = OPTIONAL_MESSAGES
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        server.start_game(GAME_ID, "client-0", "client-1")
+    game = server.games[GAME_ID]
+    for i in range(spectators):
+        game.add_spectator(f"client-{i + 2}")
+    for move in OPENING[:4]:
+        game.make_move(move, "white" if game.white_to_move() else "black")
+    delta = game.get_state_delta()
+
+    def broadcast():
+        server.broadcast_to_game(GAME_ID, GAME_DELTA, delta)
+        for client_id, (conn, _, _) in server.clients.items():
+            frames = server.client_queues[client_id].take()
+            if frames:
+                conn.sendall(b"".join(frames))
+        for peer in peers:
+            try:
+                while peer.recv(65536):
+                    pass
+            except BlockingIOError:
+                pass
+    return broadcast
+
+CASES = {
+    "create_message.game_state": bench_create_message,
+    "parse_message.game_state": bench_parse_message,
+    "framing.per_frame": bench_framing,
+    "make_move.per_ply": bench_make_move,
+    "get_game_state": bench_get_game_state,
+    "broadcast.1_spectator": lambda: bench_broadcast(1),
+    "broadcast.10_spectators": lambda: bench_broadcast(10),
+    "broadcast.1000_spectators": lambda: bench_broadcast(1000),
+}
+
+def raise_file_limit(needed):
+    """The 1000-spectator case needs about two thousand descriptors"""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+def calibration_loop():
+    """A fixed pure-Python workload, to factor out how fast the machine is running today"""
+    total = 0
+    for i in range(1000):
+        total += i * i % 7
+    return total
+
+def calibrate(repeat):
+    """Time the calibration loop a few times, returning the median in microseconds"""
+    return statistics.median(run_case(lambda: calibration_loop, repeat) for _ in range(CALIBRATION_RUNS))
+
+def run_case(build, repeat, min_time=0.5):
+    """Return the best time per operation in microseconds"""
+    built = build()
+    func, ops = built if isinstance(built, tuple) else (built, 1)
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=repeat, number=number)) / number / ops * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.5, help="slowdown that counts as a regression")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("cases", nargs="*", help="run only these cases")
+    args = parser.parse_args()
+
+    raise_file_limit(4096)
+    baseline = {}
+    baseline_calibration = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as baseline_file:
+            saved = json.load(baseline_file)
+        baseline = saved["results"]
+        baseline_calibration = saved.get("calibration")
+
+    # One factor for the whole run, so every case is scaled alike
+    calibration = calibrate(args.repeat)
+    scale = baseline_calibration / calibration if baseline_calibration else 1
+    print(f"calibration {calibration:.2f} us" + (f" (baseline {baseline_calibration:.2f} us)" if baseline_calibration else ""))
+
+    results = {}
+    regressions = []
+    print(f"{'case':<28} {'us/op':>10} {'baseline':>10} {'change':>8}")
+    for name, build in CASES.items():
+        if args.cases and name not in args.cases:
+            continue
+        results[name] = run_case(build, args.repeat)
+        line = f"{name:<28} {results[name]:>10.2f}"
+        if name in baseline:
+            change = results[name] * scale / baseline[name] - 1
+            line += f" {baseline[name]:>10.2f} {change:>+7.0%}"
+            if change > args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+
+    report = {
+        "python": platform.python_version(),
+        "chess": chess.__version__,
+        "machine": platform.machine(),
+        "calibration": calibration,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+from config import CHAT_RATE, CHAT_BURST, CHAT_PAGE_SIZE
+
+class TokenBucket:
+    """Allows bursts of up to burst messages, refilled at rate messages per second"""
+    __slots__ = ("tokens", "updated", "warned")
+
+    def __init__(self, now):
+        self.tokens = CHAT_BURST
+        self.updated = now
+        self.warned = False  # the sender has been told it is over the limit since its last accepted message
+
+    def take(self, now):
+        self.tokens = min(CHAT_BURST, self.tokens + (now - self.updated) * CHAT_RATE)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        self.warned = False
+        return True
+
+class ChatLimiter:
+    """Per-sender token buckets for chat messages"""
+    def __init__(self):
+        self.buckets = {}  # {client_id: TokenBucket}
+        self.prune_at = 1024
+
+    def allow(self, client_id, now):
+        """Return (allowed, warn): warn is set on the first refusal of a run of them"""
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            if len(self.buckets) >= self.prune_at:
+                self.prune(now)
+            bucket = self.buckets[client_id] = TokenBucket(now)
+        if bucket.take(now):
+            return True, False
+        warn = not bucket.warned
+        bucket.warned = True
+        return False, warn
+
+    def prune(self, now):
+        """Drop the buckets that have refilled; a new one starts full too"""
+        idle = CHAT_BURST / CHAT_RATE
+        self.buckets = {client_id: bucket for client_id, bucket in self.buckets.items()
+                        if now - bucket.updated < idle}
+        self.prune_at = max(1024, 2 * len(self.buckets))
+
+    def forget(self, client_id):
+        self.buckets.pop(client_id, None)
+
+def chat_entry(record):
+    """Return the wire form of a (chat id, sender, message, timestamp) history record"""
+    chat_id, sender, message, timestamp = record
+    return {"id": chat_id, "sender": sender, "message": message, "timestamp": timestamp}
+
+def history_page(history, before=None, limit=CHAT_PAGE_SIZE):
+    """Return (entries, has_more): up to limit of the newest records with ids below before, oldest first"""
+    page = []
+    for record in reversed(history):
+        if before is not None and record[0] >= before:
+            continue
+        if len(page) == limit:
+            return [chat_entry(record) for record in reversed(page)], True
+        page.append(record)
+    return [chat_entry(record) for record in reversed(page)], False
@@ -1,15 +1,34 @@
+import collections
 import socket
 import threading
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import ImageTk
 import chess
 import time
 import io
 import os
 from communication import *
+from framing import FrameDecoder
+from sprites import load_sprites
 from config import *
 
+# Messages handled on the Tk thread by the UI pump
+UI_EVENTS = {PLAYER_ASSIGNED, GAME_STATE, GAME_DELTA, CHAT_MESSAGE, CHAT_BATCH, CHAT_HISTORY,
+             GAME_OVER, TIME_UPDATE, GAMES_LIST, SESSION_RESUMED, ERROR}
+
+# Chat never touches the board, so it does not stop events around it being merged
+CHAT_EVENTS = {CHAT_MESSAGE, CHAT_BATCH, CHAT_HISTORY}
+
+# Events made redundant by a later one in the same pump batch: a snapshot replaces the
+# deltas and clocks before it, and a delta or clock update replaces earlier clocks.
+# Messages missing from this table and CHAT_EVENTS are never merged across.
+SUPERSEDES = {
+    GAME_STATE: (GAME_STATE, GAME_DELTA, TIME_UPDATE),
+    GAME_DELTA: (TIME_UPDATE,),
+    TIME_UPDATE: (TIME_UPDATE,)
+}
+
 class ChessClient:
     def __init__(self, master):
         self.master = master
@@ -23,72 +42,78 @@ class ChessClient:
         self.player_name = None
         self.player_color = None
         self.game_id = None
-        self.buffer = b""
+        self.decoder = FrameDecoder()
+        self.codec = None  # BinaryCodec once the server selects the binary format
+        
+        # Session resumption after a dropped connection
+        self.server_address = None
+        self.session_token = None  # from the server's SESSION message
+        self.resume_grace = RESUME_GRACE
+        self.last_seq = 0  # seq of the last game event applied
+        self.status_before_reconnect = None
         
         # Game state variables
         self.board = chess.Board()
+        self.last_move = None
+        self.state_version = None  # version of the last GAME_STATE/GAME_DELTA applied
+        self.resync_pending = False
         self.status = "disconnected"  # disconnected, in_lobby, waiting, playing, spectating
         self.selected_square = None
         self.valid_moves = []
         self.white_time = DEFAULT_TIME_LIMIT * 60
         self.black_time = DEFAULT_TIME_LIMIT * 60
         
+        # The clocks are counted down locally from the last values the server sent
+        self.clock_anchor = None  # local monotonic time white_time/black_time were read at
+        self.clock_running = False  # whether the side to move's clock is running
+        self.clock_delays = collections.deque(maxlen=CLOCK_DELAY_SAMPLES)  # local time.time() - server_time
+        self.shown_clocks = None
+        
+        # Open "Select a Game" dialog, filled one LIST_GAMES page at a time
+        self.games_tree = None
+        self.games_next_cursor = None
+        self.games_page_requested = False
+        
         # Piece images cache
         self.piece_images = {}
+        
+        # Board canvas items, created once by update_board_display() and then updated in place
+        self.square_items = {}  # {square: rectangle item}
+        self.piece_items = {}   # {square: image item}
+        self.last_move_items = []
+        self.selection_item = None
+        self.move_dot_items = []
+        
+        # What the canvas currently shows, to diff each update against
+        self.drawn_flipped = None
+        self.drawn_pieces = {}  # {square: piece image key, or None for an empty square}
+        self.drawn_last_move = None
+        self.drawn_selection = None
+        self.drawn_targets = ()
         self.load_piece_images()
         
+        # Inbound events queued by the receive thread for the UI pump
+        self.ui_events = collections.deque()
+        self.ui_stats = collections.Counter()  # received, merged, dropped, batches
+        self.ui_stats_logged = time.monotonic()
+        self.board_dirty = False
+        self.chat_lines = []  # received this batch, inserted together
+        self.chat_game_id = None  # game whose chat is shown
+        self.chat_first_id = None  # ids of the oldest and newest chat entries shown
+        self.chat_last_id = None
+        
         # Setup UI
         self.create_widgets()
+        self.master.after(UI_PUMP_INTERVAL, self.pump_ui_events)
+        self.master.after(CLOCK_REDRAW_INTERVAL, self.tick_clocks)
         
         # Start in connection screen
         self.show_connection_screen()
     
     def load_piece_images(self):
-        """Load chess piece images"""
-        piece_chars = {
-            'p': '♟', 'n': '♞', 'b': '♝', 'r': '♜', 'q': '♛', 'k': '♚',
-            'P': '♙', 'N': '♘', 'B': '♗', 'R': '♖', 'Q': '♕', 'K': '♔'
-        }
-        
-        # Create empty images with Unicode chess symbols
-        size = SQUARE_SIZE - 10
-        background_colors = {"light": (240, 217, 181), "dark": (181, 136, 99)}
-        
-        for piece_code, unicode_char in piece_chars.items():
-            for bg in background_colors:
-                img = Image.new('RGB', (size, size), background_colors[bg])
-                draw = ImageDraw.Draw(img)
-                
-                # Try to load a font that supports Unicode chess symbols
-                try:
-                    # Look for fonts that usually have chess symbols
-                    font_options = ["DejaVuSans.ttf", "Arial Unicode.ttf", "segoeui.ttf", "seguisym.ttf"]
-                    font = None
-                    
-                    for font_name in font_options:
-                        try:
-                            font = ImageFont.truetype(font_name, size-10)
-                            break
-                        except IOError:
-                            continue
-                    
-                    if not font:
-                        # Use default font
-                        font = ImageFont.load_default()
-                        
-                    # Draw the chess piece character
-                    text_width, text_height = draw.textsize(unicode_char, font=font)
-                    position = ((size - text_width) // 2, (size - text_height) // 2 - 10)
-                    color = "white" if piece_code.islower() else "black"
-                    draw.text(position, unicode_char, fill=color, font=font)
-                    
-                except Exception as e:
-                    print(f"Error creating piece image: {e}")
-                    # Create fallback image with just the letter
-                    draw.text((size//2-10, size//2-10), piece_code, fill="red", font=ImageFont.load_default())
-                
-                # Store the image
-                self.piece_images[f"{piece_code}_{bg}"] = ImageTk.PhotoImage(img)
+        """Load chess piece images from the cached sprite sheet"""
+        for img_key, image in load_sprites().items():
+            self.piece_images[img_key] = ImageTk.PhotoImage(image)
     
     def create_widgets(self):
         """Create and setup all UI widgets"""
@@ -122,6 +147,11 @@ class ChessClient:
         self.turn_label = tk.Label(self.info_frame, text="Turn: -", font=("Arial", 10))
         self.turn_label.pack(anchor="w", pady=2)
         
+        # Enabled while the position allows a threefold-repetition or 50-move claim
+        self.claim_draw_button = tk.Button(self.info_frame, text="Claim Draw", command=self.claim_draw,
+                                           state=tk.DISABLED)
+        self.claim_draw_button.pack(anchor="w", pady=2)
+        
         # Timer display
         self.timer_frame = tk.Frame(self.control_frame)
         self.timer_frame.pack(fill=tk.X, pady=(0, PADDING))
@@ -136,8 +166,15 @@ class ChessClient:
         self.chat_frame = tk.Frame(self.control_frame)
         self.chat_frame.pack(fill=tk.BOTH, expand=True)
         
-        self.chat_label = tk.Label(self.chat_frame, text="Chat", font=("Arial", 12, "bold"))
-        self.chat_label.pack(anchor="w", pady=(0, 5))
+        self.chat_header = tk.Frame(self.chat_frame)
+        self.chat_header.pack(fill=tk.X, pady=(0, 5))
+        
+        self.chat_label = tk.Label(self.chat_header, text="Chat", font=("Arial", 12, "bold"))
+        self.chat_label.pack(side=tk.LEFT)
+        
+        self.chat_older_button = tk.Button(self.chat_header, text="Older messages", command=self.request_older_chat,
+                                           state=tk.DISABLED)
+        self.chat_older_button.pack(side=tk.RIGHT)
         
         self.chat_text = tk.Text(self.chat_frame, width=30, height=15)
         self.chat_text.pack(fill=tk.BOTH, expand=True)
@@ -219,14 +256,21 @@ class ChessClient:
             self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.client_socket.connect((host, port))
             self.connected = True
+            self.decoder = FrameDecoder()
+            self.codec = None
+            self.server_address = (host, port)
+            self.session_token = None
+            self.last_seq = 0
             
             # Start receiving thread
             receive_thread = threading.Thread(target=self.receive_messages)
             receive_thread.daemon = True
             receive_thread.start()
             
-            # Join lobby
-            self.send_message(JOIN_LOBBY, {"player_name": self.player_name})
+            # Join lobby, offering the binary wire format and the newer game and chat messages
+            codecs = [CODEC_BINARY] if ENABLE_BINARY_PROTOCOL else []
+            self.send_message(JOIN_LOBBY, {"player_name": self.player_name, "codecs": codecs,
+                                           "features": sorted(OPTIONAL_MESSAGES)})
             
             # Update UI
             self.status = "in_lobby"
@@ -259,27 +303,34 @@ class ChessClient:
             if not self.connected:
                 return
         
-        # First, request the list of active games from the server
-        self.send_message(LIST_GAMES, {})
+        # First, request the first page of active games from the server
+        self.send_message(LIST_GAMES, {"limit": GAMES_PAGE_SIZE})
         # Result will be handled in process_message
     
     def receive_messages(self):
-        """Receive and process messages from the server"""
+        """Receive and process messages from the server, resuming the session whenever the connection drops"""
+        while True:
+            self.read_connection()
+            if not self.reconnect():
+                break
+        
+        self.connected = False
+        self.status = "disconnected"
+        self.master.after(0, self.update_status)
+    
+    def read_connection(self):
+        """Process messages until the current connection closes"""
         self.client_socket.setblocking(True)
         
         try:
             while self.connected:
                 try:
-                    data = self.client_socket.recv(4096)
-                    if not data:
+                    if not self.decoder.recv_into(self.client_socket):
                         break  # Server closed the connection
                     
-                    self.buffer += data
-                    
                     # Process complete messages
-                    while b'\n' in self.buffer:
-                        message, self.buffer = self.buffer.split(b'\n', 1)
-                        self.process_message(message)
+                    for is_binary, message in self.decoder.frames():
+                        self.process_message(message, is_binary)
                         
                 except Exception as e:
                     print(f"Error receiving data: {e}")
@@ -289,47 +340,186 @@ class ChessClient:
             pass
         finally:
             self.connected = False
-            self.status = "disconnected"
-            self.master.after(0, self.update_status)
     
-    def process_message(self, message):
+    def reconnect(self):
+        """Open a new connection and resume the session on it, retrying until the server would have given up"""
+        if self.session_token is None:
+            return False
+        
+        self.master.after(0, self.show_reconnecting)
+        deadline = time.monotonic() + self.resume_grace
+        delay = RECONNECT_DELAY
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            try:
+                client_socket = socket.create_connection(self.server_address, timeout=RECONNECT_MAX_DELAY)
+            except OSError:
+                continue
+            
+            self.client_socket = client_socket
+            self.decoder = FrameDecoder()
+            self.codec = None
+            self.connected = True
+            
+            # The server replays whatever game events came after last_seq
+            codecs = [CODEC_BINARY] if ENABLE_BINARY_PROTOCOL else []
+            self.send_message(RESUME_SESSION, {"token": self.session_token, "seq": self.last_seq, "codecs": codecs,
+                                               "features": sorted(OPTIONAL_MESSAGES)})
+            return True
+        
+        self.session_token = None
+        return False
+    
+    def show_reconnecting(self):
+        self.status_before_reconnect = self.status_label.cget("text")
+        self.status_label.config(text="Status: Reconnecting...")
+    
+    def handle_session_resumed(self, data):
+        """Restore the status line, or give up if the server no longer knows the session"""
+        if data.get("resumed"):
+            if self.status_before_reconnect:
+                self.status_label.config(text=self.status_before_reconnect)
+            return
+        
+        # The receive thread sees the connection close and returns to the connection screen
+        self.session_token = None
+        self.close_socket()
+    
+    def close_socket(self):
+        try:
+            self.client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def process_message(self, message, is_binary=False):
         """Process a received message"""
         try:
-            msg_type, data = parse_message(message)
+            if is_binary and self.codec is not None:
+                msg_type, data = self.codec.decode(message)
+            else:
+                msg_type, data = parse_message(message)
             
-            # Update UI from main thread
+            # Game events are numbered; a resumed session can replay ones already seen
+            seq = data.get("seq") if isinstance(data, dict) else None
             if msg_type == PLAYER_ASSIGNED:
-                self.master.after(0, lambda: self.handle_player_assigned(data))
-            
-            elif msg_type == GAME_STATE:
-                self.master.after(0, lambda: self.handle_game_state(data))
-            
-            elif msg_type == CHAT_MESSAGE:
-                self.master.after(0, lambda: self.handle_chat_message(data))
-            
-            elif msg_type == GAME_OVER:
-                self.master.after(0, lambda: self.handle_game_over(data))
-            
-            elif msg_type == TIME_UPDATE:
-                self.master.after(0, lambda: self.handle_time_update(data))
+                self.last_seq = 0  # A new game numbers its events from the start
+            elif seq is not None:
+                if msg_type != GAME_STATE and seq <= self.last_seq:
+                    self.ui_stats["dropped"] += 1
+                    return
+                self.last_seq = seq  # A snapshot resets the position even if it goes back
             
-            elif msg_type == GAMES_LIST:
-                self.master.after(0, lambda: self.show_games_list_dialog(data.get("games", [])))
+            if msg_type == CODEC_SELECTED:
+                # Everything after the acknowledgement uses the selected codec
+                if data.get("codec") == CODEC_BINARY:
+                    self.codec = BinaryCodec()
             
-            elif msg_type == SPECTATOR_JOINED:
-                # Update spectator info if needed
-                pass
+            elif msg_type == SESSION:
+                self.session_token = data.get("token")
+                self.resume_grace = data.get("resume_grace", RESUME_GRACE)
             
-            elif msg_type == ERROR:
-                self.master.after(0, lambda: messagebox.showinfo("Error", data.get("message", "Unknown error")))
+            elif msg_type in UI_EVENTS:
+                # Applied by the UI pump on the main thread
+                if "server_time" in data:
+                    data["clock_anchor"] = self.clock_anchor_for(data["server_time"])
+                self.ui_events.append((msg_type, data))
                 
         except Exception as e:
             print(f"Error processing message: {e}")
             
+    def pump_ui_events(self):
+        """Apply the events queued by the receive thread, at most once per UI_PUMP_INTERVAL.
+
+        Events made redundant by a later one in the same batch are skipped, the board is
+        redrawn at most once and chat lines are inserted together.
+        """
+        self.master.after(UI_PUMP_INTERVAL, self.pump_ui_events)
+        if not self.ui_events:
+            return
+        
+        batch = []
+        live = {}  # {msg_type: indexes in batch of events a later one may supersede}
+        while self.ui_events:
+            msg_type, data = self.ui_events.popleft()
+            if msg_type in SUPERSEDES:
+                for superseded in SUPERSEDES[msg_type]:
+                    for index in live.pop(superseded, ()):
+                        batch[index] = None
+                        self.ui_stats["merged"] += 1
+                live.setdefault(msg_type, []).append(len(batch))
+            elif msg_type not in CHAT_EVENTS:
+                live.clear()  # e.g. PLAYER_ASSIGNED: nothing before it may be merged with what follows
+            batch.append((msg_type, data))
+        self.ui_stats["received"] += len(batch)
+        self.ui_stats["batches"] += 1
+        
+        handlers = {
+            PLAYER_ASSIGNED: self.handle_player_assigned,
+            GAME_STATE: self.handle_game_state,
+            GAME_DELTA: self.handle_game_delta,
+            CHAT_MESSAGE: self.handle_chat_message,
+            CHAT_BATCH: self.handle_chat_batch,
+            CHAT_HISTORY: self.handle_chat_history,
+            GAME_OVER: self.handle_game_over,
+            TIME_UPDATE: self.handle_time_update,
+            GAMES_LIST: self.handle_games_list,
+            SESSION_RESUMED: self.handle_session_resumed,
+            ERROR: self.handle_error
+        }
+        for event in batch:
+            if event is not None:
+                try:
+                    handlers[event[0]](event[1])
+                except Exception as e:
+                    print(f"Error applying {event[0]}: {e}")
+        
+        if self.board_dirty:
+            self.board_dirty = False
+            self.update_board_display()
+        if self.chat_lines:
+            self.flush_chat()
+        
+        now = time.monotonic()
+        if now - self.ui_stats_logged >= UI_STATS_LOG_INTERVAL and (self.ui_stats["merged"] or self.ui_stats["dropped"]):
+            self.ui_stats_logged = now
+            print(f"UI events: {dict(self.ui_stats)}")
+    
+    def handle_games_list(self, data):
+        """Open the games dialog with the first page, or append a later page to it"""
+        self.games_page_requested = False
+        self.games_next_cursor = data.get("next_cursor")
+        
+        if data.get("cursor") and self.games_tree is not None and self.games_tree.winfo_exists():
+            self.add_games_to_list(data.get("games", []))
+        elif not data.get("cursor"):
+            self.show_games_list_dialog(data.get("games", []))
+    
+    def request_more_games(self):
+        """Fetch the next page of the games list, if there is one"""
+        if self.games_next_cursor is not None and not self.games_page_requested:
+            self.games_page_requested = True
+            self.send_message(LIST_GAMES, {"cursor": self.games_next_cursor, "limit": GAMES_PAGE_SIZE})
+    
+    def add_games_to_list(self, games):
+        """Append games to the open games dialog"""
+        for game in games:
+            game_id = game["game_id"]
+            if self.games_tree.exists(game_id):
+                continue
+            short_id = f"{game_id[:8]}..."
+            self.games_tree.insert("", "end", iid=game_id, values=(
+                short_id,
+                game["white_player"],
+                game["black_player"],
+                game["status"],
+                game["spectator_count"]
+            ), tags=(game_id,))
+    
     def show_games_list_dialog(self, games):
         """Show a dialog with available games to spectate"""
         if not games:
-            messagebox.showinfo("No Games", "There are no active games to spectate at the moment.")
+            self.show_info("No Games", "There are no active games to spectate at the moment.")
             return
             
         # Create a dialog to display games
@@ -353,20 +543,18 @@ class ChessClient:
             tree.column(col, width=100)
         
         # Add games to the treeview
-        for i, game in enumerate(games):
-            game_id = game["game_id"]
-            short_id = f"{game_id[:8]}..."
-            tree.insert("", "end", iid=str(i), values=(
-                short_id,
-                game["white_player"],
-                game["black_player"],
-                game["status"],
-                game["spectator_count"]
-            ), tags=(game_id,))
+        self.games_tree = tree
+        self.add_games_to_list(games)
         
-        # Add scrollbar
+        # Add scrollbar; reaching the bottom of the list loads the next page
         scrollbar = ttk.Scrollbar(games_frame, orient=tk.VERTICAL, command=tree.yview)
-        tree.configure(yscrollcommand=scrollbar.set)
+        
+        def on_scroll(first, last):
+            scrollbar.set(first, last)
+            if float(last) >= 1.0:
+                self.request_more_games()
+        
+        tree.configure(yscrollcommand=on_scroll)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         
@@ -416,6 +604,10 @@ class ChessClient:
         cancel_button = tk.Button(button_frame, text="Cancel", command=games_dialog.destroy)
         cancel_button.pack(side=tk.RIGHT, padx=5)
         
+        # Add a button to load the next page explicitly
+        more_button = tk.Button(button_frame, text="More", command=self.request_more_games)
+        more_button.pack(side=tk.RIGHT, padx=5)
+        
         # Enable double-click to select
         tree.bind("<Double-1>", lambda e: on_select())
     
@@ -423,6 +615,7 @@ class ChessClient:
         """Handle player assignment from server"""
         self.player_color = data.get("color")
         self.game_id = data.get("game_id")
+        self.state_version = None  # Wait for the new game's first snapshot
         
         if data.get("status") == "waiting":
             self.status = "waiting"
@@ -435,9 +628,14 @@ class ChessClient:
         """Update game state from server data"""
         # Update board
         self.board = chess.Board(data.get("board_fen"))
+        self.last_move = chess.Move.from_uci(data["last_move"]) if data.get("last_move") else None
+        self.state_version = data.get("version")
+        self.resync_pending = False
+        if data.get("game_id") != self.chat_game_id:
+            self.reset_chat(data.get("game_id"))
         
         # Update UI elements
-        self.update_board_display()
+        self.board_dirty = True
         
         opponent = None
         if self.player_color == "white":
@@ -447,45 +645,193 @@ class ChessClient:
         else:  # Spectating
             self.opponent_label.config(text=f"White: {data.get('white_player', '-')} | Black: {data.get('black_player', '-')}")
         
+        self.update_game_info(data)
+    
+    def handle_game_delta(self, data):
+        """Apply an incremental update on top of the local board"""
+        version = data.get("version")
+        if self.state_version is not None and version is not None and version <= self.state_version:
+            self.ui_stats["dropped"] += 1
+            return  # Already applied (e.g. covered by a newer snapshot)
+        
+        move = chess.Move.from_uci(data["move"]) if data.get("move") else None
+        if self.state_version is None or version != self.state_version + 1 or \
+           move is None or move not in self.board.legal_moves:
+            # We missed an update; ask for a full snapshot once
+            if not self.resync_pending:
+                self.resync_pending = True
+                self.send_message(REQUEST_STATE, {"game_id": data.get("game_id")})
+            return
+        
+        self.board.push(move)
+        self.last_move = move
+        self.state_version = version
+        
+        # A move invalidates any piece selection
+        self.selected_square = None
+        self.valid_moves = []
+        self.board_dirty = True
+        
+        self.update_game_info({
+            "turn": "white" if self.board.turn == chess.WHITE else "black",
+            "check": self.board.is_check(),
+            "white_time": data.get("white_time"),
+            "black_time": data.get("black_time"),
+            "clock_anchor": data.get("clock_anchor"),
+            "status": data.get("status"),
+            "draw_claimable": data.get("draw_claimable")
+        })
+    
+    def update_game_info(self, data):
+        """Update turn, clocks and status from a state snapshot or delta"""
         self.turn_label.config(text=f"Turn: {data.get('turn', '-').capitalize()}")
         
         if data.get('check'):
             self.turn_label.config(text=f"Turn: {data.get('turn', '-').capitalize()} (CHECK)")
         
-        # Update timers
-        self.white_time = data.get("white_time", self.white_time)
-        self.black_time = data.get("black_time", self.black_time)
-        self.update_time_display()
+        # Update timers; only an active game's clock runs
+        if data.get("status") is not None:
+            self.clock_running = data["status"] == "active"
+        self.set_clocks(data.get("white_time"), data.get("black_time"), data.get("clock_anchor"))
         
         # Update status if game ended
         if data.get("status") == "completed":
             self.status = "game_over"
             self.status_label.config(text="Status: Game Over")
+        
+        can_claim = data.get("draw_claimable") and self.status == "playing"
+        self.claim_draw_button.config(state=tk.NORMAL if can_claim else tk.DISABLED)
+    
+    def claim_draw(self):
+        """Ask the server to end the game as a draw"""
+        if self.connected and self.status == "playing":
+            self.send_message(CLAIM_DRAW, {})
     
     def handle_chat_message(self, data):
         """Add a chat message to the chat window"""
+        chat_id = data.get("id")
+        if chat_id is not None:
+            if self.chat_last_id is not None and chat_id <= self.chat_last_id:
+                return  # Already shown, e.g. replayed after a reconnect or in the history page
+            self.chat_last_id = chat_id
+            if self.chat_first_id is None:
+                self.chat_first_id = chat_id
+        
         sender = data.get("sender", "Unknown")
         message = data.get("message", "")
         
+        self.chat_lines.append(f"{sender}: {message}\n")
+    
+    def handle_chat_batch(self, data):
+        """Add the chat messages the server batched together"""
+        for entry in data.get("messages", []):
+            self.handle_chat_message(entry)
+    
+    def handle_chat_history(self, data):
+        """Insert a page of older chat messages above the ones shown"""
+        if data.get("game_id") != self.chat_game_id:
+            return  # An answer for a game we have since left
+        
+        entries = [entry for entry in data.get("messages", [])
+                   if self.chat_first_id is None or entry.get("id", 0) < self.chat_first_id]
+        if entries:
+            self.chat_first_id = entries[0].get("id")
+            if self.chat_last_id is None:
+                self.chat_last_id = entries[-1].get("id")
+            lines = "".join(f"{entry.get('sender', 'Unknown')}: {entry.get('message', '')}\n" for entry in entries)
+            self.chat_text.config(state=tk.NORMAL)
+            self.chat_text.insert("1.0", lines)
+            self.chat_text.config(state=tk.DISABLED)
+        self.chat_older_button.config(state=tk.NORMAL if data.get("has_more") else tk.DISABLED)
+    
+    def reset_chat(self, game_id):
+        """Clear the chat window for a new game and fetch the game's latest messages"""
+        self.chat_game_id = game_id
+        self.chat_first_id = None
+        self.chat_last_id = None
+        self.chat_lines = []
+        self.chat_text.config(state=tk.NORMAL)
+        self.chat_text.delete("1.0", tk.END)
+        self.chat_text.config(state=tk.DISABLED)
+        self.chat_older_button.config(state=tk.DISABLED)
+        if game_id:
+            self.send_message(CHAT_HISTORY, {"game_id": game_id, "limit": CHAT_PAGE_SIZE})
+    
+    def request_older_chat(self):
+        """Ask for the page of chat messages before the oldest one shown"""
+        if self.connected and self.chat_game_id and self.chat_first_id is not None:
+            self.chat_older_button.config(state=tk.DISABLED)
+            self.send_message(CHAT_HISTORY, {"game_id": self.chat_game_id, "before": self.chat_first_id,
+                                             "limit": CHAT_PAGE_SIZE})
+    
+    def flush_chat(self):
+        """Insert the chat lines received since the last flush in one go"""
         self.chat_text.config(state=tk.NORMAL)
-        self.chat_text.insert(tk.END, f"{sender}: {message}\n")
+        self.chat_text.insert(tk.END, "".join(self.chat_lines))
         self.chat_text.see(tk.END)
         self.chat_text.config(state=tk.DISABLED)
+        self.chat_lines = []
     
     def handle_game_over(self, data):
         """Handle game over notification"""
         reason = data.get("reason", "Game Over")
+        if data.get("game_state"):
+            self.handle_game_state(data["game_state"])
         self.status = "game_over"
         self.status_label.config(text="Status: Game Over")
+        self.clock_running = False
         
-        messagebox.showinfo("Game Over", reason)
+        self.show_info("Game Over", reason)
+    
+    def handle_error(self, data):
+        self.show_info("Error", data.get("message", "Unknown error"))
+    
+    def show_info(self, title, message):
+        """Show a message box once the current UI pump batch has been applied"""
+        self.master.after_idle(lambda: messagebox.showinfo(title, message))
     
     def handle_time_update(self, data):
-        """Update time display"""
-        self.white_time = data.get("white_time", self.white_time)
-        self.black_time = data.get("black_time", self.black_time)
+        """Correct the local clocks with the server's"""
+        self.set_clocks(data.get("white_time"), data.get("black_time"), data.get("clock_anchor"))
+    
+    def clock_anchor_for(self, server_time):
+        """Return the local monotonic time at which the server read clocks stamped with server_time.
+
+        The quickest recent message gives the clock skew plus the minimum network delay;
+        a message slower than that (held in a queue on the way, say) is backdated by the
+        difference, so its clocks count down from when they were read.
+        """
+        received = time.monotonic()
+        delay = time.time() - server_time
+        self.clock_delays.append(delay)
+        return received - (delay - min(self.clock_delays))
+    
+    def set_clocks(self, white_time, black_time, anchor=None):
+        """Take new clock values, as of local monotonic time anchor (now if None)"""
+        if white_time is not None:
+            self.white_time = white_time
+        if black_time is not None:
+            self.black_time = black_time
+        self.clock_anchor = anchor if anchor is not None else time.monotonic()
         self.update_time_display()
     
+    def current_clocks(self):
+        """Return (white, black) time remaining now, counting down the side to move"""
+        white_time, black_time = self.white_time, self.black_time
+        if self.clock_running and self.clock_anchor is not None:
+            elapsed = time.monotonic() - self.clock_anchor
+            if self.board.turn == chess.WHITE:
+                white_time = max(0, white_time - elapsed)
+            else:
+                black_time = max(0, black_time - elapsed)
+        return white_time, black_time
+    
+    def tick_clocks(self):
+        """Redraw the running clock every CLOCK_REDRAW_INTERVAL ms"""
+        self.master.after(CLOCK_REDRAW_INTERVAL, self.tick_clocks)
+        if self.clock_running:
+            self.update_time_display()
+    
     def update_status(self):
         """Update status display based on current state"""
         if not self.connected:
@@ -495,135 +841,132 @@ class ChessClient:
     
     def update_time_display(self):
         """Update the time displays"""
-        white_mins = int(self.white_time // 60)
-        white_secs = int(self.white_time % 60)
-        black_mins = int(self.black_time // 60)
-        black_secs = int(self.black_time % 60)
-        
+        white_time, black_time = self.current_clocks()
+        white_mins = int(white_time // 60)
+        white_secs = int(white_time % 60)
+        black_mins = int(black_time // 60)
+        black_secs = int(black_time % 60)
+        
+        # Most ticks land within the same second; leave the labels alone then
+        shown = (white_mins, white_secs, black_mins, black_secs)
+        if shown == self.shown_clocks:
+            return
+        self.shown_clocks = shown
         self.white_time_label.config(text=f"White: {white_mins:02d}:{white_secs:02d}")
         self.black_time_label.config(text=f"Black: {black_mins:02d}:{black_secs:02d}")
     
     def update_board_display(self):
-        """Render the chess board on the canvas"""
-        # Get board orientation
+        """Bring the board canvas in line with the current position, selection and last move.
+
+        The canvas items are created once; each call only touches the squares whose piece
+        changed and the highlights that moved.
+        """
         flipped = self.player_color == "black"
-        
-        # Clear the canvas
-        self.board_canvas.delete("all")
-        
-        # Draw the chess board squares
-        for rank in range(8):
-            for file in range(8):
-                # Determine square color (alternating light/dark)
-                is_light = (rank + file) % 2 == 0
-                color = "#F0D9B5" if is_light else "#B58863"  # Light/dark square colors
-                
-                # Calculate square position based on board orientation
-                if flipped:
-                    x1 = (7 - file) * SQUARE_SIZE
-                    y1 = rank * SQUARE_SIZE
-                else:
-                    x1 = file * SQUARE_SIZE
-                    y1 = (7 - rank) * SQUARE_SIZE
-                    
-                x2 = x1 + SQUARE_SIZE
-                y2 = y1 + SQUARE_SIZE
-                
-                # Draw square
-                self.board_canvas.create_rectangle(x1, y1, x2, y2, fill=color, outline="")
-                
-                # Get piece at this square, if any
-                square = chess.square(file, rank)
-                piece = self.board.piece_at(square)
-                
-                if piece:
-                    # Get piece code (e.g., "P" for white pawn, "r" for black rook)
-                    piece_code = piece.symbol()
-                    
-                    # Determine background color of square where piece sits
-                    bg = "light" if is_light else "dark"
-                    
-                    # Draw piece on the square
-                    img_key = f"{piece_code}_{bg}"
-                    if img_key in self.piece_images:
-                        self.board_canvas.create_image(
-                            x1 + SQUARE_SIZE//2, 
-                            y1 + SQUARE_SIZE//2, 
-                            image=self.piece_images[img_key]
-                        )
-        
-        # Highlight the selected square, if any
-        if self.selected_square:
-            file_idx = chess.square_file(self.selected_square)
-            rank_idx = chess.square_rank(self.selected_square)
-            
-            # Adjust for flipped board
-            if flipped:
-                x = (7 - file_idx) * SQUARE_SIZE
-                y = rank_idx * SQUARE_SIZE
+        if not self.square_items:
+            self.create_board_items()
+        if flipped != self.drawn_flipped:
+            self.layout_board(flipped)
+        
+        # Re-image only the squares whose piece differs from what is drawn
+        pieces = self.board.piece_map()
+        for square, item in self.piece_items.items():
+            piece = pieces.get(square)
+            img_key = f"{piece.symbol()}_{self.square_shade(square)}" if piece else None
+            if img_key == self.drawn_pieces.get(square):
+                continue
+            self.drawn_pieces[square] = img_key
+            if img_key in self.piece_images:
+                self.board_canvas.itemconfigure(item, image=self.piece_images[img_key], state=tk.NORMAL)
             else:
-                x = file_idx * SQUARE_SIZE
-                y = (7 - rank_idx) * SQUARE_SIZE
-                
-            # Draw highlight rectangle
-            self.board_canvas.create_rectangle(
-                x, y, x + SQUARE_SIZE, y + SQUARE_SIZE,
-                outline="blue", width=3
-            )
-            
-            # Draw valid move indicators
-            for move in self.valid_moves:
-                target = move.to_square
-                target_file = chess.square_file(target)
-                target_rank = chess.square_rank(target)
-                
-                # Adjust for flipped board
-                if flipped:
-                    tx = (7 - target_file) * SQUARE_SIZE + SQUARE_SIZE//2
-                    ty = target_rank * SQUARE_SIZE + SQUARE_SIZE//2
-                else:
-                    tx = target_file * SQUARE_SIZE + SQUARE_SIZE//2
-                    ty = (7 - target_rank) * SQUARE_SIZE + SQUARE_SIZE//2
-                
-                # Draw circle for valid move
-                self.board_canvas.create_oval(
-                    tx - 5, ty - 5, tx + 5, ty + 5,
-                    fill="green", outline="darkgreen"
-                )
-                
+                self.board_canvas.itemconfigure(item, state=tk.HIDDEN)
+        
         # Highlight last move
-        if len(self.board.move_stack) > 0:
-            last_move = self.board.peek()
-            from_square = last_move.from_square
-            to_square = last_move.to_square
-            
-            # Get coordinates
-            from_file = chess.square_file(from_square)
-            from_rank = chess.square_rank(from_square)
-            to_file = chess.square_file(to_square)
-            to_rank = chess.square_rank(to_square)
-            
-            # Adjust for flipped board
-            if flipped:
-                from_x = (7 - from_file) * SQUARE_SIZE
-                from_y = from_rank * SQUARE_SIZE
-                to_x = (7 - to_file) * SQUARE_SIZE
-                to_y = to_rank * SQUARE_SIZE
-            else:
-                from_x = from_file * SQUARE_SIZE
-                from_y = (7 - from_rank) * SQUARE_SIZE
-                to_x = to_file * SQUARE_SIZE
-                to_y = (7 - to_rank) * SQUARE_SIZE
-            
-            # Highlight last move squares with semi-transparent yellow
-            self.board_canvas.create_rectangle(
-                from_x, from_y, from_x + SQUARE_SIZE, from_y + SQUARE_SIZE,
-                outline="yellow", width=2
-            )
-            self.board_canvas.create_rectangle(
-                to_x, to_y, to_x + SQUARE_SIZE, to_y + SQUARE_SIZE,
-                outline="yellow", width=2
-            )
+        last_move = None
+        if self.last_move is not None:
+            last_move = (self.last_move.from_square, self.last_move.to_square)
+        if last_move != self.drawn_last_move:
+            self.drawn_last_move = last_move
+            for index, item in enumerate(self.last_move_items):
+                self.place_highlight(item, last_move[index] if last_move else None)
+        
+        # Highlight the selected square and its valid moves, if any
+        selection = self.selected_square
+        targets = tuple(move.to_square for move in self.valid_moves) if selection is not None else ()
+        if selection != self.drawn_selection:
+            self.drawn_selection = selection
+            self.place_highlight(self.selection_item, selection)
+        if targets != self.drawn_targets:
+            self.drawn_targets = targets
+            self.place_move_dots(targets)
+    
+    def create_board_items(self):
+        """Create the canvas items for the squares, pieces and highlights, in stacking order"""
+        for square in chess.SQUARES:
+            color = "#F0D9B5" if self.square_shade(square) == "light" else "#B58863"  # Light/dark square colors
+            self.square_items[square] = self.board_canvas.create_rectangle(
+                0, 0, 0, 0, fill=color, outline="", tags=("square",))
+        for square in chess.SQUARES:
+            self.piece_items[square] = self.board_canvas.create_image(0, 0, state=tk.HIDDEN, tags=("piece",))
+        
+        # Highlight layers above the pieces, moved or hidden rather than redrawn
+        self.last_move_items = [
+            self.board_canvas.create_rectangle(0, 0, 0, 0, outline="yellow", width=2,
+                                               state=tk.HIDDEN, tags=("last_move",))
+            for _ in range(2)
+        ]
+        self.selection_item = self.board_canvas.create_rectangle(0, 0, 0, 0, outline="blue", width=3,
+                                                                 state=tk.HIDDEN, tags=("selection",))
+    
+    def layout_board(self, flipped):
+        """Move every item to its square for the board orientation"""
+        self.drawn_flipped = flipped
+        for square in chess.SQUARES:
+            x, y = self.square_origin(square)
+            self.board_canvas.coords(self.square_items[square], x, y, x + SQUARE_SIZE, y + SQUARE_SIZE)
+            self.board_canvas.coords(self.piece_items[square], x + SQUARE_SIZE//2, y + SQUARE_SIZE//2)
+        
+        # Highlights are placed by square; force them to be placed again
+        self.drawn_last_move = self.drawn_selection = False
+        self.drawn_targets = None
+    
+    def square_shade(self, square):
+        """Return "light" or "dark" for a square"""
+        return "light" if (chess.square_rank(square) + chess.square_file(square)) % 2 == 0 else "dark"
+    
+    def square_origin(self, square):
+        """Return the canvas coordinates of a square's top-left corner"""
+        file_idx = chess.square_file(square)
+        rank_idx = chess.square_rank(square)
+        
+        # Adjust for flipped board
+        if self.drawn_flipped:
+            return (7 - file_idx) * SQUARE_SIZE, rank_idx * SQUARE_SIZE
+        return file_idx * SQUARE_SIZE, (7 - rank_idx) * SQUARE_SIZE
+    
+    def place_highlight(self, item, square):
+        """Move a square outline onto a square, or hide it if square is None"""
+        if square is None:
+            self.board_canvas.itemconfigure(item, state=tk.HIDDEN)
+            return
+        x, y = self.square_origin(square)
+        self.board_canvas.coords(item, x, y, x + SQUARE_SIZE, y + SQUARE_SIZE)
+        self.board_canvas.itemconfigure(item, state=tk.NORMAL)
+    
+    def place_move_dots(self, targets):
+        """Show a valid-move dot on each target square, reusing the dot items of earlier selections"""
+        while len(self.move_dot_items) < len(targets):
+            self.move_dot_items.append(self.board_canvas.create_oval(
+                0, 0, 0, 0, fill="green", outline="darkgreen", state=tk.HIDDEN, tags=("move_dot",)))
+        
+        for index, item in enumerate(self.move_dot_items):
+            if index >= len(targets):
+                self.board_canvas.itemconfigure(item, state=tk.HIDDEN)
+                continue
+            x, y = self.square_origin(targets[index])
+            tx = x + SQUARE_SIZE//2
+            ty = y + SQUARE_SIZE//2
+            self.board_canvas.coords(item, tx - 5, ty - 5, tx + 5, ty + 5)
+            self.board_canvas.itemconfigure(item, state=tk.NORMAL)
     
     def on_board_click(self, event):
         """Handle clicks on the chess board"""
@@ -699,7 +1042,7 @@ class ChessClient:
         
         message = self.chat_entry.get()
         if message:
-            self.send_message(CHAT_MESSAGE, {"message": message})
+            self.send_message(CHAT_MESSAGE, {"message": message[:CHAT_MAX_LENGTH]})
             self.chat_entry.delete(0, tk.END)
     
     def send_message(self, msg_type, data):
@@ -708,12 +1051,14 @@ class ChessClient:
             return
         
         try:
-            message = create_message(msg_type, data)
-            self.client_socket.sendall(message + b'\n')
+            if self.codec is not None:
+                message = self.codec.encode(msg_type, data)
+            else:
+                message = create_message(msg_type, data) + b'\n'
+            self.client_socket.sendall(message)
         except Exception as e:
             print(f"Error sending message: {e}")
-            self.connected = False
-            self.update_status()
+            self.close_socket()  # The receive thread reconnects, or reports the disconnection
 
 if __name__ == "__main__":
     root = tk.Tk()
@@ -0,0 +1,62 @@
+import heapq
+import itertools
+
+# Timer kinds
+FLAG_FALL = "flag_fall"
+CLOCK_TICK = "clock_tick"
+LOBBY_WIDEN = "lobby_widen"
+JOURNAL_CLOCK = "journal_clock"
+EVICT_GAME = "evict_game"
+MEMORY_STATS = "memory_stats"
+METRICS_LOG = "metrics_log"
+SESSION_EXPIRY = "session_expiry"
+CHAT_FLUSH = "chat_flush"
+
+class ClockScheduler:
+    """Server-wide heap of timers keyed by (key, kind), e.g. a game's flag-fall deadline"""
+
+    def __init__(self):
+        self.heap = []     # [(deadline, seq, key, kind)]
+        self.pending = {}  # {(key, kind): seq of the live timer}
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def schedule(self, key, kind, deadline):
+        """Arm a timer, replacing any pending timer with the same key and kind"""
+        seq = next(self.counter)
+        self.pending[(key, kind)] = seq
+        heapq.heappush(self.heap, (deadline, seq, key, kind))
+
+        # Re-armed timers leave stale entries behind; rebuild once they dominate
+        if len(self.heap) > 2 * len(self.pending) + 64:
+            self.heap = [entry for entry in self.heap if self.pending.get((entry[2], entry[3])) == entry[1]]
+            heapq.heapify(self.heap)
+
+    def cancel(self, key, kind):
+        """Disarm a timer if it is pending"""
+        self.pending.pop((key, kind), None)
+
+    def is_scheduled(self, key, kind):
+        """Check whether a timer is pending"""
+        return (key, kind) in self.pending
+
+    def next_deadline(self):
+        """Return the deadline of the earliest pending timer, or None"""
+        while self.heap:
+            deadline, seq, key, kind = self.heap[0]
+            if self.pending.get((key, kind)) == seq:
+                return deadline
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self, now):
+        """Remove and return (key, kind, deadline) for every timer due at or before now"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, seq, key, kind = heapq.heappop(self.heap)
+            if self.pending.get((key, kind)) == seq:
+                del self.pending[(key, kind)]
+                due.append((key, kind, deadline))
+        return due
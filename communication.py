@@ -1,4 +1,6 @@
 import json
+import struct
+import itertools
 
 # Message types
 JOIN_LOBBY = "join_lobby"
@@ -14,6 +16,34 @@ ERROR = "error"
 LIST_GAMES = "list_games"
 GAMES_LIST = "games_list"
 SPECTATOR_JOINED = "spectator_joined"
+CODEC_SELECTED = "codec_selected"
+INTERN = "intern"
+GAME_DELTA = "game_delta"
+REQUEST_STATE = "request_state"
+CLAIM_DRAW = "claim_draw"
+PROFILE = "profile"
+PROFILE_STATUS = "profile_status"
+RELAY_SUBSCRIBE = "relay_subscribe"
+SESSION = "session"
+RESUME_SESSION = "resume_session"
+SESSION_RESUMED = "session_resumed"
+CHAT_BATCH = "chat_batch"
+CHAT_HISTORY = "chat_history"
+
+# Wire codecs. JSON is the default; clients list the codecs they support in
+# JOIN_LOBBY and the server answers with CODEC_SELECTED before switching.
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+
+# Messages that replace older ones. Clients list those they understand in the "features"
+# field of JOIN_LOBBY, SPECTATE_GAME, RELAY_SUBSCRIBE or RESUME_SESSION; anyone else gets
+# a GAME_STATE for every GAME_DELTA and a CHAT_MESSAGE for each line of a CHAT_BATCH.
+OPTIONAL_MESSAGES = frozenset({GAME_DELTA, CHAT_BATCH})
+
+def legacy_chat_messages(data):
+    """Split a CHAT_BATCH into the CHAT_MESSAGEs it replaces"""
+    extra = {"seq": data["seq"]} if "seq" in data else {}
+    return [(CHAT_MESSAGE, {**entry, **extra}) for entry in data["messages"]]
 
 def create_message(msg_type, data):
     """Create a message packet that can be sent over the socket"""
@@ -32,3 +62,256 @@ def parse_message(message):
     except Exception as e:
         print(f"Error parsing message: {e}")
         return ERROR, {"error": "Invalid message format"}
+
+# Binary framing: magic byte, u32 body length, then the body (u8 message code + payload).
+# JSON frames always start with '{', so both framings can share a connection.
+BINARY_MAGIC = 0xB7
+BINARY_HEADER = struct.Struct(">BI")
+
+# Message code 0 wraps a JSON-encoded message, for types without a packed layout
+JSON_ENVELOPE = 0
+MESSAGE_CODES = {
+    JOIN_LOBBY: 1, CREATE_GAME: 2, MAKE_MOVE: 3, GAME_STATE: 4, CHAT_MESSAGE: 5,
+    PLAYER_ASSIGNED: 6, GAME_OVER: 7, SPECTATE_GAME: 8, TIME_UPDATE: 9, ERROR: 10,
+    LIST_GAMES: 11, GAMES_LIST: 12, SPECTATOR_JOINED: 13, CODEC_SELECTED: 14, INTERN: 15,
+    GAME_DELTA: 16, REQUEST_STATE: 17, CLAIM_DRAW: 18, PROFILE: 19, PROFILE_STATUS: 20,
+    RELAY_SUBSCRIBE: 21, SESSION: 22, RESUME_SESSION: 23, SESSION_RESUMED: 24,
+    CHAT_BATCH: 25, CHAT_HISTORY: 26
+}
+MESSAGE_TYPES = {code: msg_type for msg_type, code in MESSAGE_CODES.items()}
+
+def message_label(msg_type):
+    """Return a client-supplied message type as a metric label, "unknown" if it is not a known type"""
+    if isinstance(msg_type, str) and msg_type in MESSAGE_CODES:
+        return msg_type
+    return "unknown"
+
+GAME_STATUSES = ["waiting", "active", "completed"]
+PROMOTION_PIECES = "nbrq"
+NO_MOVE = 0xFFFF
+NO_ID = 0
+NO_SEQ = 0  # game event sequence numbers start at 1
+NO_TIMESTAMP = 0
+
+MOVE_LAYOUT = struct.Struct(">H")
+CLOCKS_LAYOUT = struct.Struct(">IIIQ")
+GAME_STATE_LAYOUT = struct.Struct(">IIIIIIBBHB")
+GAME_DELTA_LAYOUT = struct.Struct(">IIHIIIQ")
+INTERN_LAYOUT = struct.Struct(">I")
+
+def pack_move(move_uci):
+    """Pack a UCI move such as 'e7e8q' into a 16-bit code"""
+    if move_uci is None:
+        return NO_MOVE
+    from_square = (ord(move_uci[0]) - ord('a')) + (int(move_uci[1]) - 1) * 8
+    to_square = (ord(move_uci[2]) - ord('a')) + (int(move_uci[3]) - 1) * 8
+    promotion = PROMOTION_PIECES.index(move_uci[4]) + 1 if len(move_uci) == 5 else 0
+    if len(move_uci) > 5 or not (0 <= from_square < 64 and 0 <= to_square < 64):
+        raise ValueError(f"Cannot pack move {move_uci!r}")
+    return (promotion << 12) | (from_square << 6) | to_square
+
+def unpack_move(code):
+    """Inverse of pack_move"""
+    if code == NO_MOVE:
+        return None
+    from_square = (code >> 6) & 0x3F
+    to_square = code & 0x3F
+    promotion = code >> 12
+    move_uci = (chr(ord('a') + from_square % 8) + str(from_square // 8 + 1) +
+                chr(ord('a') + to_square % 8) + str(to_square // 8 + 1))
+    if promotion:
+        move_uci += PROMOTION_PIECES[promotion - 1]
+    return move_uci
+
+def _pack_clock(seconds):
+    return max(0, round(seconds * 1000))
+
+def _pack_timestamp(seconds):
+    """Pack a time.time() value as milliseconds, NO_TIMESTAMP if there is none"""
+    return NO_TIMESTAMP if seconds is None else round(seconds * 1000)
+
+def _unpack_timestamp(data, millis):
+    if millis != NO_TIMESTAMP:
+        data["server_time"] = millis / 1000
+    return data
+
+def _extra_fields(data, packed_keys):
+    """JSON-encode any fields a packed layout does not cover"""
+    extra = {key: value for key, value in data.items() if key not in packed_keys}
+    return json.dumps(extra).encode() if extra else b""
+
+def _merge_extra_fields(data, payload):
+    if payload:
+        data.update(json.loads(bytes(payload).decode()))
+    return data
+
+class IdTable:
+    """Assigns small integer handles to game and player ids"""
+    def __init__(self):
+        self.handles = {}  # {id: handle}
+        self.values = {}   # {handle: id}
+        self.counter = itertools.count(1)
+    
+    def intern(self, value):
+        """Return the handle for an id, allocating one on first use"""
+        if value is None:
+            return NO_ID
+        handle = self.handles.get(value)
+        if handle is None:
+            handle = self.handles[value] = next(self.counter)
+            self.values[handle] = value
+        return handle
+    
+    def release(self, value):
+        """Forget an id's handle, returning it (None if it had none); handles are never reused"""
+        handle = self.handles.pop(value, None)
+        if handle is not None:
+            del self.values[handle]
+        return handle
+
+MOVE_KEYS = {"move"}
+CLOCK_KEYS = {"white_time", "black_time", "seq", "server_time"}
+GAME_STATE_KEYS = {"game_id", "version", "board_fen", "turn", "white_player", "black_player",
+                   "white_time", "black_time", "status", "check", "last_move"}
+GAME_DELTA_KEYS = {"game_id", "version", "move", "white_time", "black_time", "seq", "server_time"}
+
+def encode_binary_body(msg_type, data, ids):
+    """Encode a message body in the binary format.
+
+    Returns (body, handles) where handles are the interned ids the body refers to;
+    the peer must have seen an INTERN frame for each before it can decode the body.
+    Messages without a packed layout (or that don't fit it) fall back to a JSON envelope.
+    """
+    try:
+        if msg_type == MAKE_MOVE and data.keys() <= MOVE_KEYS:
+            body = MOVE_LAYOUT.pack(pack_move(data["move"]))
+            return bytes([MESSAGE_CODES[MAKE_MOVE]]) + body, ()
+        
+        if msg_type == TIME_UPDATE:
+            body = CLOCKS_LAYOUT.pack(_pack_clock(data["white_time"]), _pack_clock(data["black_time"]),
+                                      data.get("seq", NO_SEQ), _pack_timestamp(data.get("server_time")))
+            return bytes([MESSAGE_CODES[TIME_UPDATE]]) + body + _extra_fields(data, CLOCK_KEYS), ()
+        
+        if msg_type == GAME_STATE:
+            handles = (ids.intern(data["game_id"]), ids.intern(data["white_player"]), ids.intern(data["black_player"]))
+            fen = data["board_fen"].encode()
+            flags = (data["turn"] == "black") | (bool(data["check"]) << 1)
+            body = GAME_STATE_LAYOUT.pack(*handles, data["version"],
+                                          _pack_clock(data["white_time"]), _pack_clock(data["black_time"]),
+                                          GAME_STATUSES.index(data["status"]), flags,
+                                          pack_move(data["last_move"]), len(fen))
+            return bytes([MESSAGE_CODES[GAME_STATE]]) + body + fen + _extra_fields(data, GAME_STATE_KEYS), handles
+        
+        if msg_type == GAME_DELTA:
+            handles = (ids.intern(data["game_id"]),)
+            body = GAME_DELTA_LAYOUT.pack(handles[0], data["version"], pack_move(data["move"]),
+                                          _pack_clock(data["white_time"]), _pack_clock(data["black_time"]),
+                                          data.get("seq", NO_SEQ), _pack_timestamp(data.get("server_time")))
+            return bytes([MESSAGE_CODES[GAME_DELTA]]) + body + _extra_fields(data, GAME_DELTA_KEYS), handles
+    except (KeyError, ValueError, TypeError, struct.error):
+        pass
+    
+    return bytes([JSON_ENVELOPE]) + create_message(msg_type, data), ()
+
+def decode_binary_body(body, ids):
+    """Decode a binary message body, resolving handles through ids ({handle: id})"""
+    code = body[0]
+    payload = memoryview(body)[1:]
+    
+    if code == JSON_ENVELOPE:
+        return parse_message(bytes(payload))
+    
+    msg_type = MESSAGE_TYPES[code]
+    if msg_type == INTERN:
+        (handle,) = INTERN_LAYOUT.unpack_from(payload)
+        ids[handle] = bytes(payload[INTERN_LAYOUT.size:]).decode()
+        return INTERN, {"handle": handle, "id": ids[handle]}
+    
+    if msg_type == MAKE_MOVE:
+        (move,) = MOVE_LAYOUT.unpack_from(payload)
+        return MAKE_MOVE, {"move": unpack_move(move)}
+    
+    if msg_type == TIME_UPDATE:
+        white_time, black_time, seq, server_time = CLOCKS_LAYOUT.unpack_from(payload)
+        data = _unpack_timestamp({"white_time": white_time / 1000, "black_time": black_time / 1000}, server_time)
+        if seq != NO_SEQ:
+            data["seq"] = seq
+        return TIME_UPDATE, _merge_extra_fields(data, payload[CLOCKS_LAYOUT.size:])
+    
+    if msg_type == GAME_STATE:
+        (game, white, black, version, white_time, black_time,
+         status, flags, last_move, fen_length) = GAME_STATE_LAYOUT.unpack_from(payload)
+        fen_end = GAME_STATE_LAYOUT.size + fen_length
+        data = {
+            "game_id": ids.get(game),
+            "version": version,
+            "board_fen": bytes(payload[GAME_STATE_LAYOUT.size:fen_end]).decode(),
+            "turn": "black" if flags & 1 else "white",
+            "white_player": ids.get(white),
+            "black_player": ids.get(black),
+            "white_time": white_time / 1000,
+            "black_time": black_time / 1000,
+            "status": GAME_STATUSES[status],
+            "check": bool(flags & 2),
+            "last_move": unpack_move(last_move)
+        }
+        return GAME_STATE, _merge_extra_fields(data, payload[fen_end:])
+    
+    if msg_type == GAME_DELTA:
+        game, version, move, white_time, black_time, seq, server_time = GAME_DELTA_LAYOUT.unpack_from(payload)
+        data = _unpack_timestamp({
+            "game_id": ids.get(game),
+            "version": version,
+            "move": unpack_move(move),
+            "white_time": white_time / 1000,
+            "black_time": black_time / 1000
+        }, server_time)
+        if seq != NO_SEQ:
+            data["seq"] = seq
+        return GAME_DELTA, _merge_extra_fields(data, payload[GAME_DELTA_LAYOUT.size:])
+    
+    raise ValueError(f"No packed layout for message code {code}")
+
+def frame_binary(body):
+    """Prefix a binary body with its frame header"""
+    return BINARY_HEADER.pack(BINARY_MAGIC, len(body)) + body
+
+class BinaryCodec:
+    """Per-connection state of the binary wire format"""
+    def __init__(self, ids=None):
+        self.ids = ids if ids is not None else IdTable()
+        self.sent_handles = set()  # handles already defined to the peer
+        self.received_ids = {}     # {handle: id} defined by the peer
+    
+    def encode(self, msg_type, data):
+        """Encode a complete frame for a message"""
+        body, handles = encode_binary_body(msg_type, data, self.ids)
+        return self.frame(frame_binary(body), handles)
+    
+    def frame(self, framed_body, handles=()):
+        """Prepend INTERN frames for any handles the peer hasn't seen to an already framed body.
+
+        A broadcast frames its body once and shares it between every binary recipient.
+        """
+        frames = []
+        for handle in handles:
+            if handle != NO_ID and handle not in self.sent_handles:
+                self.sent_handles.add(handle)
+                value = self.ids.values[handle].encode()
+                frames.append(frame_binary(bytes([MESSAGE_CODES[INTERN]]) + INTERN_LAYOUT.pack(handle) + value))
+        if not frames:
+            return framed_body
+        frames.append(framed_body)
+        return b"".join(frames)
+    
+    def forget_sent_ids(self):
+        """Re-announce every id, e.g. after queued INTERN frames were discarded"""
+        self.sent_handles.clear()
+    
+    def decode(self, body):
+        """Decode a binary frame body"""
+        try:
+            return decode_binary_body(body, self.received_ids)
+        except Exception as e:
+            print(f"Error parsing message: {e}")
+            return ERROR, {"error": "Invalid message format"}
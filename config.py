@@ -6,6 +6,64 @@ SERVER_PORT = 5555
 DEFAULT_TIME_LIMIT = 15  # minutes
 MAX_PLAYERS_IN_LOBBY = 100
 MAX_GAMES = 50
+TIME_CONTROLS = [1, 3, 5, 10, 15, 30]  # minutes; the lobby pools players by these
+GAMES_PAGE_SIZE = 50  # games per LIST_GAMES page
+MAX_GAMES_PAGE_SIZE = 200
+
+# Chat
+CHAT_HISTORY_LIMIT = 100  # chat messages kept per game; older ones are dropped
+CHAT_PAGE_SIZE = 20  # messages per CHAT_HISTORY page
+CHAT_RATE = 1.0  # messages per second a sender's allowance refills at
+CHAT_BURST = 5  # messages a sender may send at once after a quiet spell
+CHAT_BATCH_WINDOW = 0.2  # seconds of a game's chat gathered into one CHAT_BATCH broadcast
+CHAT_MAX_LENGTH = 500  # characters; longer messages are cut
+
+# Matchmaking
+DEFAULT_RATING = 1200
+RATING_BAND_WIDTH = 200  # players in the same band are paired immediately
+MATCH_WIDEN_INTERVAL = 5  # seconds of waiting before accepting one band further away
+MAX_BAND_DISTANCE = 5
+TIME_UPDATE_INTERVAL = 30  # seconds between TIME_UPDATE resyncs of an active game; clients count down locally in between
+ENABLE_BINARY_PROTOCOL = True  # offer the binary codec to clients that ask for it
+OUTBOUND_QUEUE_LIMIT = 256  # frames buffered per connection before the overflow policy applies
+SHARD_COUNT = 0  # game worker processes for sharded_server.py; 0 means one per CPU core
+OUTBOUND_MAX_RESYNCS = 3  # overflows (each answered with a snapshot) before a slow client is dropped
+RECV_BUFFER_SIZE = 4096  # bytes read per recv; each connection's receive buffer starts this size
+MAX_FRAME_SIZE = 1 << 20  # bytes; a peer sending a longer frame is disconnected
+
+# Reconnection
+RESUME_GRACE = 30  # seconds a dropped player's seat is held for RESUME_SESSION before the game is forfeited
+REPLAY_BUFFER_SIZE = 32  # recent events kept per game for replay to a resuming client; older gaps get a snapshot
+RECONNECT_DELAY = 0.5  # seconds before a client's first reconnection attempt, doubling after each failure
+RECONNECT_MAX_DELAY = 4
+
+# Spectator relays (relay.py)
+RELAY_PORT = 5556  # where a relay accepts spectators; it subscribes to SERVER_HOST:SERVER_PORT by default
+RELAY_LIST_CACHE_TTL = 1.0  # seconds a relay reuses a GAMES_LIST or CHAT_HISTORY answer from upstream
+
+# Crash recovery
+JOURNAL_PATH = "games.journal"  # move journal replayed at startup; None disables it
+JOURNAL_FLUSH_INTERVAL = 0.05  # seconds of records committed with one fsync
+JOURNAL_CLOCK_INTERVAL = 10  # seconds between clock snapshots of an active game
+JOURNAL_COMPACT_BYTES = 64 * 1024 * 1024  # rewrite the journal with only live games beyond this size
+
+# Finished games
+GAME_ARCHIVE_GRACE = 60  # seconds a completed game stays in memory (e.g. for late REQUEST_STATE) after it is archived
+ARCHIVE_PATH = "games.pgn"  # finished games are appended here as PGN; None keeps only the in-memory cache
+ARCHIVE_CACHE_SIZE = 1000  # archived games kept in memory
+MEMORY_LOG_INTERVAL = 3600  # seconds between memory usage log lines; 0 disables them
+
+# Metrics
+METRICS_HOST = '127.0.0.1'  # the endpoint is meant for a local scraper only
+METRICS_PORT = 9555  # Prometheus text at http://METRICS_HOST:METRICS_PORT/metrics; None disables it
+METRICS_LOG_INTERVAL = 60  # seconds between metrics snapshot log lines; 0 disables them
+
+# Profiling
+ADMIN_TOKEN = None  # shared secret for admin messages such as PROFILE; None refuses them all
+PROFILE_DURATION = 30  # seconds a profiling window lasts unless stopped early
+PROFILE_SAMPLE_INTERVAL = 0.005  # seconds between stack samples while profiling
+PROFILE_SWITCH_INTERVAL = None  # seconds; GIL switch interval during a window (e.g. 0.0001), None leaves it alone
+PROFILE_DIR = "profiles"  # collapsed-stack output, one file per window
 
 # GUI settings
 BOARD_SIZE = 600
@@ -14,3 +72,8 @@ PADDING = 20
 CHAT_WIDTH = 300
 WINDOW_WIDTH = BOARD_SIZE + CHAT_WIDTH + PADDING * 3
 WINDOW_HEIGHT = BOARD_SIZE + PADDING * 2
+CLOCK_REDRAW_INTERVAL = 100  # milliseconds between redraws of the locally counted-down clock
+CLOCK_DELAY_SAMPLES = 32  # recent server timestamps the client compares to estimate message delay
+UI_PUMP_INTERVAL = 30  # milliseconds between client UI updates from network events
+UI_STATS_LOG_INTERVAL = 60  # seconds between client log lines counting merged and dropped events
+SPRITE_CACHE_DIR = "sprite_cache"  # rendered piece sprite sheets, reused by later launches; None disables the cache
@@ -0,0 +1,87 @@
+from communication import BINARY_MAGIC, BINARY_HEADER
+from config import MAX_FRAME_SIZE, RECV_BUFFER_SIZE
+
+class FrameDecoder:
+    """Splits a connection's byte stream into frames: newline-terminated JSON or length-prefixed binary.
+
+    Bytes are received straight into one reusable buffer and consumed by moving an
+    offset, and the newline search resumes where the last one stopped, so a burst of
+    frames costs time linear in its size however it is split across reads. A frame
+    longer than max_frame_size raises ConnectionError, which drops the connection.
+    """
+    __slots__ = ("buffer", "view", "start", "end", "scanned", "read_size", "max_frame_size")
+
+    def __init__(self, read_size=RECV_BUFFER_SIZE, max_frame_size=MAX_FRAME_SIZE):
+        self.buffer = bytearray(read_size)
+        self.view = memoryview(self.buffer)  # released while the buffer is resized
+        self.start = 0    # first byte not yet returned as a frame
+        self.end = 0      # end of the bytes received
+        self.scanned = 0  # if past start, the pending frame has no newline before this
+        self.read_size = read_size
+        self.max_frame_size = max_frame_size
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reserve(self, size):
+        """Make room for size more bytes after end"""
+        if self.start == self.end:
+            if len(self.buffer) > 16 * self.read_size:
+                self.view.release()
+                self.buffer = bytearray(self.read_size)  # Give back the room a large frame needed
+                self.view = memoryview(self.buffer)
+            self.start = self.end = self.scanned = 0
+        if len(self.buffer) - self.end >= size:
+            return
+
+        # Slide the partial frame to the front, then grow if that is not enough
+        pending = self.end - self.start
+        if self.start:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+            self.scanned -= self.start
+            self.start, self.end = 0, pending
+        if len(self.buffer) - self.end < size:
+            self.view.release()
+            self.buffer.extend(bytes(max(size, len(self.buffer))))
+            self.view = memoryview(self.buffer)
+
+    def recv_into(self, sock):
+        """Receive from a socket into the buffer, returning the byte count (0 once the peer has closed)"""
+        self.reserve(self.read_size)
+        count = sock.recv_into(self.view[self.end:])
+        self.end += count
+        return count
+
+    def feed(self, data):
+        """Append bytes already read, e.g. from an asyncio stream"""
+        self.reserve(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        """Yield (is_binary, message) for every complete frame received so far"""
+        buffer, view, end = self.buffer, self.view, self.end
+        start = self.start
+        while start < end:
+            if buffer[start] == BINARY_MAGIC:
+                if end - start < BINARY_HEADER.size:
+                    return
+                _, length = BINARY_HEADER.unpack_from(buffer, start)
+                if length > self.max_frame_size:
+                    raise ConnectionError(f"Frame of {length} bytes exceeds {self.max_frame_size}")
+                body = start + BINARY_HEADER.size
+                if end < body + length:
+                    return
+                start = self.start = body + length
+                yield True, view[body:start].tobytes()
+            else:
+                scanned = self.scanned
+                index = buffer.find(b'\n', scanned if scanned > start else start, end)
+                if index < 0:
+                    self.scanned = end
+                    if end - start > self.max_frame_size:
+                        raise ConnectionError(f"Frame exceeds {self.max_frame_size} bytes without a newline")
+                    return
+                message = view[start:index].tobytes()
+                start = self.start = index + 1
+                yield False, message
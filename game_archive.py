@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+import chess.pgn
+from config import ARCHIVE_CACHE_SIZE
+
+class GameArchive:
+    """Compact records of finished games: PGN text plus a little metadata.
+
+    The most recent ARCHIVE_CACHE_SIZE records are kept in memory (least recently
+    used first out); with a path, every record is also appended to a PGN file.
+    """
+    def __init__(self, path=None, max_games=ARCHIVE_CACHE_SIZE):
+        self.path = path
+        self.max_games = max_games
+        self.games = OrderedDict()  # {game_id: record}
+        self.archived = 0
+        self.bytes = 0  # PGN text held in memory
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, game_id):
+        return game_id in self.games
+
+    def add(self, game, reason, white_name, black_name):
+        """Archive a finished game"""
+        pgn_game = chess.pgn.Game.from_board(game.replay_board())
+        pgn_game.headers["Event"] = "Online game"
+        pgn_game.headers["Site"] = game.game_id
+        pgn_game.headers["Date"] = time.strftime("%Y.%m.%d")
+        pgn_game.headers["White"] = white_name
+        pgn_game.headers["Black"] = black_name
+        pgn_game.headers["Result"] = game.result
+        pgn_game.headers["TimeControl"] = str(game.time_limit)
+        pgn_game.headers["Termination"] = reason or "normal"
+        pgn = str(pgn_game)
+
+        if self.path:
+            with open(self.path, "a") as archive_file:
+                archive_file.write(pgn + "\n\n")
+
+        self.games[game.game_id] = {
+            "game_id": game.game_id,
+            "white_player": white_name,
+            "black_player": black_name,
+            "result": game.result,
+            "reason": reason,
+            "pgn": pgn
+        }
+        self.bytes += len(pgn)
+        self.archived += 1
+        while len(self.games) > self.max_games:
+            _, record = self.games.popitem(last=False)
+            self.bytes -= len(record["pgn"])
+
+    def get(self, game_id):
+        """Return a game's archive record, or None if it is not held in memory"""
+        record = self.games.get(game_id)
+        if record is not None:
+            self.games.move_to_end(game_id)
+        return record
+
+def resident_memory():
+    """Return this process's resident set size in bytes (peak RSS where current is unavailable)"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
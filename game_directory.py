@@ -0,0 +1,81 @@
+import bisect
+import heapq
+import itertools
+
+LISTED_STATUSES = ("waiting", "active")
+
+class GameDirectory:
+    """Index of the games LIST_GAMES can return, updated as games change.
+
+    Each listed status keeps its games' listing sequence numbers in ascending order,
+    so a page is found by bisecting for the cursor and reading forward: the cost of a
+    page depends on its size, not on how many games the server has ever hosted.
+    """
+    def __init__(self):
+        self.entries = {}  # {game_id: (seq, summary)}
+        self.by_seq = {}   # {seq: game_id} for live entries only
+        self.indexes = {status: [] for status in LISTED_STATUSES}  # may hold stale seqs
+        self.counter = itertools.count(1)
+        self.stale = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, game_id, summary):
+        """Add or refresh a game's entry, or drop it once the game is no longer listable"""
+        old = self.entries.get(game_id)
+        if summary is None or summary["status"] not in LISTED_STATUSES:
+            if old is not None:
+                del self.entries[game_id]
+                self.forget(old[0])
+            return
+
+        if old is not None and old[1]["status"] == summary["status"]:
+            # Same index; keep the game's position in the listing
+            self.entries[game_id] = (old[0], summary)
+            return
+
+        if old is not None:
+            self.forget(old[0])
+        seq = next(self.counter)
+        self.entries[game_id] = (seq, summary)
+        self.by_seq[seq] = game_id
+        self.indexes[summary["status"]].append(seq)
+
+    def forget(self, seq):
+        """Retire a sequence number, compacting the indexes once they are mostly stale"""
+        del self.by_seq[seq]
+        self.stale += 1
+        if self.stale > len(self.entries) + 64:
+            for status, index in self.indexes.items():
+                self.indexes[status] = [seq for seq in index if seq in self.by_seq]
+            self.stale = 0
+
+    def after(self, index, cursor):
+        """Iterate an index from the first seq greater than cursor"""
+        for i in range(bisect.bisect_right(index, cursor), len(index)):
+            yield index[i]
+
+    def page(self, cursor=0, limit=50, status=None, time_control=None, min_spectators=0):
+        """Return (games, next_cursor) for the listed games after cursor that match the filters.
+
+        next_cursor is None once the listing is exhausted.
+        """
+        statuses = [status] if status else LISTED_STATUSES
+        streams = [self.after(self.indexes.get(listed_status, []), cursor) for listed_status in statuses]
+
+        games = []
+        for seq in heapq.merge(*streams):
+            game_id = self.by_seq.get(seq)
+            if game_id is None:
+                continue
+            summary = self.entries[game_id][1]
+            if time_control is not None and summary.get("time_control") != time_control:
+                continue
+            if summary.get("spectator_count", 0) < min_spectators:
+                continue
+
+            games.append(summary)
+            if len(games) == limit:
+                return games, seq
+        return games, None
@@ -1,22 +1,87 @@
 import chess
 import time
+from array import array
+from collections import Counter, deque
+from config import CHAT_HISTORY_LIMIT
+from chat import chat_entry
+
+# Terminal positions, as reported by ChessGame.position()
+CHECKMATE = "checkmate"
+STALEMATE = "stalemate"
+INSUFFICIENT_MATERIAL = "insufficient_material"
+FIVEFOLD_REPETITION = "fivefold_repetition"
+SEVENTYFIVE_MOVES = "seventyfive_moves"
+
+# Draws a player may claim with CLAIM_DRAW
+THREEFOLD_REPETITION = "threefold_repetition"
+FIFTY_MOVES = "fifty_moves"
+
+DRAW_REASONS = {
+    STALEMATE: "Game drawn.",
+    INSUFFICIENT_MATERIAL: "Game drawn.",
+    FIVEFOLD_REPETITION: "Game drawn by fivefold repetition.",
+    SEVENTYFIVE_MOVES: "Game drawn by the 75-move rule.",
+    THREEFOLD_REPETITION: "Draw claimed by threefold repetition.",
+    FIFTY_MOVES: "Draw claimed under the 50-move rule."
+}
+
+def position_key(board):
+    """Identify a position for repetition: placement, side to move, castling and en passant.
+
+    The whole position is kept rather than a hash of it, so two positions can never be
+    confused, and only public Board attributes are used.
+    """
+    return (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK], board.turn,
+            board.clean_castling_rights(), board.ep_square if board.has_legal_en_passant() else None)
+
+def encode_move(move):
+    """Pack a chess.Move into 16 bits, in the same layout as communication.pack_move"""
+    promotion = move.promotion - 1 if move.promotion else 0
+    return (promotion << 12) | (move.from_square << 6) | move.to_square
+
+def decode_move(code):
+    """Inverse of encode_move"""
+    promotion = code >> 12
+    return chess.Move((code >> 6) & 0x3F, code & 0x3F, promotion + 1 if promotion else None)
 
 class ChessGame:
+    """One game's state, kept small so a server can hold many thousands at once.
+
+    The move list is the source of truth, packed at two bytes per move. The board is
+    rebuilt from it on first use and kept without its undo stack, so a long game costs
+    no more than a short one beyond its move list.
+    """
+    __slots__ = ("game_id", "_board", "_repetitions", "_position", "_fen", "moves", "white_player", "black_player", "spectators",
+                 "chat_history", "game_status", "result", "state_version", "time_limit",
+                 "white_time_remaining", "black_time_remaining", "last_move_time")
+
     def __init__(self, game_id, white_player=None, black_player=None, time_limit_mins=15):
         self.game_id = game_id
-        self.board = chess.Board()
+        self._board = None  # built from moves on demand, see board
+        self._repetitions = None  # {position_key: occurrences} since the last capture or pawn move
+        self._position = None  # (check, terminal) for the current position, see position()
+        self._fen = None
+        self.moves = array("H")  # encode_move() codes
         self.white_player = white_player
         self.black_player = black_player
-        self.spectators = []
-        self.chat_history = []
+        self.spectators = set()
+        self.chat_history = deque(maxlen=CHAT_HISTORY_LIMIT)  # (chat id, sender, message, timestamp)
         self.game_status = "waiting"  # waiting, active, completed
+        self.result = "*"  # PGN result once completed: 1-0, 0-1 or 1/2-1/2
+        self.state_version = 0  # bumped on every move and status change
         
         # Time control (in seconds)
+        # Remaining times are as of last_move_time, a time.monotonic() timestamp;
+        # the live value for the side to move is derived in time_remaining()
         self.time_limit = time_limit_mins * 60
         self.white_time_remaining = self.time_limit
         self.black_time_remaining = self.time_limit
         self.last_move_time = None
         
+        if white_player is not None and black_player is not None:
+            self.start_clock()
+        
     def add_player(self, player_id):
         """Add a player to the game if a slot is available"""
         if self.white_player is None:
@@ -24,57 +89,205 @@ class ChessGame:
             return "white"
         elif self.black_player is None:
             self.black_player = player_id
-            self.game_status = "active"
-            self.last_move_time = time.time()
+            self.start_clock()
             return "black"
         return None
+    
+    def start_clock(self):
+        """Mark the game active and start white's clock"""
+        self.game_status = "active"
+        self.state_version += 1
+        self.last_move_time = time.monotonic()
+    
+    @property
+    def board(self):
+        """The current position, rebuilt from the move list if it was released"""
+        if self._board is None:
+            board = chess.Board()
+            self._repetitions = Counter({position_key(board): 1})
+            for code in self.moves:
+                self.push(board, decode_move(code))
+            self._board = board
+        return self._board
+    
+    def push(self, board, move):
+        """Play a move on board and count the resulting position"""
+        board.push(move)
+        board.clear_stack()  # Only the position is needed; moves has the history
+        if board.halfmove_clock == 0:
+            # After a capture or pawn move no earlier position can recur
+            self._repetitions.clear()
+        self._repetitions[position_key(board)] += 1
+    
+    def position(self):
+        """Return (check, terminal, claimable) for the current position, working them out once per ply.
+
+        terminal is the rule that ends the game here (CHECKMATE, STALEMATE,
+        INSUFFICIENT_MATERIAL, FIVEFOLD_REPETITION or SEVENTYFIVE_MOVES) or None;
+        claimable is THREEFOLD_REPETITION, FIFTY_MOVES or None. A single lazy move
+        generation answers both checkmate and stalemate, and repetitions come from
+        the running count, so the cost does not grow with the length of the game.
+        """
+        if self._position is None:
+            board = self.board
+            occurrences = self._repetitions[position_key(board)]
+            check = board.is_check()
+            claimable = None
+            if not any(board.generate_legal_moves()):
+                terminal = CHECKMATE if check else STALEMATE
+            elif board.is_insufficient_material():
+                terminal = INSUFFICIENT_MATERIAL
+            elif occurrences >= 5:
+                terminal = FIVEFOLD_REPETITION
+            elif board.halfmove_clock >= 150:
+                terminal = SEVENTYFIVE_MOVES
+            else:
+                terminal = None
+                if occurrences >= 3:
+                    claimable = THREEFOLD_REPETITION
+                elif board.halfmove_clock >= 100:
+                    claimable = FIFTY_MOVES
+            self._position = (check, terminal, claimable)
+        return self._position
+    
+    def fen(self):
+        """Return the FEN of the current position, computed at most once per ply"""
+        if self._fen is None:
+            self._fen = self.board.fen()
+        return self._fen
+    
+    def release_board(self):
+        """Free the board of a game that is unlikely to be looked at again soon"""
+        self._board = None
+        self._repetitions = None
+    
+    def white_to_move(self):
+        return len(self.moves) % 2 == 0
+    
+    def last_move(self):
+        """Return the last move in UCI notation, or None"""
+        return decode_move(self.moves[-1]).uci() if self.moves else None
+    
+    def move_list(self):
+        """Return every move in UCI notation"""
+        return [decode_move(code).uci() for code in self.moves]
+    
+    def replay_board(self):
+        """Return a fresh board with the full move stack, e.g. for PGN export"""
+        board = chess.Board()
+        for code in self.moves:
+            board.push(decode_move(code))
+        return board
+    
+    def restore(self, moves, white_time, black_time):
+        """Replay journaled moves and clocks; an active game's clock resumes from now"""
+        # Validated when first played; the board is only rebuilt when it is needed
+        self.moves.extend(encode_move(chess.Move.from_uci(move)) for move in moves)
+        self._board = None
+        self._repetitions = None
+        self._position = None
+        self._fen = None
+        self.state_version += len(moves)
+        self.white_time_remaining = white_time
+        self.black_time_remaining = black_time
+        if self.game_status == "active":
+            self.last_move_time = time.monotonic()
+
+    def end_game(self, result="*"):
+        """Mark the game completed"""
+        self.game_status = "completed"
+        self.result = result
+        self.state_version += 1
+    
+    def time_remaining(self, now=None):
+        """Return the (white, black) time remaining at monotonic time now"""
+        white_time, black_time = self.white_time_remaining, self.black_time_remaining
+        if self.game_status == "active" and self.last_move_time is not None:
+            elapsed = (time.monotonic() if now is None else now) - self.last_move_time
+            if self.white_to_move():
+                white_time = max(0, white_time - elapsed)
+            else:
+                black_time = max(0, black_time - elapsed)
+        return white_time, black_time
+    
+    def flag_deadline(self):
+        """Return the monotonic time at which the side to move runs out of time"""
+        if self.game_status != "active" or self.last_move_time is None:
+            return None
+        if self.white_to_move():
+            return self.last_move_time + self.white_time_remaining
+        return self.last_move_time + self.black_time_remaining
+    
+    def check_flag(self, now=None):
+        """End the game if the side to move has run out of time, returning the reason"""
+        if now is None:
+            now = time.monotonic()
+        deadline = self.flag_deadline()
+        if deadline is None or now < deadline:
+            return None
+        
+        if self.white_to_move():
+            self.end_game("0-1")
+            self.white_time_remaining = 0
+            return "White ran out of time. Black wins!"
+        self.end_game("1-0")
+        self.black_time_remaining = 0
+        return "Black ran out of time. White wins!"
         
     def add_spectator(self, spectator_id):
         """Add a spectator to the game"""
         if spectator_id not in self.spectators:
-            self.spectators.append(spectator_id)
+            self.spectators.add(spectator_id)
             return True
         return False
         
     def make_move(self, move_uci, player_id):
         """Attempt to make a move on the board"""
+        if self.game_status != "active":
+            return False, "Game is not active"
+        
         # Check if it's the player's turn
-        is_white_turn = self.board.turn == chess.WHITE
+        is_white_turn = self.white_to_move()
         if (is_white_turn and player_id != self.white_player) or \
            (not is_white_turn and player_id != self.black_player):
             return False, "Not your turn"
         
-        # Update timer
-        current_time = time.time()
-        if self.last_move_time:
-            elapsed = current_time - self.last_move_time
-            if is_white_turn:
-                self.white_time_remaining -= elapsed
-                if self.white_time_remaining <= 0:
-                    self.game_status = "completed"
-                    return False, "White ran out of time"
-            else:
-                self.black_time_remaining -= elapsed
-                if self.black_time_remaining <= 0:
-                    self.game_status = "completed"
-                    return False, "Black ran out of time"
+        # Update timer (only committed once the move is accepted)
+        current_time = time.monotonic()
+        reason = self.check_flag(current_time)
+        if reason:
+            return False, reason
         
         # Try to make the move
         try:
             move = chess.Move.from_uci(move_uci)
             if move in self.board.legal_moves:
-                self.board.push(move)
+                if self.last_move_time:
+                    elapsed = current_time - self.last_move_time
+                    if is_white_turn:
+                        self.white_time_remaining -= elapsed
+                    else:
+                        self.black_time_remaining -= elapsed
+                self.push(self.board, move)
+                self.moves.append(encode_move(move))
+                self._position = None
+                self._fen = None
                 self.last_move_time = current_time
+                self.state_version += 1
                 
                 # Check for game end conditions
-                if self.board.is_checkmate():
+                terminal = self.position()[1]
+                if terminal == CHECKMATE:
                     self.game_status = "completed"
-                    winner = "black" if is_white_turn else "white"
+                    # is_white_turn was read before the move: the side that just moved has mated
+                    self.result = "1-0" if is_white_turn else "0-1"
+                    winner = "white" if is_white_turn else "black"
                     return True, f"Checkmate. {winner.capitalize()} wins!"
                 
-                if self.board.is_stalemate() or self.board.is_insufficient_material():
+                if terminal is not None:
                     self.game_status = "completed"
-                    return True, "Game drawn."
+                    self.result = "1/2-1/2"
+                    return True, DRAW_REASONS[terminal]
                 
                 return True, None
             else:
@@ -82,27 +295,65 @@ class ChessGame:
         except Exception as e:
             return False, str(e)
     
+    def claim_draw(self, player_id):
+        """End the game as a draw if the current position allows a claim"""
+        if self.game_status != "active":
+            return False, "Game is not active"
+        if player_id not in (self.white_player, self.black_player):
+            return False, "Only the players can claim a draw"
+        
+        reason = self.check_flag()
+        if reason:
+            return False, reason
+        
+        claimable = self.position()[2]
+        if claimable is None:
+            return False, "There is no draw to claim in this position"
+        
+        self.end_game("1/2-1/2")
+        return True, DRAW_REASONS[claimable]
+    
     def add_chat_message(self, sender_id, message):
-        """Add a chat message to the game"""
-        chat_entry = {
-            "sender": sender_id,
-            "message": message,
-            "timestamp": time.time()
-        }
-        self.chat_history.append(chat_entry)
-        return chat_entry
+        """Add a chat message to the game and return its CHAT_BATCH entry"""
+        chat_id = self.chat_history[-1][0] + 1 if self.chat_history else 1  # ids let clients page back through history
+        record = (chat_id, sender_id, message, time.time())
+        self.chat_history.append(record)  # The oldest message falls off when full
+        return chat_entry(record)
     
     def get_game_state(self):
         """Return the current state of the game"""
-        return {
+        white_time, black_time = self.time_remaining()
+        state = {
             "game_id": self.game_id,
-            "board_fen": self.board.fen(),
+            "version": self.state_version,
+            "board_fen": self.fen(),
             "turn": "white" if self.board.turn == chess.WHITE else "black",
             "white_player": self.white_player,
             "black_player": self.black_player,
-            "white_time": self.white_time_remaining,
-            "black_time": self.black_time_remaining,
+            "white_time": white_time,
+            "black_time": black_time,
+            "server_time": time.time(),  # wall-clock time the clocks were read at, for client countdowns
             "status": self.game_status,
-            "check": self.board.is_check(),
-            "last_move": self.board.move_stack[-1].uci() if len(self.board.move_stack) > 0 else None
+            "check": self.position()[0],
+            "last_move": self.last_move()
+        }
+        if self.game_status == "active" and self.position()[2]:
+            state["draw_claimable"] = self.position()[2]
+        return state
+    
+    def get_state_delta(self):
+        """Return the change made by the last move, for clients holding the previous version"""
+        white_time, black_time = self.time_remaining()
+        delta = {
+            "game_id": self.game_id,
+            "version": self.state_version,
+            "move": self.last_move(),
+            "white_time": white_time,
+            "black_time": black_time,
+            "server_time": time.time()
         }
+        if self.game_status != "active":
+            delta["status"] = self.game_status
+        elif self.position()[2]:
+            delta["draw_claimable"] = self.position()[2]
+        return delta
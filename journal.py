@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+from config import JOURNAL_FLUSH_INTERVAL
+
+# Record kinds
+GAME_CREATED = "created"      # white, black, time_limit, seats
+MOVE_MADE = "move"            # move, white_time, black_time (as of the move)
+CLOCK_SNAPSHOT = "clock"      # white_time, black_time (live values)
+GAME_COMPLETED = "completed"  # reason
+GAME_SNAPSHOT = "snapshot"    # white, black, time_limit, moves, white_time, black_time, seats (written by compaction)
+
+# seats maps a seated player's client id to [session token, player name], so a
+# recovered game's players can resume their sessions after a restart
+
+class GameJournal:
+    """Append-only, newline-delimited JSON log of game events.
+
+    append() only queues a record; a writer thread commits everything queued within
+    JOURNAL_FLUSH_INTERVAL with a single write and fsync (group commit), so moves never
+    wait on the disk. A crash can lose at most the last interval of records.
+    """
+    def __init__(self, path, flush_interval=JOURNAL_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.file = open(path, "ab")
+        self.pending = []  # encoded records waiting for the next commit
+        self.condition = threading.Condition()  # guards pending; never held while on the disk
+        self.file_lock = threading.Lock()  # serialises commit() and rewrite()
+        self.closed = False
+        self.bytes_written = self.file.tell()
+
+        self.writer = threading.Thread(target=self.run)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def append(self, op, game_id, **fields):
+        """Queue a record for the next group commit"""
+        record = {"op": op, "game": game_id}
+        record.update(fields)
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        with self.condition:
+            self.pending.append(line)
+            if len(self.pending) == 1:
+                self.condition.notify()
+
+    def run(self):
+        """Commit queued records in batches"""
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+
+            # Let the group fill up, then write it in one go
+            time.sleep(self.flush_interval)
+            self.commit()
+
+    def commit(self):
+        """Write and fsync everything queued so far"""
+        with self.file_lock:
+            # Take the batch inside file_lock, so a rewrite cannot land between taking
+            # it and writing it, but release condition so append() never waits on the disk
+            with self.condition:
+                batch, self.pending = self.pending, []
+            if batch:
+                data = b"".join(batch)
+                self.file.write(data)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.bytes_written += len(data)
+
+    def rewrite(self, records):
+        """Atomically replace the journal with records, a list of (op, game_id, fields)"""
+        with self.file_lock:
+            with self.condition:
+                self.pending = []  # superseded by the new contents
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "wb") as temp_file:
+                for op, game_id, fields in records:
+                    record = {"op": op, "game": game_id}
+                    record.update(fields)
+                    temp_file.write(json.dumps(record, separators=(",", ":")).encode() + b"\n")
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+                self.bytes_written = temp_file.tell()
+            self.file.close()
+            os.replace(temp_path, self.path)
+            self.file = open(self.path, "ab")
+
+    def close(self):
+        """Commit outstanding records and stop the writer"""
+        self.commit()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+        self.file.close()
+
+def replay_journal(path):
+    """Return the last known state of every unfinished game recorded in a journal.
+
+    The result maps game_id to a dict with white, black, time_limit, moves,
+    white_time, black_time and seats.
+    """
+    games = {}
+    if not os.path.exists(path):
+        return games
+
+    with open(path, "rb") as journal_file:
+        for line in journal_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # Torn write at the tail of the journal
+
+            op = record["op"]
+            game_id = record["game"]
+            if op == GAME_CREATED:
+                games[game_id] = {
+                    "white": record["white"],
+                    "black": record["black"],
+                    "time_limit": record["time_limit"],
+                    "moves": [],
+                    "white_time": record["time_limit"],
+                    "black_time": record["time_limit"],
+                    "seats": record.get("seats", {})
+                }
+            elif op == GAME_SNAPSHOT:
+                games[game_id] = {key: record[key] for key in
+                                  ("white", "black", "time_limit", "moves", "white_time", "black_time")}
+                games[game_id]["seats"] = record.get("seats", {})
+            elif game_id not in games:
+                continue
+            elif op == MOVE_MADE:
+                state = games[game_id]
+                state["moves"].append(record["move"])
+                state["white_time"] = record["white_time"]
+                state["black_time"] = record["black_time"]
+            elif op == CLOCK_SNAPSHOT:
+                games[game_id]["white_time"] = record["white_time"]
+                games[game_id]["black_time"] = record["black_time"]
+            elif op == GAME_COMPLETED:
+                del games[game_id]
+    return games
@@ -0,0 +1,91 @@
+import time
+from config import *
+
+class Matchmaker:
+    """Lobby of players waiting for a game, pooled by time control and rating band.
+
+    Each pool is an insertion-ordered dict, so joining, cancelling and taking the
+    longest-waiting player are all O(1). A player's search window starts at their own
+    rating band and widens by one band every MATCH_WIDEN_INTERVAL seconds, so a search
+    only ever looks at a fixed number of pools no matter how many players are waiting.
+    """
+    def __init__(self):
+        self.pools = {}    # {(time_control, band): {client_id: time joined}}
+        self.players = {}  # {client_id: (time_control, band)}
+
+    def __len__(self):
+        return len(self.players)
+
+    def __contains__(self, client_id):
+        return client_id in self.players
+
+    def add(self, client_id, time_control=DEFAULT_TIME_LIMIT, rating=DEFAULT_RATING, now=None):
+        """Put a player in the lobby"""
+        if client_id in self.players:
+            self.remove(client_id)
+        band = int(rating) // RATING_BAND_WIDTH
+        self.players[client_id] = (time_control, band)
+        self.pools.setdefault((time_control, band), {})[client_id] = time.monotonic() if now is None else now
+
+    def remove(self, client_id):
+        """Take a player out of the lobby"""
+        key = self.players.pop(client_id)
+        pool = self.pools[key]
+        del pool[client_id]
+        if not pool:
+            del self.pools[key]
+
+    def reach(self, joined, now):
+        """How many rating bands away a player who joined at `joined` will accept"""
+        return min(MAX_BAND_DISTANCE, int((now - joined) // MATCH_WIDEN_INTERVAL))
+
+    def find_opponent(self, client_id, now):
+        """Return the best waiting opponent for a player, or None"""
+        time_control, band = self.players[client_id]
+        my_reach = self.reach(self.pools[(time_control, band)][client_id], now)
+
+        # Nearest bands first; within a pool only the longest waiter is considered
+        for distance in range(MAX_BAND_DISTANCE + 1):
+            for candidate_band in ((band,) if distance == 0 else (band - distance, band + distance)):
+                pool = self.pools.get((time_control, candidate_band))
+                if not pool:
+                    continue
+                for opponent, joined in pool.items():
+                    if opponent == client_id:
+                        continue
+                    if distance <= max(my_reach, self.reach(joined, now)):
+                        return opponent
+                    break
+        return None
+
+    def match(self, client_id, now=None):
+        """Pair a waiting player with an acceptable opponent if there is one.
+
+        Returns (white, black, time_control) with the longer waiter as white, or None.
+        """
+        if now is None:
+            now = time.monotonic()
+        opponent = self.find_opponent(client_id, now)
+        if opponent is None:
+            return None
+
+        time_control = self.players[client_id][0]
+        white, black = sorted((client_id, opponent), key=lambda c: self.pools[self.players[c]][c])
+        self.remove(white)
+        self.remove(black)
+        return white, black, time_control
+
+    def pop_matches(self, now=None):
+        """Pair up every player whose widened window now holds an acceptable opponent"""
+        if now is None:
+            now = time.monotonic()
+
+        matches = []
+        # Only the head of each pool can be the longest waiter in its window
+        for key in list(self.pools):
+            pool = self.pools.get(key)
+            if pool:
+                match = self.match(next(iter(pool)), now)
+                if match is not None:
+                    matches.append(match)
+        return matches
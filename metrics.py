@@ -0,0 +1,203 @@
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Upper bounds, in bytes, of the per-connection traffic buckets
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+def format_labels(names, values, extra=""):
+    """Render a Prometheus label set, e.g. {type="make_move",le="0.001"}"""
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def summarize(labels, values):
+    """Return {label values joined by commas: value}, or the bare value of an unlabelled metric"""
+    if not labels:
+        return values.get(())
+    return {",".join(map(str, key)): value for key, value in values.items()}
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonic count, optionally split by labels"""
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {} if labels else {(): 0}  # {label values: count}
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in sorted(self.values.items()):
+            yield self.name + format_labels(self.labels, label_values), value
+
+    def snapshot(self):
+        return summarize(self.labels, self.values)
+
+class Gauge:
+    """Value read when the metrics are collected.
+
+    callback returns a number, or with labels a {label values: number} dict. kind
+    "counter" exposes a total the server already keeps, such as bytes sent.
+    """
+    def __init__(self, name, help_text, callback, labels=(), kind="gauge"):
+        self.kind = kind
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.labels = labels
+
+    def read(self):
+        value = self.callback()
+        return value if self.labels else {(): value}
+
+    def samples(self):
+        for label_values, value in sorted(self.read().items()):
+            if value is not None:
+                yield self.name + format_labels(self.labels, label_values), value
+
+    def snapshot(self):
+        return summarize(self.labels, self.read())
+
+class Histogram:
+    """Distribution of observed values in fixed buckets, optionally split by labels"""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}  # {label values: [bucket counts..., overflow count, sum]}
+
+    def observe(self, value, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for label_values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                yield self.name + "_bucket" + format_labels(self.labels, label_values, le), cumulative
+            yield self.name + "_sum" + format_labels(self.labels, label_values), series[-1]
+            yield self.name + "_count" + format_labels(self.labels, label_values), cumulative
+
+    def quantile(self, series, fraction):
+        """Estimate a quantile by interpolating within its bucket"""
+        total = sum(series[:-1])
+        if not total:
+            return None
+        rank = fraction * total
+        cumulative = 0
+        for i, count in enumerate(series[:-1]):
+            if cumulative + count >= rank:
+                if i == len(self.buckets):
+                    return self.buckets[-1]  # Beyond the last bound; report it as a floor
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+
+    def snapshot(self):
+        summary = {}
+        for label_values, series in self.series.items():
+            count = sum(series[:-1])
+            summary[label_values] = {
+                "count": count,
+                "p50": round(self.quantile(series, 0.5), 6),
+                "p99": round(self.quantile(series, 0.99), 6)
+            }
+        return summarize(self.labels, summary)
+
+class MetricsRegistry:
+    """Named counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Updates are not locked: callers update metrics from whichever thread already
+    owns the state being measured (the server lock, or the event loop).
+    """
+    def __init__(self, prefix="chess_"):
+        self.prefix = prefix
+        self.metrics = {}  # {name: metric}, in registration order
+
+    def register(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, callback, labels=(), kind="gauge"):
+        return self.register(Gauge(name, help_text, callback, labels, kind))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """Return {name without prefix: summary} of every metric with data, for logging"""
+        snapshot = {}
+        for name, metric in self.metrics.items():
+            summary = metric.snapshot()
+            if summary not in (None, {}):
+                snapshot[name[len(self.prefix):]] = summary
+        return snapshot
+
+class MetricsEndpoint:
+    """Serve render() as text over HTTP from a background thread, e.g. for Prometheus to scrape"""
+    def __init__(self, render, host, port):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes every few seconds would drown the server's own log
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        print(f"Metrics at http://{self.httpd.server_address[0]}:{self.httpd.server_address[1]}/metrics")
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,62 @@
+import collections
+from communication import TIME_UPDATE
+from config import OUTBOUND_QUEUE_LIMIT
+
+class OutboundQueue:
+    """Bounded queue of encoded frames waiting to be written to one connection.
+
+    The server fills it and a per-connection writer drains it, so a slow reader
+    only ever delays itself. wakeup is called whenever frames are added.
+    """
+    def __init__(self, max_frames=OUTBOUND_QUEUE_LIMIT, wakeup=None):
+        self.frames = collections.deque()  # [(msg_type, frame)]
+        self.max_frames = max_frames
+        self.wakeup = wakeup
+        self.closed = False
+        self.time_updates = 0  # TIME_UPDATE frames currently queued
+        self.overflows = 0     # overflows since the queue last drained completely
+        self.dropped = 0       # frames discarded over the queue's lifetime
+    
+    def __len__(self):
+        return len(self.frames)
+    
+    def put(self, msg_type, frame):
+        """Queue a frame, returning False if the queue is full"""
+        if self.closed:
+            return True
+        
+        if msg_type == TIME_UPDATE and self.time_updates:
+            # A newer clock reading supersedes any still waiting to be sent
+            self.frames = collections.deque(entry for entry in self.frames if entry[0] != TIME_UPDATE)
+            self.dropped += self.time_updates
+            self.time_updates = 0
+        
+        if len(self.frames) >= self.max_frames:
+            return False
+        
+        self.frames.append((msg_type, frame))
+        if msg_type == TIME_UPDATE:
+            self.time_updates += 1
+        if self.wakeup is not None:
+            self.wakeup()
+        return True
+    
+    def clear(self):
+        """Discard every queued frame"""
+        self.dropped += len(self.frames)
+        self.frames.clear()
+        self.time_updates = 0
+    
+    def take(self):
+        """Remove and return every queued frame"""
+        frames = [frame for _, frame in self.frames]
+        self.frames.clear()
+        self.time_updates = 0
+        self.overflows = 0
+        return frames
+    
+    def close(self):
+        """Stop accepting frames and wake the writer so it can exit"""
+        self.closed = True
+        if self.wakeup is not None:
+            self.wakeup()
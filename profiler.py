@@ -0,0 +1,139 @@
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+from config import PROFILE_SAMPLE_INTERVAL, PROFILE_SWITCH_INTERVAL, PROFILE_DIR
+
+def profiled_call(profiler, method, *args, **kwargs):
+    """Run a wrapped method, marking its thread as busy unless an outer profiled call already has"""
+    thread_id = threading.get_ident()
+    sections = profiler.sections
+    if thread_id in sections:
+        return method(*args, **kwargs)
+    sections[thread_id] = method.__name__
+    try:
+        return method(*args, **kwargs)
+    finally:
+        del sections[thread_id]
+
+PROFILED_CALL_CODE = profiled_call.__code__
+
+def frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Periodically samples the stacks of threads running wrapped methods.
+
+    Stacks are counted in the collapsed format read by flamegraph.pl and speedscope:
+    one "outer;...;inner count" line per distinct stack, rooted at the wrapped method.
+    Threads outside every wrapped method (waiting on sockets, say) are not sampled.
+
+    The sampler only runs when it gets the GIL, which a busy thread hands over every
+    sys.getswitchinterval() (5ms by default), far longer than most handlers take; it
+    then mostly sees threads after they leave a handler. A switch_interval shortens the
+    interpreter's for the duration of a window so that samples land inside handlers
+    too, at the price of more GIL hand-offs in every thread of the process. By default
+    it is left alone and the profile is coarser but costs next to nothing.
+    """
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL, directory=PROFILE_DIR, switch_interval=PROFILE_SWITCH_INTERVAL):
+        self.interval = interval
+        self.directory = directory
+        self.switch_interval = switch_interval
+        self.saved_switch_interval = None  # the interpreter's, while switch_interval is in force
+        self.sections = {}  # {thread id: name of the outermost wrapped method it is running}
+        self.stacks = collections.Counter()  # {collapsed stack: samples}
+        self.section_samples = collections.Counter()  # {wrapped method: samples}
+        self.samples = 0  # sampling rounds, busy or not
+        self.thread = None
+        self.running = False
+        self.started = None
+        self.deadline = None
+        self.finished = None
+        self.on_finish = None
+        self.path = None
+
+    def wrap(self, method):
+        """Return a callable that runs method as a profiled section"""
+        return functools.partial(profiled_call, self, method)
+
+    def start(self, duration=None, on_finish=None):
+        """Sample for duration seconds (until stop() if None), then write the profile and call on_finish(self)"""
+        self.running = True
+        self.started = time.monotonic()
+        self.deadline = None if duration is None else self.started + duration
+        self.on_finish = on_finish
+        if self.switch_interval is not None:
+            self.saved_switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(self.saved_switch_interval, self.switch_interval))
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """End the window early and wait until the profile is written"""
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def run(self):
+        try:
+            while self.running and (self.deadline is None or time.monotonic() < self.deadline):
+                time.sleep(self.interval)
+                self.sample()
+        finally:
+            self.running = False
+            self.finished = time.monotonic()
+            if self.saved_switch_interval is not None:
+                sys.setswitchinterval(self.saved_switch_interval)
+        try:
+            self.path = self.write()
+        except OSError as e:
+            print(f"Could not write profile: {e}")
+        if self.on_finish is not None:
+            self.on_finish(self)
+
+    def sample(self):
+        """Record the current stack of every thread inside a wrapped method"""
+        frames = sys._current_frames()
+        for thread_id, section in list(self.sections.items()):
+            frame = frames.get(thread_id)
+            stack = []
+            outermost = 0  # frames below the outermost wrapper; nested wrapped calls are left out
+            while frame is not None:
+                if frame.f_code is PROFILED_CALL_CODE:
+                    outermost = len(stack)
+                else:
+                    stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            stack = stack[:outermost]
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.section_samples[section] += 1
+        self.samples += 1
+
+    def write(self):
+        """Write the collapsed stacks to a new file in the profile directory and return its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.directory, f"profile-{os.getpid()}-{stamp}.collapsed")
+        with open(path, "w") as profile_file:
+            for stack, count in self.stacks.most_common():
+                profile_file.write(f"{stack} {count}\n")
+        return path
+
+    def summary(self, top=10):
+        """Return the window's sample counts and the functions most often on top of the stack"""
+        self_samples = collections.Counter()
+        for stack, count in list(self.stacks.items()):  # Copied in one step; the sampler may be adding stacks
+            self_samples[stack.rsplit(";", 1)[-1]] += count
+        return {
+            "running": self.running,
+            "path": self.path,
+            "seconds": round((self.finished or time.monotonic()) - self.started, 1),
+            "samples": self.samples,
+            "busy_samples": sum(self.section_samples.values()),
+            "sections": dict(self.section_samples),
+            "top": self_samples.most_common(top)
+        }
@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import json
+import socket
+import time
+import uuid
+import chess
+from communication import *
+from framing import FrameDecoder
+from outbound import OutboundQueue
+from config import *
+
+class GameFeed:
+    """One game's event stream from upstream and the local clients watching it.
+
+    The feed keeps its own copy of the game state, advanced by every GAME_DELTA, so a
+    late joiner (or a relay stacked below this one) gets a current GAME_STATE
+    without a round trip to the game server.
+    """
+    def __init__(self, game_id):
+        self.game_id = game_id
+        self.watchers = set()  # local client ids
+        self.state = None      # latest GAME_STATE data
+        self.board = None      # state["board_fen"] as a Board, to apply deltas to
+        self.snapshot = None   # state encoded as a GAME_STATE frame, built on demand
+        self.writer = None     # upstream connection
+        self.finished = False
+
+    def set_state(self, state):
+        self.state = state
+        self.board = chess.Board(state["board_fen"])
+        self.snapshot = None
+
+    def apply_delta(self, delta):
+        """Advance the state by one GAME_DELTA, returning False if it does not follow on"""
+        if self.state is None or delta.get("version") != self.state.get("version", 0) + 1:
+            return False
+        if delta.get("move"):
+            self.board.push_uci(delta["move"])
+        self.state.pop("draw_claimable", None)
+        self.state.update(delta)
+        self.state.pop("move", None)
+        self.state["board_fen"] = self.board.fen()
+        self.state["turn"] = "white" if self.board.turn == chess.WHITE else "black"
+        self.state["check"] = self.board.is_check()
+        self.state["last_move"] = delta.get("move")
+        self.snapshot = None
+        return True
+
+    def snapshot_frame(self):
+        if self.snapshot is None:
+            self.snapshot = create_message(GAME_STATE, self.state) + b'\n'
+        return self.snapshot
+
+class SpectatorRelay:
+    """Re-broadcasts games from a server (or another relay) to many spectators.
+
+    Each watched game costs the upstream a single spectator connection, whatever the
+    number of spectators here. Frames from upstream are forwarded as they arrive,
+    without being re-encoded. Relays speak the same protocol downstream as the game
+    server does to spectators, so they can be stacked.
+    """
+    def __init__(self, host=SERVER_HOST, port=RELAY_PORT, upstream_host=SERVER_HOST, upstream_port=SERVER_PORT):
+        self.host = host
+        self.port = port
+        self.upstream = (upstream_host, upstream_port)
+        self.clients = {}        # {client_id: StreamWriter}
+        self.client_queues = {}  # {client_id: OutboundQueue}
+        self.client_feed = {}    # {client_id: game_id}
+        self.client_features = {}  # {client_id: OPTIONAL_MESSAGES the spectator understands}
+        self.feeds = {}          # {game_id: GameFeed}
+
+        # LIST_GAMES and CHAT_HISTORY are passed upstream over one shared connection, and
+        # answers are reused for RELAY_LIST_CACHE_TTL so a crowd of spectators costs one request
+        self.request_cache = {}     # {(msg_type, request): (expiry, answering frame)}
+        self.request_lock = asyncio.Lock()
+        self.request_connection = None  # (reader, writer, FrameDecoder)
+
+    def start(self):
+        """Start the relay"""
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("Relay shutting down...")
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        print(f"Relay started on {self.host}:{self.port}, relaying {self.upstream[0]}:{self.upstream[1]}")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Handle communication with a spectator"""
+        client_id = str(uuid.uuid4())
+        ready = asyncio.Event()
+        self.clients[client_id] = writer
+        self.client_queues[client_id] = OutboundQueue(wakeup=ready.set)
+        writer_task = asyncio.create_task(self.write_client(client_id, writer, self.client_queues[client_id], ready))
+
+        client_socket = writer.get_extra_info("socket")
+        if client_socket is not None:
+            client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        try:
+            decoder = FrameDecoder()
+            while True:
+                data = await reader.read(RECV_BUFFER_SIZE)
+                if not data:
+                    break
+
+                decoder.feed(data)
+                for is_binary, message in decoder.frames():
+                    if is_binary:
+                        self.send_message(client_id, ERROR, {"error": "Binary codec was not negotiated"})
+                        continue
+                    msg_type, data = parse_message(message)
+                    self.handle_message(client_id, msg_type, data)
+
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect_client(client_id)
+            await writer_task
+
+    async def write_client(self, client_id, writer, queue, ready):
+        """Drain a spectator's outbound queue onto its transport"""
+        try:
+            while not queue.closed:
+                await ready.wait()
+                ready.clear()
+                frames = queue.take()
+                if frames:
+                    writer.write(b"".join(frames))
+                    await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.disconnect_client(client_id)
+
+    def handle_message(self, client_id, msg_type, data):
+        """Act on a message from a spectator"""
+        if msg_type in (JOIN_LOBBY, SPECTATE_GAME, RELAY_SUBSCRIBE) and isinstance(data.get("features"), list):
+            self.client_features[client_id] = OPTIONAL_MESSAGES.intersection(
+                feature for feature in data["features"] if isinstance(feature, str))
+
+        if msg_type in (SPECTATE_GAME, RELAY_SUBSCRIBE):
+            self.watch(client_id, data.get("game_id"))
+
+        elif msg_type == REQUEST_STATE:
+            feed = self.feeds.get(self.client_feed.get(client_id))
+            if feed is not None and feed.state is not None:
+                self.enqueue_frame(client_id, GAME_STATE, feed.snapshot_frame())
+
+        elif msg_type == LIST_GAMES:
+            asyncio.ensure_future(self.cached_request(client_id, LIST_GAMES, data, GAMES_LIST))
+
+        elif msg_type == CHAT_HISTORY:
+            # The shared upstream connection watches no game, so name the spectator's own
+            if not data.get("game_id") and client_id in self.client_feed:
+                data = dict(data, game_id=self.client_feed[client_id])
+            asyncio.ensure_future(self.cached_request(client_id, CHAT_HISTORY, data, CHAT_HISTORY))
+
+        elif msg_type == JOIN_LOBBY:
+            pass  # The stock client joins on connect; there is no lobby here
+
+        else:
+            self.send_message(client_id, ERROR, {"message": "This server only relays games to spectators"})
+
+    def watch(self, client_id, game_id):
+        """Add a spectator to a game's feed, subscribing upstream if it is the first"""
+        if not isinstance(game_id, str):
+            self.send_message(client_id, ERROR, {"message": "Game not found. Please check the game ID."})
+            return
+        self.unwatch(client_id)
+
+        feed = self.feeds.get(game_id)
+        if feed is None:
+            feed = self.feeds[game_id] = GameFeed(game_id)
+            asyncio.ensure_future(self.subscribe(feed))
+        feed.watchers.add(client_id)
+        self.client_feed[client_id] = game_id
+
+        if feed.state is not None:
+            self.enqueue_frame(client_id, GAME_STATE, feed.snapshot_frame())
+
+    def unwatch(self, client_id):
+        """Remove a spectator from its feed, closing the feed once nobody watches it"""
+        feed = self.feeds.get(self.client_feed.pop(client_id, None))
+        if feed is None:
+            return
+        feed.watchers.discard(client_id)
+        if not feed.watchers:
+            self.close_feed(feed)
+
+    async def subscribe(self, feed):
+        """Relay one game's frames from upstream until the game ends or the feed closes"""
+        try:
+            reader, writer = await asyncio.open_connection(*self.upstream)
+        except OSError as e:
+            self.close_feed(feed, f"Could not reach the game server: {e}")
+            return
+        if self.feeds.get(feed.game_id) is not feed:
+            writer.close()  # Every watcher left while connecting
+            return
+
+        feed.writer = writer
+        writer.write(create_message(RELAY_SUBSCRIBE, {"game_id": feed.game_id, "features": sorted(OPTIONAL_MESSAGES)}) + b'\n')
+        print(f"Subscribed to game {feed.game_id}")
+        try:
+            decoder = FrameDecoder(read_size=65536)
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+
+                decoder.feed(data)
+                for _, message in decoder.frames():
+                    self.feed_frame(feed, message)
+
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            if feed.writer is writer:
+                feed.writer = None
+                if not feed.finished:
+                    self.close_feed(feed, "Lost connection to the game server")
+
+    def feed_frame(self, feed, message):
+        """Track one upstream frame in the feed's state and forward it to the watchers"""
+        msg_type, data = parse_message(message)
+        frame = message + b'\n'
+
+        if msg_type == GAME_STATE:
+            if feed.state is not None and data.get("version") == feed.state.get("version"):
+                # A resync that told us nothing new; the watchers have it all already
+                feed.set_state(data)
+                return
+            feed.set_state(data)
+
+        elif msg_type == GAME_DELTA:
+            if not feed.apply_delta(data):
+                # Missed a move; forward nothing until the fresh snapshot arrives
+                feed.writer.write(create_message(REQUEST_STATE, {}) + b'\n')
+                return
+
+        elif msg_type == TIME_UPDATE and feed.state is not None:
+            feed.state["white_time"] = data.get("white_time")
+            feed.state["black_time"] = data.get("black_time")
+            feed.state["server_time"] = data.get("server_time")
+            feed.snapshot = None
+
+        elif msg_type == GAME_OVER and "game_state" in data:
+            feed.set_state(data["game_state"])
+            feed.finished = True
+            feed.writer.close()  # Late joiners are served from the final state
+
+        elif msg_type == ERROR and feed.state is None:
+            # e.g. no such game; pass the reason on and give up
+            self.broadcast(feed, msg_type, frame)
+            self.close_feed(feed)
+            return
+
+        if msg_type in OPTIONAL_MESSAGES:
+            self.broadcast_optional(feed, msg_type, data, frame)
+        else:
+            self.broadcast(feed, msg_type, frame)
+
+    def close_feed(self, feed, reason=None):
+        """Forget a feed, telling its remaining watchers why if there is a reason"""
+        if self.feeds.get(feed.game_id) is feed:
+            del self.feeds[feed.game_id]
+        for client_id in feed.watchers:
+            if reason:
+                self.send_message(client_id, ERROR, {"message": reason})
+            self.client_feed.pop(client_id, None)
+        feed.watchers.clear()
+        if feed.writer is not None:
+            feed.writer.close()
+            feed.writer = None
+
+    def broadcast(self, feed, msg_type, frame):
+        """Queue the same encoded frame for every watcher of a feed"""
+        for client_id in list(feed.watchers):
+            self.enqueue_frame(client_id, msg_type, frame)
+
+    def broadcast_optional(self, feed, msg_type, data, frame):
+        """Queue a GAME_DELTA or CHAT_BATCH, sending watchers that did not ask for it what it replaces"""
+        legacy_frames = None
+        for client_id in list(feed.watchers):
+            if msg_type in self.client_features.get(client_id, ()):
+                self.enqueue_frame(client_id, msg_type, frame)
+                continue
+            if legacy_frames is None:
+                if msg_type == GAME_DELTA:
+                    legacy_frames = [(GAME_STATE, feed.snapshot_frame())]
+                else:
+                    legacy_frames = [(chat_type, create_message(chat_type, chat) + b'\n')
+                                     for chat_type, chat in legacy_chat_messages(data)]
+            for legacy_type, legacy_frame in legacy_frames:
+                self.enqueue_frame(client_id, legacy_type, legacy_frame)
+
+    async def cached_request(self, client_id, msg_type, request, reply_type):
+        """Answer a read-only request from the cache or from upstream"""
+        key = (msg_type, json.dumps(request, sort_keys=True))
+        async with self.request_lock:
+            cached = self.request_cache.get(key)
+            if cached is None or cached[0] < time.monotonic():
+                try:
+                    frame = await self.request_upstream(msg_type, request, reply_type)
+                except (OSError, ConnectionError) as e:
+                    self.request_connection = None
+                    self.send_message(client_id, ERROR, {"message": f"Could not reach the game server: {e}"})
+                    return
+                cached = (time.monotonic() + RELAY_LIST_CACHE_TTL, frame)
+                self.request_cache = {k: v for k, v in self.request_cache.items() if v[0] >= time.monotonic()}
+                self.request_cache[key] = cached
+        self.enqueue_frame(client_id, reply_type, cached[1])
+
+    async def request_upstream(self, msg_type, data, reply_type):
+        """Send a request over the shared upstream connection and return the answering frame"""
+        if self.request_connection is None:
+            reader, writer = await asyncio.open_connection(*self.upstream)
+            self.request_connection = (reader, writer, FrameDecoder(read_size=65536))
+        reader, writer, decoder = self.request_connection
+        writer.write(create_message(msg_type, data) + b'\n')
+        while True:
+            for _, message in decoder.frames():
+                if parse_message(message)[0] in (reply_type, ERROR):
+                    return message + b'\n'
+            data = await reader.read(65536)
+            if not data:
+                raise ConnectionError("connection closed")
+            decoder.feed(data)
+
+    def send_message(self, client_id, msg_type, data):
+        """Send a message to a specific spectator"""
+        self.enqueue_frame(client_id, msg_type, create_message(msg_type, data) + b'\n')
+
+    def enqueue_frame(self, client_id, msg_type, frame):
+        """Queue a frame for a spectator, resyncing or dropping it if it has fallen behind"""
+        queue = self.client_queues.get(client_id)
+        if queue is None or queue.put(msg_type, frame):
+            return
+
+        queue.overflows += 1
+        if queue.overflows > OUTBOUND_MAX_RESYNCS:
+            print(f"Spectator {client_id} is not keeping up, disconnecting")
+            self.disconnect_client(client_id)
+            return
+
+        # Replace the backlog with the current state of the spectator's game
+        queue.clear()
+        feed = self.feeds.get(self.client_feed.get(client_id))
+        if feed is not None and feed.state is not None:
+            queue.put(GAME_STATE, feed.snapshot_frame())
+        if msg_type not in (GAME_STATE, GAME_DELTA, TIME_UPDATE):
+            queue.put(msg_type, frame)
+
+    def disconnect_client(self, client_id):
+        """Forget a spectator and close its connection"""
+        writer = self.clients.pop(client_id, None)
+        if writer is None:
+            return
+        self.unwatch(client_id)
+        self.client_features.pop(client_id, None)
+        self.client_queues.pop(client_id).close()
+        writer.transport.abort()
+
+def parse_address(address, default_port):
+    host, _, port = address.rpartition(":")
+    return (host or SERVER_HOST), int(port or default_port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Spectator relay for a chess server")
+    parser.add_argument("--listen", default=f"{SERVER_HOST}:{RELAY_PORT}", help="host:port to accept spectators on")
+    parser.add_argument("--upstream", default=f"{SERVER_HOST}:{SERVER_PORT}",
+                        help="host:port of the game server, or of another relay")
+    args = parser.parse_args()
+    relay = SpectatorRelay(*parse_address(args.listen, RELAY_PORT), *parse_address(args.upstream, SERVER_PORT))
+    relay.start()
@@ -1,163 +1,259 @@
+import hmac
+import signal
 import socket
 import threading
 import time
 import select
 import uuid
-import chess
 from communication import *
+from framing import FrameDecoder
 from game_logic import ChessGame
+from clock_scheduler import *
+from matchmaking import Matchmaker
+from game_directory import GameDirectory, LISTED_STATUSES
+from outbound import OutboundQueue
+from journal import *
+from game_archive import GameArchive, resident_memory
+from metrics import MetricsRegistry, MetricsEndpoint, BYTES_BUCKETS
+from profiler import SamplingProfiler
+from sessions import SessionTable, ReplayBuffer
+from chat import ChatLimiter, history_page
 from config import *
 
 class ChessServer:
-    def __init__(self, host=SERVER_HOST, port=SERVER_PORT):
+    # Handlers sampled while a profiling window is open
+    PROFILED_METHODS = ("process_message", "update_games", "broadcast_to_game", "send_message")
+    
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, listen=True, journal_path=JOURNAL_PATH,
+                 archive_path=ARCHIVE_PATH):
         self.host = host
         self.port = port
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(MAX_PLAYERS_IN_LOBBY)
+        self.server_socket = None
+        if listen:
+            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind((self.host, self.port))
+            self.server_socket.listen(MAX_PLAYERS_IN_LOBBY)
         
         self.clients = {}  # {client_id: (conn, addr, player_name)}
-        self.lobby = []    # List of client_ids waiting for a game
+        self.lobby = Matchmaker()  # Players waiting for a game
         self.games = {}    # {game_id: ChessGame}
         self.client_game = {}  # {client_id: game_id}
+        self.directory = GameDirectory()  # Listable games, kept current by game_updated()
+        self.game_events = {}  # {game_id: ReplayBuffer of the events broadcast to it}
+        self.sessions = SessionTable()  # Players who can resume after their connection drops
+        self.orphaned_games = set()  # recovered games none of whose players has come back yet
+        self.chat_limiter = ChatLimiter()
+        self.chat_batches = {}  # {game_id: chat entries waiting for the game's next CHAT_BATCH}
+        self.archive = GameArchive(archive_path)  # Finished games, evicted from self.games after a grace period
+        
+        # Clients that negotiated the binary wire format, sharing one id table
+        self.client_codecs = {}  # {client_id: BinaryCodec}
+        self.id_table = IdTable()
+        self.client_features = {}  # {client_id: OPTIONAL_MESSAGES the client understands}
+        
+        # Encoded frames waiting for each connection's writer
+        self.client_queues = {}  # {client_id: OutboundQueue}
+        self.client_traffic = {}  # {client_id: [bytes received, bytes sent]}
+        self.setup_metrics()
+        self.profiler = None  # SamplingProfiler while a profiling window is open
+        self.last_profile = None  # summary of the last finished window
+        
+        # Game clocks are driven by one scheduler rather than by each client's loop.
+        # self.lock serialises client threads and the scheduler thread.
+        self.clock_scheduler = ClockScheduler()
+        self.lock = threading.RLock()
+        self.clock_wakeup = threading.Condition(self.lock)
+        if MEMORY_LOG_INTERVAL:
+            self.clock_scheduler.schedule(MEMORY_STATS, MEMORY_STATS, time.monotonic() + MEMORY_LOG_INTERVAL)
+        if METRICS_LOG_INTERVAL:
+            self.clock_scheduler.schedule(METRICS_LOG, METRICS_LOG, time.monotonic() + METRICS_LOG_INTERVAL)
         
-        print(f"Server started on {self.host}:{self.port}")
+        # Games in progress survive a restart by replaying the move journal
+        self.journal = None
+        if journal_path:
+            self.journal = GameJournal(journal_path)
+            self.recover_games(journal_path)
+            self.compact_journal()
+        
+        if listen:
+            print(f"Server started on {self.host}:{self.port}")
         
     def start(self):
         """Start the server"""
+        self.start_metrics_endpoint()
+        self.install_profile_signal()
+        clock_thread = threading.Thread(target=self.run_clock_scheduler)
+        clock_thread.daemon = True
+        clock_thread.start()
+        
         try:
             while True:
                 client_socket, address = self.server_socket.accept()
                 client_id = str(uuid.uuid4())
-                self.clients[client_id] = (client_socket, address, None)
+                ready = threading.Event()
+                with self.lock:
+                    self.add_client(client_id, client_socket, address, wakeup=ready.set)
+                    queue = self.client_queues[client_id]
+                    traffic = self.client_traffic[client_id]
                 
                 print(f"New connection from {address}, assigned ID: {client_id}")
                 
-                # Start a new thread to handle this client
-                client_thread = threading.Thread(target=self.handle_client, args=(client_id,))
+                # Start a thread to read from this client and one to write to it. They are handed
+                # the connection's state, which a disconnect can remove from the tables at any time.
+                client_thread = threading.Thread(target=self.handle_client, args=(client_id, client_socket, traffic))
                 client_thread.daemon = True
                 client_thread.start()
                 
+                writer_thread = threading.Thread(target=self.write_client,
+                                                 args=(client_id, client_socket, queue, traffic, ready))
+                writer_thread.daemon = True
+                writer_thread.start()
+                
         except KeyboardInterrupt:
             print("Server shutting down...")
         finally:
             self.server_socket.close()
+            self.close_journal()
+    
+    def close_journal(self):
+        """Commit whatever the journal still has queued, on shutdown"""
+        with self.lock:
+            journal, self.journal = self.journal, None  # Nothing is journaled after this
+        if journal is not None:
+            journal.close()
     
-    def handle_client(self, client_id):
+    def add_client(self, client_id, conn, address, wakeup=None):
+        """Register a new connection"""
+        self.clients[client_id] = (conn, address, None)
+        self.client_queues[client_id] = OutboundQueue(wakeup=wakeup)
+        self.client_traffic[client_id] = [0, 0]
+    
+    def write_client(self, client_id, client_socket, queue, traffic, ready):
+        """Drain a client's outbound queue onto its socket"""
+        try:
+            while True:
+                ready.wait()
+                with self.lock:
+                    ready.clear()
+                    if queue.closed:
+                        break
+                    frames = queue.take()
+                
+                # Send outside the lock so a slow reader only stalls its own writer
+                if frames:
+                    payload = b"".join(frames)
+                    client_socket.sendall(payload)
+                    traffic[1] += len(payload)
+        except Exception as e:
+            if not queue.closed:
+                print(f"Error sending message to client {client_id}: {e}")
+            with self.lock:
+                self.disconnect_client(client_id)
+    
+    def handle_client(self, client_id, client_socket, traffic):
         """Handle communication with a client"""
-        client_socket = self.clients[client_id][0]
-        
         try:
-            # Set socket to non-blocking mode
-            client_socket.setblocking(False)
-            
-            buffer = b""
+            decoder = FrameDecoder()
             
             while True:
-                # Try to receive data
-                try:
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break  # Client disconnected
-                    
-                    buffer += data
-                    
-                    # Process complete messages
-                    while b'\n' in buffer:
-                        message, buffer = buffer.split(b'\n', 1)
-                        self.process_message(client_id, message)
-                        
-                except socket.error:
-                    # No data available, continue
-                    pass
+                # Block until data arrives; clocks are handled by the scheduler thread
+                count = decoder.recv_into(client_socket)
+                if not count:
+                    break  # Client disconnected
                 
-                # Update game timers and send updates
-                self.update_games(client_id)
+                traffic[0] += count
                 
-                time.sleep(0.1)  # Prevent CPU hogging
+                # Process complete messages
+                with self.lock:
+                    self.process_frames(client_id, decoder)
                 
         except Exception as e:
             print(f"Error handling client {client_id}: {e}")
         finally:
-            self.disconnect_client(client_id)
+            with self.lock:
+                self.disconnect_client(client_id)
     
-    def process_message(self, client_id, message):
+    def process_frames(self, client_id, decoder):
+        """Process every complete frame the client's FrameDecoder holds"""
+        for is_binary, message in decoder.frames():
+            self.process_message(client_id, message, is_binary)
+    
+    def process_message(self, client_id, message, is_binary=False):
         """Process a message received from a client"""
-        msg_type, data = parse_message(message)
+        start = time.perf_counter()
+        codec = self.client_codecs.get(client_id)
+        if is_binary and codec is not None:
+            msg_type, data = codec.decode(message)
+        elif is_binary:
+            msg_type, data = ERROR, {"error": "Binary codec was not negotiated"}
+        else:
+            msg_type, data = parse_message(message)
         
+        self.handle_message(client_id, msg_type, data)
+        self.message_latency.observe(time.perf_counter() - start, message_label(msg_type))
+    
+    def handle_message(self, client_id, msg_type, data):
+        """Act on a decoded message from a client"""
         if msg_type == JOIN_LOBBY:
             player_name = data.get("player_name", f"Player_{client_id[:5]}")
             self.clients[client_id] = (self.clients[client_id][0], self.clients[client_id][1], player_name)
-            self.lobby.append(client_id)
+            self.negotiate_codec(client_id, data.get("codecs", []))
+            self.negotiate_features(client_id, data.get("features"))
+            
+            time_control = data.get("time_control", DEFAULT_TIME_LIMIT)
+            if time_control not in TIME_CONTROLS:
+                time_control = DEFAULT_TIME_LIMIT
+            try:
+                rating = int(data.get("rating", DEFAULT_RATING))
+            except (TypeError, ValueError, OverflowError):  # JSON allows Infinity and NaN
+                rating = DEFAULT_RATING
+            self.lobby.add(client_id, time_control, rating)
             print(f"{player_name} joined the lobby")
             
+            # The token lets the player take their seat back from a new connection
+            session = self.sessions.for_client(client_id) or self.sessions.create(client_id, player_name)
+            session.player_name = player_name
+            session.lobby = (time_control, rating)
+            self.send_message(client_id, SESSION, {"token": session.token, "resume_grace": RESUME_GRACE})
+            
             # Try to match players
-            self.match_players()
+            self.match_players(client_id)
             
         elif msg_type == LIST_GAMES:
-            # Send list of active games to the client
-            active_games = []
-            for game_id, game in self.games.items():
-                if game.game_status == "active" or game.game_status == "waiting":
-                    white_name = self.clients[game.white_player][2] if game.white_player in self.clients else "Unknown"
-                    black_name = self.clients[game.black_player][2] if game.black_player in self.clients else "Waiting..."
-                    
-                    active_games.append({
-                        "game_id": game_id,
-                        "white_player": white_name,
-                        "black_player": black_name,
-                        "status": game.game_status,
-                        "spectator_count": len(game.spectators)
-                    })
+            # Send one page of active games to the client
+            try:
+                cursor = int(data.get("cursor") or 0)
+                limit = max(1, min(int(data.get("limit") or GAMES_PAGE_SIZE), MAX_GAMES_PAGE_SIZE))
+                time_control = data.get("time_control")
+                min_spectators = int(data.get("min_spectators") or 0)
+            except (TypeError, ValueError, OverflowError):
+                self.send_message(client_id, ERROR, {"message": "Invalid game list request"})
+                return
+            status = data.get("status")
+            if status and status not in LISTED_STATUSES:
+                self.send_message(client_id, ERROR, {"message": "Invalid game list request"})
+                return
             
-            self.send_message(client_id, GAMES_LIST, {"games": active_games})
+            games, next_cursor = self.list_games(cursor, limit, status, time_control, min_spectators)
+            self.send_message(client_id, GAMES_LIST, {
+                "games": games,
+                "cursor": cursor,
+                "next_cursor": next_cursor
+            })
             
         elif msg_type == CREATE_GAME:
             # Create a new game and add the client as the first player
-            game_id = str(uuid.uuid4())
-            self.games[game_id] = ChessGame(game_id, white_player=client_id)
-            self.client_game[client_id] = game_id
-            
-            # Confirm game creation
-            self.send_message(client_id, PLAYER_ASSIGNED, {
-                "color": "white",
-                "game_id": game_id,
-                "status": "waiting"
-            })
-            
-            print(f"New game {game_id} created by {self.clients[client_id][2]}")
+            self.create_game(client_id)
             
         elif msg_type == SPECTATE_GAME:
-            game_id = data.get("game_id")
-            if game_id in self.games:
-                game = self.games[game_id]
-                spectator_name = self.clients[client_id][2]
-                
-                # Add the spectator to the game
-                if game.add_spectator(client_id):
-                    self.client_game[client_id] = game_id
-                    
-                    # Send current game state to the spectator
-                    self.send_message(client_id, GAME_STATE, game.get_game_state())
-                    
-                    # Notify all players and other spectators that a new spectator joined
-                    self.broadcast_to_game(game_id, SPECTATOR_JOINED, {
-                        "spectator_name": spectator_name,
-                        "spectator_count": len(game.spectators)
-                    })
-                    
-                    # Also send a system chat message to notify everyone
-                    chat_entry = game.add_chat_message("System", f"{spectator_name} joined as a spectator")
-                    self.broadcast_to_game(game_id, CHAT_MESSAGE, chat_entry)
-                    
-                    print(f"{spectator_name} is now spectating game {game_id}")
-                else:
-                    # Already spectating this game
-                    self.send_message(client_id, ERROR, {"message": "You are already spectating this game"})
-            else:
-                # Game not found
-                self.send_message(client_id, ERROR, {"message": "Game not found. Please check the game ID."})
+            self.negotiate_features(client_id, data.get("features"))
+            self.add_spectator(client_id, data.get("game_id"))
+            
+        elif msg_type == RELAY_SUBSCRIBE:
+            # A relay re-broadcasts the game to its own spectators; it joins without announcement
+            self.negotiate_features(client_id, data.get("features"))
+            self.add_spectator(client_id, data.get("game_id"), announce=False)
             
         elif msg_type == MAKE_MOVE:
             game_id = self.client_game.get(client_id)
@@ -165,120 +261,761 @@ class ChessServer:
                 game = self.games[game_id]
                 move = data.get("move")
                 
+                was_active = game.game_status == "active"
                 success, message = game.make_move(move, client_id)
+                self.schedule_clock(game)
                 
-                # Send updated game state to all players and spectators
-                game_state = game.get_game_state()
-                
+                # Send the update to all players and spectators
                 if success:
-                    self.broadcast_to_game(game_id, GAME_STATE, game_state)
+                    self.journal_record(MOVE_MADE, game, move=game.last_move(),
+                                        white_time=game.white_time_remaining,
+                                        black_time=game.black_time_remaining)
+                    
+                    # Everyone already holds the previous version; send only the change
+                    self.broadcast_to_game(game_id, GAME_DELTA, game.get_state_delta())
                     
                     if game.game_status == "completed":
                         self.broadcast_to_game(game_id, GAME_OVER, {
                             "reason": message,
-                            "game_state": game_state
+                            "game_state": game.get_game_state()
                         })
+                        self.game_completed(game, message)
+                elif was_active and game.game_status == "completed":
+                    # The mover's flag fell before the scheduler noticed
+                    self.broadcast_to_game(game_id, GAME_OVER, {
+                        "reason": message,
+                        "game_state": game.get_game_state()
+                    })
+                    self.game_completed(game, message)
                 else:
                     # Send error only to the player who tried to make the invalid move
                     self.send_message(client_id, ERROR, {"message": message})
         
-        elif msg_type == CHAT_MESSAGE:
+        elif msg_type == CLAIM_DRAW:
+            # Threefold repetition and the 50-move rule end the game only when a player asks
             game_id = self.client_game.get(client_id)
             if game_id and game_id in self.games:
                 game = self.games[game_id]
-                message = data.get("message")
+                was_active = game.game_status == "active"
+                success, message = game.claim_draw(client_id)
+                if was_active and game.game_status == "completed":
+                    self.schedule_clock(game)
+                    self.broadcast_to_game(game_id, GAME_OVER, {
+                        "reason": message,
+                        "game_state": game.get_game_state()
+                    })
+                    self.game_completed(game, message)
+                else:
+                    self.send_message(client_id, ERROR, {"message": message})
+        
+        elif msg_type == PROFILE:
+            self.handle_profile(client_id, data)
+        
+        elif msg_type == RESUME_SESSION:
+            self.resume_session(client_id, data)
+        
+        elif msg_type == REQUEST_STATE:
+            # A client detected a gap in GAME_DELTA versions and needs a full snapshot
+            game_id = self.client_game.get(client_id)
+            if game_id and game_id in self.games:
+                self.send_message(client_id, GAME_STATE, self.game_snapshot(self.games[game_id]))
+        
+        elif msg_type == CHAT_MESSAGE:
+            game_id = self.client_game.get(client_id)
+            message = data.get("message")
+            if game_id and game_id in self.games and isinstance(message, str) and message.strip():
+                allowed, warn = self.chat_limiter.allow(client_id, time.monotonic())
+                if not allowed:
+                    if warn:
+                        self.send_message(client_id, ERROR, {"message": "You are sending messages too fast"})
+                    return
+                
                 sender_name = self.clients[client_id][2]
+                self.post_chat(self.games[game_id], sender_name, message[:CHAT_MAX_LENGTH])
+        
+        elif msg_type == CHAT_HISTORY:
+            self.send_chat_history(client_id, data)
+    
+    def add_spectator(self, client_id, game_id, announce=True):
+        """Add a client to a game's spectators and send it the game state"""
+        if game_id in self.games:
+            game = self.games[game_id]
+            spectator_name = self.clients[client_id][2]
+            
+            # Add the spectator to the game
+            if game.add_spectator(client_id):
+                self.client_game[client_id] = game_id
                 
-                chat_entry = game.add_chat_message(sender_name, message)
+                # Send current game state to the spectator
+                self.send_message(client_id, GAME_STATE, self.game_snapshot(game))
+                self.game_updated(game)
+                if not announce:
+                    print(f"Relay {client_id} subscribed to game {game_id}")
+                    return
                 
-                # Broadcast chat message to everyone in the game
-                self.broadcast_to_game(game_id, CHAT_MESSAGE, chat_entry)
-    
-    def match_players(self):
-        """Match waiting players in the lobby"""
-        while len(self.lobby) >= 2:
-            white_player = self.lobby.pop(0)
-            black_player = self.lobby.pop(0)
-            
-            # Create a new game
+                # Notify all players and other spectators that a new spectator joined
+                self.broadcast_to_game(game_id, SPECTATOR_JOINED, {
+                    "spectator_name": spectator_name,
+                    "spectator_count": len(game.spectators)
+                })
+                
+                # Also send a system chat message to notify everyone
+                self.post_chat(game, "System", f"{spectator_name} joined as a spectator")
+                
+                print(f"{spectator_name} is now spectating game {game_id}")
+            else:
+                # Already spectating this game
+                self.send_message(client_id, ERROR, {"message": "You are already spectating this game"})
+        elif game_id in self.archive:
+            result = self.archive.get(game_id)["result"]
+            self.send_message(client_id, ERROR, {"message": f"That game has finished ({result})."})
+        else:
+            # Game not found
+            self.send_message(client_id, ERROR, {"message": "Game not found. Please check the game ID."})
+    
+    def post_chat(self, game, sender_name, message):
+        """Record a chat line and queue it for the game's next CHAT_BATCH"""
+        chat_entry = game.add_chat_message(sender_name, message)
+        batch = self.chat_batches.get(game.game_id)
+        if batch is not None:
+            batch.append(chat_entry)
+            return
+        
+        # The first line opens a batching window; everything said within it goes out in one frame
+        self.chat_batches[game.game_id] = [chat_entry]
+        self.clock_scheduler.schedule(game.game_id, CHAT_FLUSH, time.monotonic() + CHAT_BATCH_WINDOW)
+        self.wake_clock_scheduler()
+    
+    def flush_chat(self, game_id):
+        """Broadcast a game's queued chat lines"""
+        entries = self.chat_batches.pop(game_id, None)
+        if entries:
+            self.broadcast_to_game(game_id, CHAT_BATCH, {"messages": entries})
+    
+    def send_chat_history(self, client_id, data):
+        """Answer CHAT_HISTORY with one page of a game's chat, older than data["before"] if given"""
+        game_id = data.get("game_id") or self.client_game.get(client_id)
+        before = data.get("before")
+        if not isinstance(game_id, (str, type(None))) or not isinstance(before, (int, type(None))):
+            self.send_message(client_id, ERROR, {"message": "Invalid chat history request"})
+            return
+        try:
+            limit = max(1, min(int(data.get("limit") or CHAT_PAGE_SIZE), CHAT_HISTORY_LIMIT))
+        except (TypeError, ValueError, OverflowError):
+            self.send_message(client_id, ERROR, {"message": "Invalid chat history request"})
+            return
+        
+        game = self.games.get(game_id)
+        if game is None:
+            self.send_message(client_id, ERROR, {"message": "Game not found. Please check the game ID."})
+            return
+        
+        messages, has_more = history_page(game.chat_history, before, limit)
+        self.send_message(client_id, CHAT_HISTORY, {
+            "game_id": game.game_id,
+            "messages": messages,
+            "has_more": has_more
+        })
+    
+    def handle_profile(self, client_id, data):
+        """Admin request to start, stop or report on a profiling window"""
+        token = data.get("token")
+        if not ADMIN_TOKEN or not isinstance(token, str) or not hmac.compare_digest(token, ADMIN_TOKEN):
+            self.send_message(client_id, ERROR, {"message": "Not authorised"})
+            return
+        
+        action = data.get("action", "status")
+        if action == "start":
+            try:
+                duration = float(data.get("duration") or PROFILE_DURATION)
+            except (TypeError, ValueError):
+                duration = PROFILE_DURATION
+            self.start_profiling(duration)
+        elif action == "stop":
+            self.stop_profiling()
+        
+        # profiling_finished clears self.profiler from the profiler's own thread
+        profiler = self.profiler
+        if profiler is not None:
+            status = profiler.summary()
+        else:
+            status = self.last_profile or {"running": False}
+        self.send_message(client_id, PROFILE_STATUS, status)
+    
+    def negotiate_codec(self, client_id, codecs):
+        """Switch a client to the binary wire format if both sides support it"""
+        if not ENABLE_BINARY_PROTOCOL or CODEC_BINARY not in codecs or client_id in self.client_codecs:
+            return
+        
+        # The acknowledgement goes out in JSON; everything after it is binary
+        self.send_message(client_id, CODEC_SELECTED, {"codec": CODEC_BINARY})
+        if client_id in self.clients:
+            self.client_codecs[client_id] = BinaryCodec(self.id_table)
+    
+    def negotiate_features(self, client_id, features):
+        """Record which OPTIONAL_MESSAGES a client understands, if it said"""
+        if isinstance(features, list):
+            self.client_features[client_id] = OPTIONAL_MESSAGES.intersection(
+                feature for feature in features if isinstance(feature, str))
+    
+    def game_snapshot(self, game):
+        """Return a game's GAME_STATE, numbered with the last event broadcast to it"""
+        events = self.game_events.get(game.game_id)
+        return {**game.get_game_state(), "seq": events.seq if events is not None else 0}
+    
+    def player_name(self, client_id, default):
+        """Return the name of a connected or detached player"""
+        if client_id in self.clients:
+            return self.clients[client_id][2]
+        session = self.sessions.for_client(client_id)
+        return session.player_name if session is not None else default
+    
+    def detach_session(self, session):
+        """Hold a dropped player's seat until RESUME_GRACE runs out"""
+        client_id = session.client_id
+        session.detached = True
+        session.in_lobby = client_id in self.lobby
+        if session.in_lobby:
+            self.lobby.remove(client_id)
+        self.clock_scheduler.schedule(session.token, SESSION_EXPIRY, time.monotonic() + RESUME_GRACE)
+        self.wake_clock_scheduler()
+        self.player_detached(client_id)
+    
+    def player_detached(self, client_id):
+        """Tell the rest of a game that one of its players lost their connection"""
+        game = self.games.get(self.client_game.get(client_id))
+        if game is None or game.game_status != "active" or client_id not in (game.white_player, game.black_player):
+            return
+        name = self.player_name(client_id, "A player")
+        self.post_chat(game, "System", f"{name} lost connection; waiting {RESUME_GRACE}s for them to return")
+    
+    def expire_session(self, token):
+        """A dropped player did not come back in time: treat them as gone"""
+        session = self.sessions.get(token)
+        if session is None or not session.detached:
+            return
+        print(f"Session of {session.player_name} expired")
+        self.leave(session.client_id)
+        self.sessions.remove(session)
+        self.client_game.pop(session.client_id, None)
+        self.release_id(session.client_id)
+    
+    def resume_session(self, client_id, data):
+        """Move a session onto a new connection and replay the game events it missed"""
+        session = self.sessions.get(data.get("token"))
+        if session is None or session.client_id == client_id:
+            self.send_message(client_id, SESSION_RESUMED, {"resumed": session is not None})
+            return
+        
+        old_id = session.client_id
+        if old_id in self.clients:
+            # The old connection has not been noticed to be dead yet
+            self.disconnect_client(old_id)
+        self.clock_scheduler.cancel(session.token, SESSION_EXPIRY)
+        session.detached = False
+        self.sessions.rebind(session, client_id)
+        self.clients[client_id] = (self.clients[client_id][0], self.clients[client_id][1], session.player_name)
+        self.negotiate_codec(client_id, data.get("codecs", []))
+        self.negotiate_features(client_id, data.get("features"))
+        self.send_message(client_id, SESSION_RESUMED, {"resumed": True})
+        print(f"{session.player_name} resumed their session")
+        
+        try:
+            seq = int(data.get("seq") or 0)
+        except (TypeError, ValueError):
+            seq = 0
+        self.rejoin_game(old_id, client_id, seq)
+        self.release_id(old_id)
+        
+        if session.in_lobby and session.lobby is not None:
+            self.lobby.add(client_id, *session.lobby)
+            self.match_players(client_id)
+    
+    def rejoin_game(self, old_id, client_id, seq):
+        """Give a resumed client its old connection's place in a game and catch it up from seq.
+
+        seq None only moves the place, without sending anything.
+        """
+        game_id = self.client_game.pop(old_id, None)
+        game = self.games.get(game_id)
+        if game is None:
+            return
+        if game.white_player == old_id:
+            game.white_player = client_id
+        elif game.black_player == old_id:
+            game.black_player = client_id
+        elif old_id in game.spectators:
+            game.spectators.discard(old_id)
+            game.spectators.add(client_id)
+        else:
+            return
+        self.client_game[client_id] = game_id
+        if client_id in (game.white_player, game.black_player):
+            self.orphaned_games.discard(game_id)
+        if seq is None:
+            return
+        
+        # Replay the missed events if they are all still buffered, else start over from a snapshot
+        events = self.game_events.get(game_id)
+        missed = events.since(seq) if events is not None else None
+        features = self.client_features.get(client_id, ())
+        if missed is not None and GAME_DELTA not in features and any(msg_type == GAME_DELTA for msg_type, _ in missed):
+            missed = None  # Only a snapshot brings a client without deltas up to date
+        if missed is None:
+            self.send_message(client_id, GAME_STATE, self.game_snapshot(game))
+        else:
+            for msg_type, event in missed:
+                if msg_type == CHAT_BATCH and CHAT_BATCH not in features:
+                    for chat_type, chat in legacy_chat_messages(event):
+                        self.send_message(client_id, chat_type, chat)
+                else:
+                    self.send_message(client_id, msg_type, event)
+        
+        if game.game_status == "active":
+            # TIME_UPDATEs are not replayed; send the clocks as they stand
+            white_time, black_time = game.time_remaining(time.monotonic())
+            self.send_message(client_id, TIME_UPDATE, {
+                "white_time": white_time,
+                "black_time": black_time,
+                "server_time": time.time()
+            })
+            if client_id in (game.white_player, game.black_player):
+                self.post_chat(game, "System", f"{self.player_name(client_id, 'A player')} reconnected")
+    
+    def match_players(self, client_id=None):
+        """Match waiting players in the lobby: just client_id when it has only now joined, else everyone"""
+        if client_id is not None:
+            match = self.lobby.match(client_id)
+            matches = [match] if match is not None else []
+        else:
+            matches = self.lobby.pop_matches()
+        
+        for white_player, black_player, time_control in matches:
+            self.start_game(str(uuid.uuid4()), white_player, black_player, time_control)
+        
+        # Players still waiting get a wider search window as time passes
+        if len(self.lobby) and not self.clock_scheduler.is_scheduled(LOBBY_WIDEN, LOBBY_WIDEN):
+            self.clock_scheduler.schedule(LOBBY_WIDEN, LOBBY_WIDEN, time.monotonic() + MATCH_WIDEN_INTERVAL)
+            self.wake_clock_scheduler()
+    
+    def start_game(self, game_id, white_player, black_player, time_control=DEFAULT_TIME_LIMIT):
+        """Create a game between two matched players and start white's clock"""
+        game = ChessGame(game_id, white_player=white_player, black_player=black_player,
+                         time_limit_mins=time_control)
+        self.games[game_id] = game
+        self.journal_record(GAME_CREATED, game, white=white_player, black=black_player,
+                            time_limit=game.time_limit, seats=self.game_seats(game))
+        
+        # Update client-game mappings
+        self.client_game[white_player] = game_id
+        self.client_game[black_player] = game_id
+        
+        # Notify players
+        self.send_message(white_player, PLAYER_ASSIGNED, {
+            "color": "white",
+            "game_id": game_id,
+            "status": "active"
+        })
+        
+        self.send_message(black_player, PLAYER_ASSIGNED, {
+            "color": "black",
+            "game_id": game_id,
+            "status": "active"
+        })
+        
+        # Send initial game state and start white's clock
+        game_state = game.get_game_state()
+        self.broadcast_to_game(game_id, GAME_STATE, game_state)
+        self.schedule_clock(game)
+        self.game_updated(game)
+        
+        print(f"Matched players: {self.clients[white_player][2]} (White) vs {self.clients[black_player][2]} (Black) in game {game_id}")
+    
+    def create_game(self, client_id, game_id=None):
+        """Create a game with the client as white, waiting for an opponent"""
+        if game_id is None:
             game_id = str(uuid.uuid4())
-            game = ChessGame(game_id, white_player=white_player, black_player=black_player)
+        if client_id in self.lobby:
+            self.lobby.remove(client_id)  # Don't get matched into a second game
+        game = ChessGame(game_id, white_player=client_id)
+        self.games[game_id] = game
+        self.journal_record(GAME_CREATED, game, white=client_id, black=None, time_limit=game.time_limit,
+                            seats=self.game_seats(game))
+        self.client_game[client_id] = game_id
+        
+        # Confirm game creation
+        self.send_message(client_id, PLAYER_ASSIGNED, {
+            "color": "white",
+            "game_id": game_id,
+            "status": "waiting"
+        })
+        self.game_updated(game)
+        
+        print(f"New game {game_id} created by {self.clients[client_id][2]}")
+    
+    def list_games(self, cursor=0, limit=GAMES_PAGE_SIZE, status=None, time_control=None, min_spectators=0):
+        """Return (games, next_cursor) for one page of games that are waiting or in progress"""
+        return self.directory.page(cursor, limit, status, time_control, min_spectators)
+    
+    def summarize_game(self, game):
+        """Return the GAMES_LIST entry for a game"""
+        white_name = self.player_name(game.white_player, "Unknown")
+        black_name = self.player_name(game.black_player, "Waiting...")
+        
+        return {
+            "game_id": game.game_id,
+            "white_player": white_name,
+            "black_player": black_name,
+            "status": game.game_status,
+            "time_control": game.time_limit // 60,
+            "spectator_count": len(game.spectators)
+        }
+    
+    def game_updated(self, game):
+        """Refresh a game's directory entry whenever it may have changed"""
+        self.directory.update(game.game_id, self.summarize_game(game))
+    
+    def game_completed(self, game, reason):
+        """Record a finished game once its GAME_OVER has gone out and schedule its eviction"""
+        self.journal_record(GAME_COMPLETED, game, reason=reason)
+        self.game_updated(game)
+        
+        white_name = self.player_name(game.white_player, "Unknown")
+        black_name = self.player_name(game.black_player, "Unknown")
+        self.archive.add(game, reason, white_name, black_name)
+        game.release_board()
+        self.clock_scheduler.schedule(game.game_id, EVICT_GAME, time.monotonic() + GAME_ARCHIVE_GRACE)
+        self.wake_clock_scheduler()
+        
+        if self.journal is not None and self.journal.bytes_written > JOURNAL_COMPACT_BYTES:
+            self.compact_journal()
+    
+    def journal_record(self, op, game, **fields):
+        """Append a record about a game to the journal, if there is one"""
+        if self.journal is not None:
+            self.journal.append(op, game.game_id, **fields)
+    
+    def session_token(self, client_id):
+        """Return the token of a client's session, or None"""
+        session = self.sessions.for_client(client_id)
+        return session.token if session is not None else None
+    
+    def game_seats(self, game):
+        """Return the journal's seats entry for a game: {client_id: [session token, player name]}"""
+        seats = {}
+        for client_id in (game.white_player, game.black_player):
+            token = self.session_token(client_id)
+            if token is not None:
+                seats[client_id] = [token, self.player_name(client_id, None)]
+        return seats
+    
+    def recover_games(self, journal_path):
+        """Rebuild the unfinished games recorded in a journal, holding each seat for its player to resume"""
+        start = time.perf_counter()
+        for game_id, state in replay_journal(journal_path).items():
+            game = ChessGame(game_id, white_player=state["white"], black_player=state["black"],
+                             time_limit_mins=state["time_limit"] // 60)
+            try:
+                game.restore(state["moves"], state["white_time"], state["black_time"])
+            except ValueError as e:
+                print(f"Could not recover game {game_id}: {e}")
+                continue
+            if game.position()[1] is not None:
+                continue  # Finished just before the crash; its completion record was lost
+            
             self.games[game_id] = game
+            self.orphaned_games.add(game_id)
+            self.schedule_clock(game)
+            seats = state["seats"]
+            for client_id, (token, player_name) in seats.items():
+                if client_id in (game.white_player, game.black_player):
+                    self.restore_seat(game, client_id, token, player_name)
+            self.game_updated(game)
+            
+            if any(player is not None and player not in seats for player in (game.white_player, game.black_player)):
+                # Journaled without a session, so that player can never come back
+                self.abort_game(game)
+        
+        if self.games:
+            print(f"Recovered {len(self.games)} games from {journal_path} in {time.perf_counter() - start:.2f}s")
+    
+    def restore_seat(self, game, client_id, token, player_name):
+        """Hold a recovered game's seat for its player, as though their connection had just dropped"""
+        self.client_game[client_id] = game.game_id
+        self.hold_session(client_id, token, player_name)
+    
+    def hold_session(self, client_id, token, player_name):
+        """Recreate a recovered player's session, detached until they resume it or RESUME_GRACE runs out"""
+        self.sessions.restore(token, client_id, player_name)
+        self.clock_scheduler.schedule(token, SESSION_EXPIRY, time.monotonic() + RESUME_GRACE)
+    
+    def abort_game(self, game, reason="Game aborted: the players did not return after the server restarted"):
+        """End a game with no result, e.g. one nobody came back to after a restart"""
+        game.end_game()
+        self.schedule_clock(game)
+        self.broadcast_to_game(game.game_id, GAME_OVER, {
+            "reason": reason,
+            "game_state": game.get_game_state()
+        })
+        self.game_completed(game, reason)
+    
+    def compact_journal(self):
+        """Rewrite the journal as one snapshot record per unfinished game"""
+        now = time.monotonic()
+        records = []
+        for game in self.games.values():
+            if game.game_status == "completed":
+                continue
+            white_time, black_time = game.time_remaining(now)
+            records.append((GAME_SNAPSHOT, game.game_id, {
+                "white": game.white_player,
+                "black": game.black_player,
+                "time_limit": game.time_limit,
+                "moves": game.move_list(),
+                "white_time": white_time,
+                "black_time": black_time,
+                "seats": self.game_seats(game)
+            }))
+        self.journal.rewrite(records)
+    
+    def schedule_clock(self, game):
+        """Arm the flag-fall and clock-update timers for a game, or disarm them once it is over"""
+        if game.game_status != "active":
+            self.clock_scheduler.cancel(game.game_id, FLAG_FALL)
+            self.clock_scheduler.cancel(game.game_id, CLOCK_TICK)
+            self.clock_scheduler.cancel(game.game_id, JOURNAL_CLOCK)
+            return
+        
+        self.clock_scheduler.schedule(game.game_id, FLAG_FALL, game.flag_deadline())
+        if not self.clock_scheduler.is_scheduled(game.game_id, CLOCK_TICK):
+            self.clock_scheduler.schedule(game.game_id, CLOCK_TICK, time.monotonic() + TIME_UPDATE_INTERVAL)
+        if self.journal is not None and not self.clock_scheduler.is_scheduled(game.game_id, JOURNAL_CLOCK):
+            self.clock_scheduler.schedule(game.game_id, JOURNAL_CLOCK, time.monotonic() + JOURNAL_CLOCK_INTERVAL)
+        self.wake_clock_scheduler()
+    
+    def wake_clock_scheduler(self):
+        """Let the scheduler thread recompute how long to sleep"""
+        with self.clock_wakeup:
+            self.clock_wakeup.notify()
+    
+    def run_clock_scheduler(self):
+        """Sleep until the next timer is due and fire it"""
+        with self.clock_wakeup:
+            while True:
+                deadline = self.clock_scheduler.next_deadline()
+                timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                self.clock_wakeup.wait(timeout)
+                self.update_games()
+    
+    def update_games(self, now=None):
+        """Fire every due timer: end games whose flag fell, send time updates, journal clocks and widen lobby searches"""
+        if now is None:
+            now = time.monotonic()
+        
+        for game_id, kind, deadline in self.clock_scheduler.pop_due(now):
+            self.timer_lag.observe(now - deadline, kind)
             
-            # Update client-game mappings
-            self.client_game[white_player] = game_id
-            self.client_game[black_player] = game_id
+            if kind == LOBBY_WIDEN:
+                self.match_players()
+                continue
             
-            # Notify players
-            self.send_message(white_player, PLAYER_ASSIGNED, {
-                "color": "white",
-                "game_id": game_id,
-                "status": "active"
-            })
+            if kind == MEMORY_STATS:
+                print(f"Memory: {self.memory_stats()}")
+                self.clock_scheduler.schedule(MEMORY_STATS, MEMORY_STATS, deadline + MEMORY_LOG_INTERVAL)
+                continue
             
-            self.send_message(black_player, PLAYER_ASSIGNED, {
-                "color": "black",
-                "game_id": game_id,
-                "status": "active"
-            })
+            if kind == METRICS_LOG:
+                print(f"Metrics: {self.metrics.snapshot()}")
+                self.clock_scheduler.schedule(METRICS_LOG, METRICS_LOG, deadline + METRICS_LOG_INTERVAL)
+                continue
             
-            # Send initial game state
-            game_state = game.get_game_state()
-            self.broadcast_to_game(game_id, GAME_STATE, game_state)
+            if kind == EVICT_GAME:
+                self.evict_game(game_id)
+                continue
             
-            print(f"Matched players: {self.clients[white_player][2]} (White) vs {self.clients[black_player][2]} (Black) in game {game_id}")
-    
-    def update_games(self, client_id):
-        """Update game timers and send updates to clients"""
-        game_id = self.client_game.get(client_id)
-        if not game_id or game_id not in self.games:
-            return
+            if kind == CHAT_FLUSH:
+                self.flush_chat(game_id)
+                continue
             
-        game = self.games[game_id]
-        if game.game_status != "active":
-            return
+            if kind == SESSION_EXPIRY:
+                self.expire_session(game_id)  # Keyed by session token
+                continue
             
-        # Update timers
-        current_time = time.time()
-        if game.last_move_time:
-            elapsed = current_time - game.last_move_time
-            if game.board.turn == chess.WHITE:
-                if client_id == game.white_player:
-                    game.white_time_remaining -= elapsed
-                    game.last_move_time = current_time
-                    
-                    # Check for timeout
-                    if game.white_time_remaining <= 0:
-                        game.white_time_remaining = 0
-                        game.game_status = "completed"
-                        
-                        # Notify players of game over
-                        self.broadcast_to_game(game_id, GAME_OVER, {
-                            "reason": "White ran out of time. Black wins!",
-                            "game_state": game.get_game_state()
-                        })
-            else:
-                if client_id == game.black_player:
-                    game.black_time_remaining -= elapsed
-                    game.last_move_time = current_time
-                    
-                    # Check for timeout
-                    if game.black_time_remaining <= 0:
-                        game.black_time_remaining = 0
-                        game.game_status = "completed"
-                        
-                        # Notify players of game over
-                        self.broadcast_to_game(game_id, GAME_OVER, {
-                            "reason": "Black ran out of time. White wins!",
-                            "game_state": game.get_game_state()
-                        })
+            game = self.games.get(game_id)
+            if game is None or game.game_status != "active":
+                continue
             
-            # Send time updates every second
-            if int(current_time) != int(current_time - elapsed):
+            if kind == FLAG_FALL:
+                if game_id in self.orphaned_games and game.flag_deadline() <= now:
+                    # Nobody has been back since the restart to lose on time
+                    self.abort_game(game)
+                    continue
+                reason = game.check_flag(now)
+                if reason:
+                    self.schedule_clock(game)
+                    self.broadcast_to_game(game_id, GAME_OVER, {
+                        "reason": reason,
+                        "game_state": game.get_game_state()
+                    })
+                    self.game_completed(game, reason)
+                else:
+                    # Deadline moved (e.g. a move landed first); re-arm
+                    self.schedule_clock(game)
+            
+            elif kind == CLOCK_TICK:
+                # Clients run the clocks themselves; this only corrects their drift
+                white_time, black_time = game.time_remaining(now)
                 self.broadcast_to_game(game_id, TIME_UPDATE, {
-                    "white_time": game.white_time_remaining,
-                    "black_time": game.black_time_remaining
+                    "white_time": white_time,
+                    "black_time": black_time,
+                    "server_time": time.time()
                 })
+                self.clock_scheduler.schedule(game_id, CLOCK_TICK, deadline + TIME_UPDATE_INTERVAL)
+            
+            elif kind == JOURNAL_CLOCK:
+                # Bounds how much thinking time a crash can hand back to the side to move
+                white_time, black_time = game.time_remaining(now)
+                self.journal_record(CLOCK_SNAPSHOT, game, white_time=white_time, black_time=black_time)
+                self.clock_scheduler.schedule(game_id, JOURNAL_CLOCK, deadline + JOURNAL_CLOCK_INTERVAL)
+    
+    def evict_game(self, game_id):
+        """Drop an archived game from memory along with every reference to it"""
+        game = self.games.pop(game_id, None)
+        if game is None:
+            return
+        for client_id in (game.white_player, game.black_player, *game.spectators):
+            if self.client_game.get(client_id) == game_id:
+                del self.client_game[client_id]
+        self.game_events.pop(game_id, None)
+        self.chat_batches.pop(game_id, None)
+        self.orphaned_games.discard(game_id)
+        self.directory.update(game_id, None)
+        self.release_id(game_id)
+        for client_id in (game.white_player, game.black_player):
+            # Re-interned if the game was sent after they left
+            if client_id not in self.clients and self.sessions.for_client(client_id) is None:
+                self.release_id(client_id)
+    
+    def release_id(self, value):
+        """Free the interned handle of a game or client id that is gone"""
+        handle = self.id_table.release(value)
+        if handle is not None:
+            for codec in self.client_codecs.values():
+                codec.sent_handles.discard(handle)
+    
+    def memory_stats(self):
+        """Return counters for checking that memory stays flat over a long uptime"""
+        return {
+            "rss_bytes": resident_memory(),
+            "clients": len(self.clients),
+            "lobby": len(self.lobby),
+            "games": len(self.games),
+            "completed_games": sum(1 for game in self.games.values() if game.game_status == "completed"),
+            "listed_games": len(self.directory),
+            "archived_games": self.archive.archived,
+            "archive_cache": len(self.archive),
+            "archive_cache_bytes": self.archive.bytes,
+            "timers": len(self.clock_scheduler),
+            "interned_ids": len(self.id_table.values)
+        }
+    
+    def setup_metrics(self):
+        """Register the server's counters, histograms and gauges"""
+        self.metrics = MetricsRegistry()
+        self.message_latency = self.metrics.histogram(
+            "message_handling_seconds", "Time to decode and handle one client message", ("type",))
+        self.messages_sent = self.metrics.counter(
+            "messages_sent_total", "Messages queued for clients", ("type",))
+        self.timer_lag = self.metrics.histogram(
+            "timer_lag_seconds", "How long after its deadline a timer fired", ("kind",))
+        self.slow_disconnects = self.metrics.counter(
+            "slow_client_disconnects_total", "Clients dropped for not keeping up with their messages")
+        self.connection_bytes = self.metrics.histogram(
+            "connection_bytes", "Bytes transferred by each closed connection", ("direction",), BYTES_BUCKETS)
+        self.closed_traffic = [0, 0]  # bytes [received, sent] by connections that have closed
+        
+        self.metrics.gauge("received_bytes_total", "Bytes received from clients",
+                           lambda: self.closed_traffic[0] + sum(t[0] for t in self.client_traffic.values()),
+                           kind="counter")
+        self.metrics.gauge("sent_bytes_total", "Bytes sent to clients",
+                           lambda: self.closed_traffic[1] + sum(t[1] for t in self.client_traffic.values()),
+                           kind="counter")
+        self.metrics.gauge("connections", "Open client connections", lambda: len(self.clients))
+        self.metrics.gauge("lobby_players", "Players waiting to be matched", lambda: len(self.lobby))
+        self.metrics.gauge("games", "Listed games by status", self.count_games, ("status",))
+        self.metrics.gauge("games_in_memory", "Games held in memory, including recently finished ones",
+                           lambda: len(self.games))
+        self.metrics.gauge("spectators", "Spectators across all listed games",
+                           lambda: sum(entry[1].get("spectator_count", 0) for entry in self.directory.entries.values()))
+        self.metrics.gauge("send_queue_frames", "Frames waiting in all outbound queues",
+                           lambda: sum(map(len, self.client_queues.values())))
+        self.metrics.gauge("send_queue_frames_max", "Frames waiting in the longest outbound queue",
+                           lambda: max(map(len, self.client_queues.values()), default=0))
+        self.metrics.gauge("timers", "Pending scheduler timers", lambda: len(self.clock_scheduler))
+        self.metrics.gauge("resident_memory_bytes", "Resident set size of the process", resident_memory)
+    
+    def count_games(self):
+        """Return {(status,): count} for the listed games"""
+        counts = {}
+        for _, summary in self.directory.entries.values():
+            key = (summary["status"],)
+            counts[key] = counts.get(key, 0) + 1
+        return counts
+    
+    def start_metrics_endpoint(self):
+        """Serve the metrics for scraping, if METRICS_PORT is set"""
+        if not METRICS_PORT:
+            return
+        try:
+            MetricsEndpoint(self.collect_metrics, METRICS_HOST, METRICS_PORT).start()
+        except OSError as e:
+            print(f"Metrics endpoint unavailable: {e}")
+    
+    def collect_metrics(self):
+        """Render the metrics from the endpoint's thread"""
+        with self.lock:
+            return self.metrics.render()
+    
+    def start_profiling(self, duration=PROFILE_DURATION):
+        """Sample the handlers in PROFILED_METHODS for duration seconds, unless a window is already open"""
+        with self.lock:  # Shared by the SIGUSR2 handler and the admin PROFILE message
+            if self.profiler is not None:
+                return
+            # Instance attributes shadow the methods, so nothing is wrapped outside a window
+            self.profiler = SamplingProfiler()
+            for name in self.PROFILED_METHODS:
+                setattr(self, name, self.profiler.wrap(getattr(self, name)))
+            self.profiler.start(duration, self.profiling_finished)
+            print(f"Profiling for {duration:g}s")
+    
+    def stop_profiling(self):
+        """Close the profiling window early"""
+        with self.lock:
+            profiler = self.profiler
+            if profiler is not None:
+                profiler.stop()  # profiling_finished runs without the lock, so this cannot deadlock
+    
+    def profiling_finished(self, profiler):
+        """Unwrap the handlers once a window has closed and its profile is written"""
+        for name in self.PROFILED_METHODS:
+            self.__dict__.pop(name, None)
+        self.last_profile = profiler.summary()
+        self.profiler = None
+        print(f"Profile of {profiler.samples} samples ({self.last_profile['busy_samples']} busy) "
+              f"written to {profiler.path}")
+    
+    def install_profile_signal(self):
+        """Toggle a profiling window with SIGUSR2, e.g. kill -USR2 <pid>"""
+        # Only the main thread may install signal handlers, e.g. not a server started from a test
+        if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGUSR2, self.toggle_profiling)
+    
+    def toggle_profiling(self, signum=None, frame=None):
+        with self.lock:
+            if self.profiler is None:
+                self.start_profiling()
+            else:
+                self.stop_profiling()
     
     def broadcast_to_game(self, game_id, msg_type, data):
         """Send a message to all players and spectators in a game"""
@@ -286,24 +1023,103 @@ class ChessServer:
             return
             
         game = self.games[game_id]
-        recipients = [game.white_player, game.black_player] + game.spectators
         
+        # Number the event so a reconnecting client can ask for what it missed
+        events = self.game_events.get(game_id)
+        if events is None:
+            events = self.game_events[game_id] = ReplayBuffer()
+        data = {**data, "seq": events.next_seq()}
+        if msg_type != TIME_UPDATE:
+            events.add(data["seq"], msg_type, data)
+        
+        recipients = (game.white_player, game.black_player, *game.spectators)
+        if msg_type not in OPTIONAL_MESSAGES:
+            self.fan_out(recipients, msg_type, data, game_id)
+            return
+        
+        # Clients that did not ask for the newer message get what it replaced
+        current, legacy = [], []
+        for client_id in recipients:
+            if client_id in self.clients:
+                (current if msg_type in self.client_features.get(client_id, ()) else legacy).append(client_id)
+        if not legacy:
+            self.fan_out(recipients, msg_type, data, game_id)
+            return
+        self.fan_out(current, msg_type, data)
+        if msg_type == GAME_DELTA:
+            self.fan_out(legacy, GAME_STATE, self.game_snapshot(game))
+        else:
+            for chat_type, chat in legacy_chat_messages(data):
+                self.fan_out(legacy, chat_type, chat)
+    
+    def fan_out(self, recipients, msg_type, data, game_id=None):
+        """Send one message to many clients; game_id is the game it was broadcast to, if any"""
+        # Encode at most once per codec and share the bytes between recipients
+        json_frame = None
+        binary_body = None
         for client_id in recipients:
-            if client_id and client_id in self.clients:
-                self.send_message(client_id, msg_type, data)
+            if not client_id or client_id not in self.clients:
+                continue
+            
+            codec = self.client_codecs.get(client_id)
+            if codec is None:
+                if json_frame is None:
+                    json_frame = create_message(msg_type, data) + b'\n'
+                frame = json_frame
+            else:
+                if binary_body is None:
+                    body, handles = encode_binary_body(msg_type, data, self.id_table)
+                    binary_body = (frame_binary(body), handles)
+                frame = codec.frame(*binary_body)
+            
+            self.enqueue_frame(client_id, msg_type, frame)
     
     def send_message(self, client_id, msg_type, data):
         """Send a message to a specific client"""
         if client_id not in self.clients:
             return
-            
-        client_socket = self.clients[client_id][0]
-        try:
-            message = create_message(msg_type, data)
-            client_socket.sendall(message + b'\n')
-        except Exception as e:
-            print(f"Error sending message to client {client_id}: {e}")
+        
+        self.enqueue_frame(client_id, msg_type, self.encode_message(client_id, msg_type, data))
+    
+    def enqueue_frame(self, client_id, msg_type, frame):
+        """Queue an encoded frame for a client, applying the overflow policy if it has fallen behind"""
+        queue = self.client_queues.get(client_id)
+        if queue is None:
+            return
+        self.messages_sent.inc(msg_type)
+        if queue.put(msg_type, frame):
+            return
+        
+        queue.overflows += 1
+        if queue.overflows > OUTBOUND_MAX_RESYNCS:
+            print(f"Client {client_id} is not keeping up, disconnecting")
+            self.slow_disconnects.inc()
             self.disconnect_client(client_id)
+            return
+        
+        # Replace the backlog with a fresh snapshot of the client's game
+        queue.clear()
+        codec = self.client_codecs.get(client_id)
+        if codec is not None:
+            codec.forget_sent_ids()  # Discarded frames may have carried INTERN definitions
+        self.queue_snapshot(client_id)
+        
+        if msg_type not in (GAME_STATE, GAME_DELTA, TIME_UPDATE):
+            # Not covered by the snapshot; these frames never carry interned ids
+            queue.put(msg_type, frame)
+    
+    def queue_snapshot(self, client_id):
+        """Queue a full GAME_STATE of the client's game"""
+        game = self.games.get(self.client_game.get(client_id))
+        if game is not None:
+            self.send_message(client_id, GAME_STATE, self.game_snapshot(game))
+    
+    def encode_message(self, client_id, msg_type, data):
+        """Encode a complete frame for a client in its negotiated codec"""
+        codec = self.client_codecs.get(client_id)
+        if codec is not None:
+            return codec.encode(msg_type, data)
+        return create_message(msg_type, data) + b'\n'
     
     def disconnect_client(self, client_id):
         """Handle client disconnection"""
@@ -312,6 +1128,41 @@ class ChessServer:
             
         print(f"Client {client_id} ({self.clients[client_id][2]}) disconnected")
         
+        # A player with a session keeps their seat for a while in case they reconnect
+        session = self.sessions.for_client(client_id)
+        detached = session is not None and not session.detached
+        if detached:
+            self.detach_session(session)
+        else:
+            self.leave(client_id)
+        
+        # Close the socket and remove the client; an overflowing queue during
+        # the broadcast above may already have done so
+        client = self.clients.pop(client_id, None)
+        if client is not None:
+            self.close_connection(client[0])
+        
+        queue = self.client_queues.pop(client_id, None)
+        if queue is not None:
+            queue.close()
+        
+        if not detached:
+            self.client_game.pop(client_id, None)
+        self.client_codecs.pop(client_id, None)
+        self.client_features.pop(client_id, None)
+        if self.sessions.for_client(client_id) is None:
+            self.release_id(client_id)  # A held session frees it once it expires or resumes
+        
+        traffic = self.client_traffic.pop(client_id, None)
+        if traffic is not None:
+            for direction, count in enumerate(traffic):
+                self.closed_traffic[direction] += count
+                self.connection_bytes.observe(count, ("received", "sent")[direction])
+    
+    def leave(self, client_id):
+        """Take a departed client out of the lobby and its game, forfeiting any game it was playing"""
+        self.chat_limiter.forget(client_id)
+        
         # Remove from lobby if present
         if client_id in self.lobby:
             self.lobby.remove(client_id)
@@ -323,12 +1174,23 @@ class ChessServer:
             
             # If player is a spectator, just remove them
             if client_id in game.spectators:
-                game.spectators.remove(client_id)
+                game.spectators.discard(client_id)
+                self.game_updated(game)
+            elif game.game_status == "waiting":
+                # Nobody can take the seat of a creator who has left
+                game.end_game()
+                self.broadcast_to_game(game_id, GAME_OVER, {
+                    "reason": "The game was abandoned before it started",
+                    "game_state": game.get_game_state()
+                })
+                self.game_completed(game, "Abandoned")
+            elif game_id in self.orphaned_games:
+                # Neither player came back after a restart; nobody lost
+                if game.game_status == "active":
+                    self.abort_game(game)
             else:
                 # If player is white or black, end the game
                 if game.game_status == "active":
-                    game.game_status = "completed"
-                    
                     # Determine winner
                     if client_id == game.white_player:
                         winner = "black"
@@ -337,21 +1199,26 @@ class ChessServer:
                         winner = "white"
                         reason = "Black player disconnected. White wins!"
                     
+                    game.end_game("0-1" if winner == "black" else "1-0")
+                    self.schedule_clock(game)
+                    
                     # Notify remaining players and spectators
                     self.broadcast_to_game(game_id, GAME_OVER, {
                         "reason": reason,
                         "game_state": game.get_game_state()
                     })
-        
-        # Close the socket and remove the client
+                    self.game_completed(game, reason)
+    
+    def close_connection(self, conn):
+        """Close a client socket, waking its reader thread"""
         try:
-            self.clients[client_id][0].close()
-        except:
+            conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            conn.close()
+        except OSError:
             pass
-        
-        del self.clients[client_id]
-        if client_id in self.client_game:
-            del self.client_game[client_id]
 
 if __name__ == "__main__":
     server = ChessServer()
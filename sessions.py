@@ -0,0 +1,91 @@
+import collections
+import secrets
+from config import REPLAY_BUFFER_SIZE
+
+class Session:
+    """A player's identity across connections, so a dropped connection can be resumed"""
+    __slots__ = ("token", "client_id", "player_name", "lobby", "in_lobby", "detached")
+
+    def __init__(self, token, client_id, player_name):
+        self.token = token
+        self.client_id = client_id      # id of the session's current (or last) connection
+        self.player_name = player_name
+        self.lobby = None               # (time_control, rating) of the last JOIN_LOBBY
+        self.in_lobby = False           # waiting in the lobby when the connection dropped
+        self.detached = False           # connection lost, seat held until the grace period ends
+
+class SessionTable:
+    """Sessions by token and by the client id currently holding them"""
+    def __init__(self):
+        self.by_token = {}
+        self.by_client = {}
+
+    def __len__(self):
+        return len(self.by_token)
+
+    def create(self, client_id, player_name):
+        """Issue a session for a connection, replacing any it already had"""
+        self.remove(self.by_client.get(client_id))
+        session = Session(secrets.token_urlsafe(16), client_id, player_name)
+        self.by_token[session.token] = session
+        self.by_client[client_id] = session
+        return session
+
+    def restore(self, token, client_id, player_name):
+        """Recreate a session recovered from the journal, detached until its player resumes it"""
+        self.remove(self.by_token.get(token))
+        session = Session(token, client_id, player_name)
+        session.detached = True
+        self.by_token[token] = session
+        self.by_client[client_id] = session
+        return session
+
+    def get(self, token):
+        return self.by_token.get(token) if isinstance(token, str) else None
+
+    def for_client(self, client_id):
+        return self.by_client.get(client_id)
+
+    def rebind(self, session, client_id):
+        """Move a session to a new connection, replacing any the connection already had"""
+        if self.by_client.get(client_id) not in (None, session):
+            self.remove(self.by_client[client_id])
+        if self.by_client.get(session.client_id) is session:
+            del self.by_client[session.client_id]
+        session.client_id = client_id
+        self.by_client[client_id] = session
+
+    def remove(self, session):
+        if session is None:
+            return
+        self.by_token.pop(session.token, None)
+        if self.by_client.get(session.client_id) is session:
+            del self.by_client[session.client_id]
+
+class ReplayBuffer:
+    """Sequence numbers for a game's broadcasts, and its most recent events for replay.
+
+    TIME_UPDATEs are numbered but not kept: a resuming client is sent the current
+    clocks instead.
+    """
+    __slots__ = ("seq", "events", "floor")
+
+    def __init__(self, size=REPLAY_BUFFER_SIZE):
+        self.seq = 0
+        self.events = collections.deque(maxlen=size)  # [(seq, msg_type, data)]
+        self.floor = 1  # every kept event from this seq on is still buffered
+
+    def next_seq(self):
+        self.seq += 1
+        return self.seq
+
+    def add(self, seq, msg_type, data):
+        if len(self.events) == self.events.maxlen:
+            self.floor = self.events[0][0] + 1
+        self.events.append((seq, msg_type, data))
+
+    def since(self, seq):
+        """Return the (msg_type, data) of every kept event after seq, or None if some have been dropped"""
+        if seq + 1 < self.floor:
+            return None
+        return [(msg_type, data) for event_seq, msg_type, data in self.events if event_seq > seq]
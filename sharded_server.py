@@ -0,0 +1,365 @@
+import asyncio
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import uuid
+import zlib
+from communication import *
+from server import ChessServer
+from async_server import AsyncChessServer
+from config import *
+
+# Commands from the front process to a shard
+REGISTER_CLIENT = "register_client"  # (client_id, player_name, session token or None, features)
+CLIENT_MESSAGE = "client_message"    # (client_id, msg_type, data)
+START_GAME = "start_game"            # (game_id, white_player, black_player, time_control)
+NEW_GAME = "new_game"                # (game_id, client_id)
+CLIENT_LEFT = "client_left"          # (client_id,)
+CLIENT_DETACHED = "client_detached"  # (client_id,) lost its connection but may resume
+CLIENT_RESUMED = "client_resumed"    # (old client_id, new client_id, seq to replay from or None, features)
+
+# Events from a shard to the front process
+SEND = "send"                        # (client_id, msg_type, data)
+FAN_OUT = "fan_out"                  # (game_id, recipients or None if unchanged since the last one, msg_type, data)
+GAME_SUMMARY = "game_summary"        # (game_id, GAMES_LIST entry, or None once the game is evicted)
+SEAT_RECOVERED = "seat_recovered"    # (client_id, session token, player_name) of a seat in a recovered game
+
+# Messages the front can answer itself; everything else belongs to the client's game
+FRONT_MESSAGES = {JOIN_LOBBY, LIST_GAMES, CREATE_GAME, PROFILE, RESUME_SESSION}
+
+class PipeSender:
+    """Writes to one end of a pipe from a thread of its own, so the caller never blocks.
+
+    Front and shard each read their end of the pipe from a single loop. If that loop
+    also wrote with a blocking send, two full pipe buffers would leave both sides
+    waiting to write and neither reading. Messages are pickled by the caller, so they
+    are sent as they were at the time.
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.queue = queue.SimpleQueue()
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def send(self, message):
+        self.queue.put(pickle.dumps(message, pickle.HIGHEST_PROTOCOL))
+
+    def run(self):
+        while True:
+            payload = self.queue.get()
+            try:
+                self.conn.send_bytes(payload)  # Read back with Connection.recv()
+            except OSError:
+                return  # The other side has gone
+
+class ShardServer(ChessServer):
+    """Worker process that owns a subset of the games.
+
+    Clients live in the front process; here they are only ids and names, and every
+    message for them is handed back to the front over the pipe to be encoded and sent.
+    """
+    PROFILED_METHODS = ("handle_command", "update_games", "broadcast_to_game", "send_message")
+
+    def __init__(self, conn, shard_index):
+        # Set before recovery, which reports the recovered games to the front
+        self.conn = conn
+        self.sender = PipeSender(conn)
+        self.shard_index = shard_index
+        self.sent_recipients = {}  # {game_id: recipients the front was last given for the game}
+        self.client_tokens = {}  # {client_id: session token}, for journaling seats; sessions live in the front
+        journal_path = f"{JOURNAL_PATH}.{shard_index}" if JOURNAL_PATH else None
+        archive_path = None
+        if ARCHIVE_PATH:
+            root, ext = os.path.splitext(ARCHIVE_PATH)
+            archive_path = f"{root}.{shard_index}{ext}"
+        super().__init__(listen=False, journal_path=journal_path, archive_path=archive_path)
+
+    def run(self):
+        """Process commands from the front until it goes away"""
+        self.install_profile_signal()
+        clock_thread = threading.Thread(target=self.run_clock_scheduler)
+        clock_thread.daemon = True
+        clock_thread.start()
+
+        try:
+            while True:
+                command, *args = self.conn.recv()
+                with self.lock:
+                    self.handle_command(command, args)
+        except (EOFError, KeyboardInterrupt):
+            pass
+        finally:
+            self.close_journal()
+
+    def handle_command(self, command, args):
+        """Apply a command from the front process"""
+        if command == REGISTER_CLIENT:
+            client_id, player_name, token, features = args
+            self.clients[client_id] = (None, None, player_name)
+            self.client_features[client_id] = features
+            if token is not None:
+                self.client_tokens[client_id] = token
+
+        elif command == CLIENT_MESSAGE:
+            # Clients' frames are decoded in the front, so time just the handling here
+            client_id, msg_type, data = args
+            if client_id in self.clients:
+                start = time.perf_counter()
+                self.handle_message(client_id, msg_type, data)
+                self.message_latency.observe(time.perf_counter() - start, message_label(msg_type))
+
+        elif command == START_GAME:
+            self.start_game(*args)
+
+        elif command == NEW_GAME:
+            game_id, client_id = args
+            self.create_game(client_id, game_id)
+
+        elif command == CLIENT_LEFT:
+            self.disconnect_client(*args)
+            self.client_tokens.pop(args[0], None)
+            self.client_features.pop(args[0], None)
+
+        elif command == CLIENT_DETACHED:
+            self.player_detached(*args)
+
+        elif command == CLIENT_RESUMED:
+            old_id, client_id, seq, features = args
+            client = self.clients.pop(old_id, None)
+            if client is not None:
+                self.clients[client_id] = client
+                self.client_features.pop(old_id, None)
+                self.client_features[client_id] = features
+                if old_id in self.client_tokens:
+                    self.client_tokens[client_id] = self.client_tokens.pop(old_id)
+                self.rejoin_game(old_id, client_id, seq)
+
+    def send_message(self, client_id, msg_type, data):
+        """Hand a message for one client to the front"""
+        if client_id in self.clients:
+            self.sender.send((SEND, client_id, msg_type, data))
+
+    def fan_out(self, recipients, msg_type, data, game_id=None):
+        """Hand a broadcast to the front, which encodes it once for every recipient.
+
+        The front remembers each game's recipients, so they are only sent when they change.
+        """
+        recipients = frozenset(client_id for client_id in recipients if client_id and client_id in self.clients)
+        if game_id is None:
+            self.sender.send((FAN_OUT, None, recipients, msg_type, data))
+        elif self.sent_recipients.get(game_id) != recipients:
+            self.sent_recipients[game_id] = recipients
+            self.sender.send((FAN_OUT, game_id, recipients, msg_type, data))
+        else:
+            self.sender.send((FAN_OUT, game_id, None, msg_type, data))
+
+    def game_updated(self, game):
+        """Keep the front's game directory in sync"""
+        self.sender.send((GAME_SUMMARY, game.game_id, self.summarize_game(game)))
+
+    def evict_game(self, game_id):
+        """Let the front forget an evicted game too"""
+        super().evict_game(game_id)
+        self.sent_recipients.pop(game_id, None)
+        self.sender.send((GAME_SUMMARY, game_id, None))
+
+    def close_connection(self, conn):
+        """Connections are owned by the front process"""
+        pass
+
+    def session_token(self, client_id):
+        return self.client_tokens.get(client_id)
+
+    def hold_session(self, client_id, token, player_name):
+        """Know a recovered seat's player here, and have the front hold their session"""
+        self.clients[client_id] = (None, None, player_name)
+        self.client_tokens[client_id] = token
+        self.sender.send((SEAT_RECOVERED, client_id, token, player_name))
+
+def run_shard(conn, shard_index):
+    """Entry point of a shard worker process"""
+    ShardServer(conn, shard_index).run()
+
+class ShardedChessServer(AsyncChessServer):
+    """Front process that owns client sockets and the lobby and routes games to worker processes.
+
+    Move validation runs in the shards, so it is spread across CPU cores instead of
+    contending on one GIL.
+    """
+    def __init__(self, host=SERVER_HOST, port=SERVER_PORT, shard_count=SHARD_COUNT):
+        # Start the workers before binding so they don't inherit the listening socket
+        context = multiprocessing.get_context("spawn")
+        self.shards = []  # [(Connection, Process)]
+        for index in range(shard_count or os.cpu_count() or 1):
+            conn, worker_conn = context.Pipe()
+            process = context.Process(target=run_shard, args=(worker_conn, index), daemon=True)
+            process.start()
+            worker_conn.close()
+            self.shards.append((conn, process))
+        self.shard_senders = [PipeSender(conn) for conn, _ in self.shards]
+
+        # Games, their journals and archives live in the shards
+        super().__init__(host, port, journal_path=None, archive_path=None)
+
+        self.game_shard = {}      # {game_id: shard index}
+        self.client_shard = {}    # {client_id: shard index of the client's current game}
+        self.client_shards = {}   # {client_id: every shard the client is registered with}
+        self.game_recipients = {} # {game_id: recipients of the game's last FAN_OUT}
+
+        print(f"Routing games to {len(self.shards)} shard processes")
+
+    async def serve(self):
+        """Listen for shard events alongside client connections"""
+        loop = asyncio.get_running_loop()
+        for index, (conn, _) in enumerate(self.shards):
+            loop.add_reader(conn.fileno(), self.read_shard, index)
+        await super().serve()
+
+    def read_shard(self, index):
+        """Dispatch every event a shard has sent"""
+        conn = self.shards[index][0]
+        try:
+            while conn.poll():
+                event, *args = conn.recv()
+                self.handle_shard_event(index, event, args)
+        except EOFError:
+            print(f"Shard {index} exited")
+            asyncio.get_running_loop().remove_reader(conn.fileno())
+
+    def handle_shard_event(self, index, event, args):
+        """Apply an event from a shard"""
+        if event == SEND:
+            self.send_message(*args)
+
+        elif event == FAN_OUT:
+            game_id, recipients, msg_type, data = args
+            if recipients is None:
+                recipients = self.game_recipients.get(game_id, ())
+            elif game_id is not None:
+                self.game_recipients[game_id] = recipients
+            self.fan_out(recipients, msg_type, data)
+
+        elif event == GAME_SUMMARY:
+            # Also how the front learns about games a shard recovered from its journal
+            game_id, summary = args
+            if summary is None:
+                self.game_shard.pop(game_id, None)
+                self.game_recipients.pop(game_id, None)
+                self.release_id(game_id)
+            else:
+                self.game_shard[game_id] = index
+            self.directory.update(game_id, summary)
+
+        elif event == SEAT_RECOVERED:
+            # The shard holds the seat; the session, and so its expiry, lives here
+            client_id, token, player_name = args
+            self.hold_session(client_id, token, player_name)
+            self.client_shard[client_id] = index
+            self.client_shards[client_id] = {index}
+            self.wake_clock_scheduler()
+
+    def shard_for(self, game_id):
+        """Pick the shard that owns a game"""
+        return zlib.crc32(game_id.encode()) % len(self.shards)
+
+    def send_to_shard(self, index, *command):
+        self.shard_senders[index].send(command)
+
+    def register_client(self, client_id, game_id):
+        """Make sure the shard owning game_id knows the client, returning the shard's index"""
+        index = self.game_shard[game_id]
+        if index not in self.client_shards.setdefault(client_id, set()):
+            self.client_shards[client_id].add(index)
+            self.send_to_shard(index, REGISTER_CLIENT, client_id, self.clients[client_id][2],
+                               self.session_token(client_id), self.client_features.get(client_id, frozenset()))
+        return index
+
+    def route_client(self, client_id, game_id):
+        """Make the shard owning game_id the destination of a client's game messages"""
+        index = self.register_client(client_id, game_id)
+        self.client_shard[client_id] = index
+        return index
+
+    def handle_message(self, client_id, msg_type, data):
+        """Answer lobby messages here and forward game messages to the owning shard"""
+        if msg_type in FRONT_MESSAGES:
+            super().handle_message(client_id, msg_type, data)
+        elif msg_type in (SPECTATE_GAME, RELAY_SUBSCRIBE):
+            self.handle_spectate(client_id, msg_type, data)
+        elif msg_type == CHAT_HISTORY:
+            self.handle_chat_history(client_id, data)
+        elif client_id in self.client_shard:
+            self.send_to_shard(self.client_shard[client_id], CLIENT_MESSAGE, client_id, msg_type, data)
+
+    def start_game(self, game_id, white_player, black_player, time_control=DEFAULT_TIME_LIMIT):
+        """Hand a newly matched game to its shard"""
+        self.game_shard[game_id] = self.shard_for(game_id)
+        self.route_client(white_player, game_id)
+        index = self.route_client(black_player, game_id)
+        self.send_to_shard(index, START_GAME, game_id, white_player, black_player, time_control)
+
+    def create_game(self, client_id, game_id=None):
+        """Hand a game waiting for an opponent to its shard"""
+        game_id = game_id or str(uuid.uuid4())
+        self.game_shard[game_id] = self.shard_for(game_id)
+        index = self.route_client(client_id, game_id)
+        self.send_to_shard(index, NEW_GAME, game_id, client_id)
+
+    def handle_spectate(self, client_id, msg_type, data):
+        """Forward a spectate or relay subscription to the shard that owns the game"""
+        game_id = data.get("game_id")
+        if game_id not in self.game_shard:
+            self.send_message(client_id, ERROR, {"message": "Game not found. Please check the game ID."})
+            return
+        self.negotiate_features(client_id, data.get("features"))
+        index = self.route_client(client_id, game_id)
+        self.send_to_shard(index, CLIENT_MESSAGE, client_id, msg_type, data)
+
+    def handle_chat_history(self, client_id, data):
+        """Forward CHAT_HISTORY to the shard that owns the game; any game's history can be read"""
+        game_id = data.get("game_id")
+        if game_id in self.game_shard:
+            index = self.register_client(client_id, game_id)
+        elif game_id is None and client_id in self.client_shard:
+            index = self.client_shard[client_id]
+        else:
+            self.send_message(client_id, ERROR, {"message": "Game not found. Please check the game ID."})
+            return
+        self.send_to_shard(index, CLIENT_MESSAGE, client_id, CHAT_HISTORY, data)
+
+    def queue_snapshot(self, client_id):
+        """Ask the client's shard for a fresh GAME_STATE"""
+        if client_id in self.client_shard:
+            self.send_to_shard(self.client_shard[client_id], CLIENT_MESSAGE, client_id, REQUEST_STATE, {})
+
+    def leave(self, client_id):
+        """Drop the client here and in every shard that knows it"""
+        super().leave(client_id)
+        self.client_shard.pop(client_id, None)
+        for index in self.client_shards.pop(client_id, ()):
+            self.send_to_shard(index, CLIENT_LEFT, client_id)
+
+    def player_detached(self, client_id):
+        """Let the shard running the client's game announce the dropped connection"""
+        if client_id in self.client_shard:
+            self.send_to_shard(self.client_shard[client_id], CLIENT_DETACHED, client_id)
+
+    def rejoin_game(self, old_id, client_id, seq):
+        """Rename the client in every shard that knows it; its game's shard also replays from seq"""
+        index = self.client_shard.pop(old_id, None)
+        if index is not None:
+            self.client_shard[client_id] = index
+        shards = self.client_shards.pop(old_id, set())
+        if shards:
+            self.client_shards[client_id] = shards
+        features = self.client_features.get(client_id, frozenset())
+        for shard in shards:
+            self.send_to_shard(shard, CLIENT_RESUMED, old_id, client_id, seq if shard == index else None, features)
+
+if __name__ == "__main__":
+    server = ShardedChessServer()
+    server.start()
@@ -0,0 +1,90 @@
+import hashlib
+import os
+from PIL import Image, ImageDraw, ImageFont
+from PIL.PngImagePlugin import PngInfo
+from config import SQUARE_SIZE, SPRITE_CACHE_DIR
+
+SPRITE_VERSION = 1  # bump when the rendering changes, so cached sheets are not reused
+
+PIECE_CHARS = {
+    'p': '♟', 'n': '♞', 'b': '♝', 'r': '♜', 'q': '♛', 'k': '♚',
+    'P': '♙', 'N': '♘', 'B': '♗', 'R': '♖', 'Q': '♕', 'K': '♔'
+}
+PIECE_CODES = tuple(PIECE_CHARS)
+BACKGROUND_COLORS = {"light": (240, 217, 181), "dark": (181, 136, 99)}
+
+# Fonts that usually have chess symbols, in order of preference
+FONT_CANDIDATES = ("DejaVuSans.ttf", "Arial Unicode.ttf", "segoeui.ttf", "seguisym.ttf")
+
+def sprite_size(square_size=SQUARE_SIZE):
+    return square_size - 10
+
+def find_font(size, candidates=FONT_CANDIDATES):
+    """Return (font, name) for the first candidate installed, or Pillow's default font"""
+    for font_name in candidates:
+        try:
+            return ImageFont.truetype(font_name, size), font_name
+        except OSError:
+            continue
+    return ImageFont.load_default(), "default"
+
+def render_sheet(size, candidates=FONT_CANDIDATES):
+    """Render every piece on both square colours into one sheet: a column per piece, a row per colour"""
+    font, font_name = find_font(size - 10, candidates)
+    sheet = Image.new('RGB', (size * len(PIECE_CODES), size * len(BACKGROUND_COLORS)))
+    draw = ImageDraw.Draw(sheet)
+
+    for row, background in enumerate(BACKGROUND_COLORS.values()):
+        draw.rectangle((0, row * size, sheet.width, (row + 1) * size), fill=background)
+        for column, piece_code in enumerate(PIECE_CODES):
+            x, y = column * size, row * size
+            char = PIECE_CHARS[piece_code] if font_name != "default" else piece_code
+            left, top, right, bottom = draw.textbbox((0, 0), char, font=font)
+            position = (x + (size - (right - left)) // 2 - left, y + (size - (bottom - top)) // 2 - top)
+            color = "white" if piece_code.islower() else "black"
+            draw.text(position, char, fill=color, font=font)
+
+    return sheet, font_name
+
+def sheet_path(size, candidates=FONT_CANDIDATES, directory=SPRITE_CACHE_DIR):
+    """Return where the sheet for a sprite size and font list is cached"""
+    fonts = hashlib.sha1("|".join(candidates).encode()).hexdigest()[:8]
+    return os.path.join(directory, f"pieces-{size}-{fonts}-v{SPRITE_VERSION}.png")
+
+def load_sheet(size, candidates=FONT_CANDIDATES, directory=SPRITE_CACHE_DIR):
+    """Return the sprite sheet, read from the cache or rendered and cached on first use"""
+    path = sheet_path(size, candidates, directory) if directory else None
+    if path is not None:
+        try:
+            with Image.open(path) as cached:
+                # A sheet drawn in the default font (letters) is redone once a symbol font is installed
+                fallback = cached.text.get("font") == "default"
+                if (cached.size == (size * len(PIECE_CODES), size * len(BACKGROUND_COLORS)) and
+                        (not fallback or find_font(size - 10, candidates)[1] == "default")):
+                    return cached.convert('RGB')
+        except (OSError, ValueError):
+            pass  # Missing or unreadable; render it again
+
+    sheet, font_name = render_sheet(size, candidates)
+    if path is not None:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            info = PngInfo()
+            info.add_text("font", font_name)
+            partial = f"{path}.{os.getpid()}.tmp"
+            sheet.save(partial, format="PNG", pnginfo=info)
+            os.replace(partial, path)  # Another client starting at once never sees half a file
+        except OSError as e:
+            print(f"Could not cache piece sprites: {e}")
+    return sheet
+
+def load_sprites(square_size=SQUARE_SIZE, directory=SPRITE_CACHE_DIR):
+    """Return {"<piece>_<light|dark>": image} for every piece on both square colours"""
+    size = sprite_size(square_size)
+    sheet = load_sheet(size, directory=directory)
+    sprites = {}
+    for row, background in enumerate(BACKGROUND_COLORS):
+        for column, piece_code in enumerate(PIECE_CODES):
+            x, y = column * size, row * size
+            sprites[f"{piece_code}_{background}"] = sheet.crop((x, y, x + size, y + size))
+    return sprites
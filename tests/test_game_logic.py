@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from game_logic import ChessGame
+
+def play(moves):
+    """Start a game and play moves, returning the game and the result of the last one"""
+    game = ChessGame("game", "white", "black")
+    game.start_clock()
+    outcome = None
+    for move in moves:
+        outcome = game.make_move(move, "white" if game.white_to_move() else "black")
+        assert outcome[0], outcome
+    return game, outcome
+
+class CheckmateTest(unittest.TestCase):
+    def test_black_mate_is_scored_for_black(self):
+        game, (_, message) = play(["f2f3", "e7e5", "g2g4", "d8h4"])
+        self.assertEqual(game.game_status, "completed")
+        self.assertEqual(game.result, "0-1")
+        self.assertEqual(message, "Checkmate. Black wins!")
+
+    def test_white_mate_is_scored_for_white(self):
+        game, (_, message) = play(["e2e4", "e7e5", "f1c4", "b8c6", "d1h5", "g8f6", "h5f7"])
+        self.assertEqual(game.result, "1-0")
+        self.assertEqual(message, "Checkmate. White wins!")
+
+class RepetitionTest(unittest.TestCase):
+    KNIGHT_SHUFFLE = ["g1f3", "g8f6", "f3g1", "f6g8"]
+
+    def test_threefold_can_be_claimed(self):
+        game, _ = play(self.KNIGHT_SHUFFLE * 2)
+        self.assertEqual(game.game_status, "active")
+        self.assertEqual(game.claim_draw("white"), (True, "Draw claimed by threefold repetition."))
+        self.assertEqual(game.result, "1/2-1/2")
+
+    def test_fivefold_ends_the_game(self):
+        game, (_, message) = play(self.KNIGHT_SHUFFLE * 4)
+        self.assertEqual(game.game_status, "completed")
+        self.assertEqual(message, "Game drawn by fivefold repetition.")
+
+if __name__ == "__main__":
+    unittest.main()
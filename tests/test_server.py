@@ -0,0 +1,51 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from communication import *
+from game_logic import ChessGame
+from server import ChessServer
+from config import *
+
+class HandlerTest(unittest.TestCase):
+    """Drive ChessServer.handle_message without sockets, recording what it sends"""
+    def setUp(self):
+        self.server = ChessServer(listen=False, journal_path=None, archive_path=None)
+        self.sent = []
+        self.server.send_message = lambda client_id, msg_type, data: self.sent.append((client_id, msg_type, data))
+        self.server.add_client("a", None, None)
+
+    def receive(self, client_id, msg_type, data_json):
+        """Handle a message whose data is given as the JSON text a client would send"""
+        msg_type, data = parse_message(f'{{"type": "{msg_type}", "data": {data_json}}}'.encode())
+        self.server.handle_message(client_id, msg_type, data)
+
+    def test_non_finite_rating_falls_back_to_default(self):
+        self.receive("a", JOIN_LOBBY, '{"player_name": "A", "rating": Infinity}')
+        self.assertEqual(self.server.lobby.players["a"][1], DEFAULT_RATING // RATING_BAND_WIDTH)
+
+    def test_unlisted_status_is_refused(self):
+        for status in ('["active"]', '{"a": 1}', '"completed"'):
+            self.sent.clear()
+            self.receive("a", LIST_GAMES, f'{{"status": {status}}}')
+            self.assertEqual([msg_type for _, msg_type, _ in self.sent], [ERROR])
+
+    def test_listed_status_is_answered(self):
+        self.receive("a", LIST_GAMES, '{"status": "waiting"}')
+        self.assertEqual([msg_type for _, msg_type, _ in self.sent], [GAMES_LIST])
+
+    def test_chat_history_checks_types_before_the_lookup(self):
+        self.server.games["g"] = ChessGame("g", "a", "b")
+        for data_json in ('{"game_id": ["g"]}', '{"game_id": {"g": 1}}', '{"game_id": "g", "before": "x"}'):
+            self.sent.clear()
+            self.receive("a", CHAT_HISTORY, data_json)
+            self.assertEqual([msg_type for _, msg_type, _ in self.sent], [ERROR])
+
+        self.sent.clear()
+        self.receive("a", CHAT_HISTORY, '{"game_id": "g", "before": 10}')
+        self.assertEqual([msg_type for _, msg_type, _ in self.sent], [CHAT_HISTORY])
+
+if __name__ == "__main__":
+    unittest.main()